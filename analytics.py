@@ -0,0 +1,292 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+import psycopg2
+import api
+import library as lib
+
+# Numeric columns exported from the order tables, as (name, type). They are
+# fixed-width and NOT NULL, so a binary COPY of them is an array of records.
+export_columns = {
+    "orders":       (("id", "integer"), ("branch_id", "integer"), ("customer_id", "integer"),
+                     ("order_date", "date"), ("total_cost", "real")),
+    "order_foods":  (("order_id", "integer"), ("food_id", "integer")),
+    "food":         (("id", "integer"), ("branch_id", "integer"), ("chef_id", "integer"), ("cost", "real")),
+    "employee":     (("id", "integer"), ("branch_id", "integer")),
+    "calendar":     (("date", "date"), ("year", "smallint"), ("quarter", "smallint"), ("month", "smallint"),
+                     ("week", "smallint"), ("weekday", "smallint"), ("holiday", "boolean"))
+}
+
+# Id and text columns of the small tables the reports name things with
+export_labels = {
+    "branch":       (("id", "name"), "SELECT id, name FROM branch"),
+    "person":       (("id", "full_name", "phone_number"),
+                     "SELECT id, first_name || ' ' || last_name, phone_number FROM person")
+}
+
+# Binary COPY layout of each exported type, PostgreSQL sends big-endian
+_binary_types = {"integer": ">i4", "smallint": ">i2", "real": ">f4", "date": ">i4", "boolean": "|b1"}
+
+# Size of the binary COPY header and trailer
+_COPY_HEADER = 19
+_COPY_TRAILER = 2
+
+# Days between the NumPy and the PostgreSQL date epochs
+_EPOCH_DAYS = 10957
+
+# Rows converted at a time while the columns are written
+_CHUNK_ROWS = 1 << 20
+
+# Split the binary COPY of a table into one memory-mappable .npy file per column
+def _write_columns(copy_file, directory, table_name):
+
+    columns = export_columns[table_name]
+    record = np.dtype([("fields", ">i2")] + [
+        field for name, column_type in columns for field in (("length_" + name, ">i4"), (name, _binary_types[column_type]))])
+
+    size = os.path.getsize(copy_file)
+    rows = (size - _COPY_HEADER - _COPY_TRAILER) // record.itemsize
+    records = np.memmap(copy_file, dtype=record, mode="r", offset=_COPY_HEADER, shape=(rows,))
+
+    for name, column_type in columns:
+        dtype = "datetime64[D]" if column_type == "date" else _binary_types[column_type].replace(">", "<").replace("|", "")
+        output = np.lib.format.open_memmap(
+            os.path.join(directory, "{0}.{1}.npy".format(table_name, name)), mode="w+", dtype=dtype, shape=(rows,))
+        for start in range(0, rows, _CHUNK_ROWS):
+            values = records[name][start:start + _CHUNK_ROWS]
+            if column_type == "date":
+                output[start:start + _CHUNK_ROWS] = (values.astype("<i8") + _EPOCH_DAYS).astype("datetime64[D]")
+            else:
+                output[start:start + _CHUNK_ROWS] = values
+        output.flush()
+        del output
+
+    del records
+    return rows
+
+# Export the order tables as columnar .npy files and the labels of branches
+# and people, all from one snapshot so the files agree with each other.
+# The export reads a replica when one is usable, keeping the load off the
+# primary, unless 'primary' is set.
+def export(directory, primary=False):
+
+    os.makedirs(directory, exist_ok=True)
+    manifest = {"tables": {}}
+    start = time.perf_counter()
+
+    with lib.get_connection(read_only=not primary) as conn:
+        cur = conn.cursor()
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+
+        for table_name, columns in export_columns.items():
+            copy_file = os.path.join(directory, table_name + ".copy")
+            with open(copy_file, "wb") as output:
+                # The calendar is looked up by binary search, in date order
+                cur.copy_expert("COPY (SELECT {0} FROM {1}{2}) TO STDOUT WITH (FORMAT binary)".format(
+                    ", ".join(name for name, _ in columns), table_name,
+                    " ORDER BY date" if table_name == "calendar" else ""), output, size=1 << 20)
+            manifest["tables"][table_name] = _write_columns(copy_file, directory, table_name)
+            os.remove(copy_file)
+
+        for table_name, (columns, query) in export_labels.items():
+            cur.execute(query)
+            rows = cur.fetchall()
+            for name, values in zip(columns, zip(*rows) if rows else [()] * len(columns)):
+                array = np.array(values, dtype=np.int32 if name == "id" else str)
+                np.save(os.path.join(directory, "{0}.{1}.npy".format(table_name, name)), array)
+            manifest["tables"][table_name] = len(rows)
+
+        cur.close()
+
+    manifest["seconds"] = time.perf_counter() - start
+    with open(os.path.join(directory, "manifest.json"), "w") as output:
+        json.dump(manifest, output, indent=2)
+
+    return manifest
+
+# Memory-map an export as {table: {column: array}}
+def load(directory):
+
+    data = {}
+    for file_name in os.listdir(directory):
+        if file_name.endswith(".npy"):
+            table_name, column = file_name[:-4].split(".", 1)
+            data.setdefault(table_name, {})[column] = np.load(os.path.join(directory, file_name), mmap_mode="r")
+    return data
+
+# Map ids to positions of a sorted id column
+def _positions(ids, keys):
+    order = np.argsort(ids)
+    return order[np.searchsorted(ids, keys, sorter=order)]
+
+# Values of a label column for ids
+def _labels(data, table_name, column, ids):
+    table = data[table_name]
+    return table[column][_positions(table["id"], ids)]
+
+# Count and the sums of every 'values' column grouped by one key column or a
+# tuple of them, as (groups, counts, sums...).
+# Every key column is factorized and the codes combined into one integer,
+# which sorts far faster than rows of keys.
+def _group(keys, *values):
+    columns = keys if isinstance(keys, tuple) else (keys,)
+    uniques, codes = zip(*(np.unique(column, return_inverse=True) for column in columns))
+    combined = np.ravel_multi_index([code.reshape(-1) for code in codes], [len(unique) for unique in uniques])
+    present, inverse = np.unique(combined, return_inverse=True)
+    groups = [unique[code] for unique, code in zip(uniques, np.unravel_index(present, [len(unique) for unique in uniques]))]
+    counts = np.bincount(inverse, minlength=len(present))
+    sums = [np.bincount(inverse, weights=column, minlength=len(present)) for column in values]
+    return ((tuple(groups) if isinstance(keys, tuple) else groups[0]), counts, *sums)
+
+# Jalali period numbers of dates, looked up in the exported calendar:
+# the year, or year * 100 + the quarter, month or week
+def periods(data, dates, period="year"):
+    calendar = data["calendar"]
+    positions = np.searchsorted(calendar["date"], dates)
+    years = calendar["year"][positions].astype(np.int64)
+    if period == "year":
+        return years
+    return years * 100 + calendar[period][positions]
+
+# Order count and revenue per branch and Jalali period, as rows of
+# (branch id, period, order count, revenue), for orders on or after the
+# Jalali date 'since'
+def revenue_per_branch(data, period="year", since=None):
+    orders = data["orders"]
+    mask = slice(None) if since is None else orders["order_date"] >= np.datetime64(lib._to_date(since))
+    keys = (orders["branch_id"][mask], periods(data, orders["order_date"][mask], period))
+    (branches, numbers), counts, revenue = _group(keys, orders["total_cost"][mask].astype(np.float64))
+    return [(int(branch_id), int(number), int(count), float(total))
+            for branch_id, number, count, total in zip(branches, numbers, counts, revenue)]
+
+# Sample query 4: branch name, order count and income of every branch since 1400
+def report_4(data, since="1400-01-01"):
+    orders = data["orders"]
+    mask = orders["order_date"] >= np.datetime64(lib._to_date(since))
+    branches, counts, totals = _group(orders["branch_id"][mask], orders["total_cost"][mask].astype(np.float64))
+    names, _, counts, totals = _group(_labels(data, "branch", "name", branches), counts, totals)
+    return [(str(name), int(count), float(total)) for name, count, total in zip(names, counts, totals) if total >= 0]
+
+# The 'n' customers of a branch with the largest purchases, as rows of
+# (branch name, full name, phone number, total purchase, purchase count)
+def top_customers(data, branch_name, n=1):
+    orders = data["orders"]
+    branch = data["branch"]
+    branch_ids = branch["id"][branch["name"] == branch_name]
+    mask = np.isin(orders["branch_id"], branch_ids)
+    customers, counts, totals = _group(orders["customer_id"][mask], orders["total_cost"][mask].astype(np.float64))
+    top = np.argsort(-totals, kind="stable")[:n]
+    names = _labels(data, "person", "full_name", customers[top])
+    phones = _labels(data, "person", "phone_number", customers[top])
+    return [(branch_name, str(name), str(phone), float(total), int(count))
+            for name, phone, total, count in zip(names, phones, totals[top], counts[top])]
+
+# Sample query 3: the first buyer of 'BestFood_1'
+def report_3(data):
+    return top_customers(data, "BestFood_1")
+
+# Sample query 5: full name, branch name and sold item count of the chefs.
+# Like the SQL, namesakes of a branch are counted together.
+def report_5(data):
+    food = data["food"]
+    sold = np.bincount(_positions(food["id"], data["order_foods"]["food_id"]), minlength=len(food["id"]))
+    chefs, _, counts = _group(food["chef_id"], sold.astype(np.float64))
+    branches = data["employee"]["branch_id"][_positions(data["employee"]["id"], chefs)]
+    keys = (_labels(data, "person", "full_name", chefs), _labels(data, "branch", "name", branches))
+    (names, branch_names), _, counts = _group(keys, counts)
+    order = np.argsort(-counts, kind="stable")
+    return [(str(names[i]), str(branch_names[i]), int(counts[i])) for i in order if counts[i] > 0]
+
+# NumPy versions of the sample queries, by query number
+reports = {3: report_3, 4: report_4, 5: report_5}
+
+# Whether two report rows agree. SUM over a REAL column accumulates in single
+# precision in PostgreSQL, so its large sums drift from the double precision
+# NumPy ones by far more than the rounding of a single value.
+def _same_row(left, right, tolerance=1e-3):
+    if len(left) != len(right):
+        return False
+    for a, b in zip(left, right):
+        if isinstance(a, float) or isinstance(b, float):
+            if abs(float(a) - float(b)) > tolerance * max(1.0, abs(float(a)), abs(float(b))):
+                return False
+        elif a != b:
+            return False
+    return True
+
+# Compare every NumPy report with its SQL version and time both.
+# Rows are compared as sorted lists: ties are ordered arbitrarily by both.
+def verify(directory):
+
+    data = load(directory)
+    results = {}
+    for number, report in reports.items():
+        start = time.perf_counter()
+        sql_rows = lib.execute_query(api.queries[number-1], primary=True)
+        sql_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        numpy_rows = report(data)
+        numpy_seconds = time.perf_counter() - start
+
+        if sql_rows is None:
+            raise RuntimeError("query {0} failed".format(number))
+        expected = sorted(tuple(row) for row in sql_rows)
+        actual = sorted(numpy_rows)
+        results[number] = {
+            "rows":             len(actual),
+            "match":            len(expected) == len(actual) and all(map(_same_row, expected, actual)),
+            "sql_ms":           sql_seconds * 1000,
+            "numpy_ms":         numpy_seconds * 1000
+        }
+
+    return results
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Columnar export and offline analytics of the orders.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="export the order tables as .npy columns")
+    export_parser.add_argument("directory")
+    export_parser.add_argument("--primary", action="store_true", help="read the primary even when a replica is usable")
+
+    verify_parser = commands.add_parser("verify", help="compare the NumPy reports with the SQL ones")
+    verify_parser.add_argument("directory")
+
+    revenue_parser = commands.add_parser("revenue", help="revenue per branch and period")
+    revenue_parser.add_argument("directory")
+    revenue_parser.add_argument("--period", choices=("year", "quarter", "month", "week"), default="year")
+    revenue_parser.add_argument("--since", help="first order date, e.g. 1400-01-01")
+
+    args = parser.parse_args()
+
+    try:
+        if args.command == "export":
+            manifest = export(args.directory, args.primary)
+            print(":: Exported to '{0}' in {1:.2f}s:".format(args.directory, manifest["seconds"]))
+            for table_name, rows in manifest["tables"].items():
+                print("   {0:<12} {1:>10} rows".format(table_name, rows))
+
+        elif args.command == "verify":
+            results = verify(args.directory)
+            print(":: NumPy reports against SQL:")
+            for number, result in results.items():
+                print("   Query {0}: {1:>6} rows  {2:<8}  SQL {3:9.2f} ms  NumPy {4:9.2f} ms".format(
+                    number, result["rows"], "match" if result["match"] else "MISMATCH",
+                    result["sql_ms"], result["numpy_ms"]))
+            if not all(result["match"] for result in results.values()):
+                exit(1)
+
+        else:
+            for row in revenue_per_branch(load(args.directory), args.period, args.since):
+                print("   {}".format(row))
+
+    except (Exception, psycopg2.DatabaseError) as error:
+        print("!! {0}".format(error))
+        exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,30 @@
+import argparse
+import json
+import re
+import sys
+import time
+from contextlib import nullcontext
 import psycopg2
+import psycopg2.extras
+import dashboard
 import library as lib
 
+# List of tables and the columns an inserted row gives, in order
+tables_columns = {
+    "branch":       ("id", "name", "state", "city", "street", "date"),
+    "person":       ("id", "first_name", "last_name", "gender", "phone_number"),
+    "employee":     ("id", "branch_id", "post", "degree", "birth_date", "salary", "state", "married"),
+    "customer":     ("id",),
+    "salon":        ("id", "capacity", "type", "floor"),
+    "orders":       ("branch_id", "customer_id", "waiter_id", "accountant_id", "salon_id", "order_date", "reg_time",
+                     "total_cost"),
+    "food":         ("id", "branch_id", "chef_id", "name", "type", "cost"),
+    "order_foods":  ("order_id", "food_id")
+}
+
 # Get data for tables
 def get_data():
 
-    # List of tables and columns
-    tables_columns = {
-        "branch":       ("id", "name", "state", "city", "street", "date"),
-        "person":       ("id", "firt_name", "last_name", "gender", "phone_number"),
-        "employee":     ("id", "branch_id", "post", "degree", "birth_date", "salary", "state", "married"),
-        "customer":     ("id",),
-        "salon":        ("id", "capacity", "type", "floor"),
-        "orders":       ("customer_id", "waiter_id", "accountant_id", "salon_id", "order_date", "reg_time", "total_cost"),
-        "food":         ("id", "branch_id", "chef_id", "name", "type", "cost"),
-        "order_foods":  ("order_id", "food_id")        
-    }
-
     print(":: Select number of the table:")
     print("   1. branch    2. person    3. employee    4. customer")
     print("   5. salon     6. orders    7. food        8. order_foods\n")
@@ -39,39 +48,111 @@ def get_data():
 
     return table_name, tuple(row)
 
+# Insert rows into a table, sending 'page_size' statements per round trip.
+# Given 'conn', the rows join its open transaction and the caller commits,
+# then calls lib.invalidate_cache(); otherwise a pooled connection is
+# borrowed, committed on exit and the cached results are invalidated
+def insert_rows(table_name, rows, conn=None, page_size=100):
+
+    statement = lib.insert_statement(table_name)
+    rows = [lib.database_row(table_name, row) for row in rows]
+    borrowed = conn is None
+    try:
+        call = lib.instrument("insert", table_name, statement, rows[0] if rows else None)
+        with call, (nullcontext(conn) if conn is not None else lib.get_connection(call=call)) as conn:
+            # create a new cursor
+            cur = conn.cursor()
+            # execute the INSERT statements, many per round trip
+            with call.phase("execute"):
+                psycopg2.extras.execute_batch(cur, statement, rows, page_size=page_size)
+            call.rows = len(rows)
+            # close communication with the database
+            cur.close()
+    finally:
+        # drop the cached query results that read this table, once committed
+        if borrowed:
+            lib.invalidate_cache(table_name)
+
 # Insert a row into tables
-def insert_row(table_name, row):
-
-    sql = {
-        "branch":       "INSERT INTO branch VALUES(%s, %s, %s, %s, %s, %s)",
-        "person":       "INSERT INTO person VALUES(%s, %s, %s, %s, %s)",
-        "employee":     "INSERT INTO employee VALUES(%s, %s, %s, %s, %s, %s, %s, %s)",
-        "customer":     "INSERT INTO customer VALUES(%s)",
-        "salon":        "INSERT INTO salon VALUES(%s, %s, %s, %s)",
-        "orders":       "INSERT INTO orders VALUES(DEFAULT, %s, %s, %s, %s, %s, %s, %s, %s)",
-        "food":         "INSERT INTO food VALUES(%s, %s, %s, %s, %s, %s)",
-        "order_foods":  "INSERT INTO order_foods VALUES(DEFAULT, %s, %s)"
+def insert_row(table_name, row, conn=None):
+
+    try:
+        insert_rows(table_name, [row], conn)
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(error)
+
+# Read an order from the terminal and place it
+def order_entry():
+
+    print(":: Placing an order:")
+    customer = int(input(">> Customer id: "))
+    waiter = int(input(">> Waiter id: "))
+    accountant = int(input(">> Accountant id: "))
+    salon = int(input(">> Salon id: "))
+    food_ids = [int(food_id) for food_id in input(">> Food ids (separated by spaces): ").split()]
+
+    try:
+        order_id, total_cost = lib.place_order(customer, waiter, accountant, salon, food_ids)
+        print(":: Order {0} placed, total cost {1}.".format(order_id, total_cost))
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(error)
+
+# Find a customer at the register, one page of matches at a time
+def customer_search():
+
+    print(":: Finding a customer, leave a field empty to skip it:")
+    search = {
+        "phone":        input(">> Phone number starts with: ").strip() or None,
+        "last_name":    input(">> Last name starts with: ").strip() or None,
+        "first_name":   input(">> First name starts with: ").strip() or None
     }
+    if not any(search.values()):
+        search["name"] = input(">> Name contains: ").strip() or None
 
-    conn = None
     try:
-        # read database configuration
-        params = lib.config()
-        # connect to the PostgreSQL database
-        conn = psycopg2.connect(**params)
-        # create a new cursor
-        cur = conn.cursor()
-        # execute the INSERT statement
-        cur.execute(sql[table_name], row)
-        # commit the changes to the database
-        conn.commit()
-        # close communication with the database
-        cur.close()
+        after = None
+        while True:
+            rows, after = lib.find_customers(after=after, **search)
+            for row in rows:
+                print("   {}".format(row))
+            if after is None or input(">> Next page? (y/n): ").strip().lower() != 'y':
+                break
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(error)
+
+# Print the receipt of an order
+def print_receipt(order):
+
+    print("   Order {0.id}, {0.branch}, {1}-{2:02d}-{3:02d} {0.reg_time}, salon {0.salon_id}".format(
+        order, *lib.gregorian_to_jalali(order.order_date)))
+    print("   Customer: {0.customer}   Waiter: {0.waiter}   Accountant: {0.accountant}".format(order))
+    for item in order.items:
+        print("      {0:<20} {1:>10}".format(item.name, item.cost))
+    print("      {0:<20} {1:>10}\n".format("Total", order.total_cost))
+
+# Show the receipts of some orders, or the orders of a branch over some days
+def order_receipts():
+
+    print(":: Showing orders, leave the ids empty to list a range of dates:")
+    order_ids = [int(order_id) for order_id in input(">> Order ids (separated by spaces): ").split()]
+    search = {"order_ids": order_ids}
+    if not order_ids:
+        first = input(">> From date (YYYY-MM-DD): ").strip()
+        search = {
+            "first":        first,
+            "last":         input(">> To date (YYYY-MM-DD, empty for the same day): ").strip() or first,
+            "branch_id":    input(">> Branch id (empty for every branch): ").strip() or None
+        }
+
+    try:
+        count = 0
+        for orders in lib.fetch_orders(**search):
+            for order in orders:
+                print_receipt(order)
+            count += len(orders)
+        print(":: {0} orders.".format(count))
     except (Exception, psycopg2.DatabaseError) as error:
         print(error)
-    finally:
-        if conn is not None:
-            conn.close()
 
 # This function, initialize a complete sample database
 def sample_database():
@@ -80,119 +161,309 @@ def sample_database():
         lib.create_tables()
         lib.initialize_data()
 
-def sample_queries():
+# Create the tables and load a generated database of any size
+def generated_database():
+    seed = int(input(">> Enter the seed: "))
+    scale_factor = float(input(">> Enter the scale factor (1 = 100 branches, 10M orders): "))
+
+    check = lib.connect()
+    if check == True:
+        lib.create_tables()
+        lib.load_generated_data(seed, scale_factor)
+
+# The sample reporting queries, shown by sample_queries()
+queries = [
+    """
+        SELECT	
+            id, first_name || ' ' || last_name AS full_name, gender
+        FROM
+            person
+        WHERE
+            id IN (
+                SELECT id FROM employee
+            )
+        ORDER BY	
+            gender asc
+    """,
+
+    """
+        SELECT	
+            food.name, branch.name, cost
+        FROM
+            food
+        INNER JOIN
+            branch
+            ON branch_id = branch.id
+        WHERE
+            cost between 10000 and 20000
+        ORDER BY	
+            food.name asc
+    """,
+
+    """
+        SELECT	
+            branch.name AS branch_name,
+            first_name || ' ' || last_name AS full_name,
+            phone_number,
+            SUM(total_cost) AS total_purchase,
+            COUNT(orders.id) AS purchase_count                
+        FROM 
+            ((orders
+        INNER JOIN
+            person
+            ON orders.customer_id = person.id)
+        INNER JOIN
+            branch
+            ON branch_id = branch.id)
+        WHERE
+            branch.name = 'BestFood_1'
+        GROUP BY
+            branch.name, full_name, phone_number
+        ORDER BY	
+            total_purchase desc
+        FETCH FIRST 1 ROW ONLY
+    """,
+
+    """
+        SELECT
+            name AS branch_name,
+            COUNT(orders.id),
+            SUM(total_cost) AS purchase
+        FROM
+            orders
+        LEFT OUTER JOIN
+            branch
+            ON branch_id = branch.id
+        WHERE
+            order_date >= (SELECT jalali_date(1400, 1, 1))
+        GROUP BY
+            branch_name
+        HAVING
+            SUM(total_cost) >= 0
+        ORDER BY
+            branch_name
+    """,
+
+    """
+        SELECT
+            first_name || ' ' || last_name AS full_name,
+            branch.name,
+            COUNT(food_id) AS count
+        FROM
+            ((((food
+        INNER JOIN
+            order_foods
+            ON food.id = food_id)
+        INNER JOIN
+            person
+            ON person.id = chef_id)
+        INNER JOIN
+            employee
+            ON chef_id = employee.id)
+        INNER JOIN
+            branch
+            ON employee.branch_id = branch.id)
+        GROUP BY
+            full_name, branch.name
+        ORDER BY
+            count DESC
+    """
+]
+
+# Variants of sample queries 3, 4 and 5 that read the summary tables
+# maintained by the library instead of aggregating 'orders' and 'order_foods'
+summary_queries = {
+    3: """
+        SELECT
+            branch.name AS branch_name,
+            first_name || ' ' || last_name AS full_name,
+            phone_number,
+            total_purchase,
+            order_count AS purchase_count
+        FROM
+            ((customer_revenue
+        INNER JOIN
+            person
+            ON customer_revenue.customer_id = person.id)
+        INNER JOIN
+            branch
+            ON branch_id = branch.id)
+        WHERE
+            branch.name = 'BestFood_1'
+        ORDER BY
+            total_purchase desc
+        FETCH FIRST 1 ROW ONLY
+    """,
+
+    4: """
+        SELECT
+            name AS branch_name,
+            SUM(order_count)::BIGINT,
+            SUM(income) AS purchase
+        FROM
+            branch_revenue
+        LEFT OUTER JOIN
+            branch
+            ON branch_id = branch.id
+        WHERE
+            year >= 1400 AND order_count > 0
+        GROUP BY
+            branch_name
+        HAVING
+            SUM(income) >= 0
+        ORDER BY
+            branch_name
+    """,
+
+    5: """
+        SELECT
+            first_name || ' ' || last_name AS full_name,
+            branch.name,
+            SUM(sold_count)::BIGINT AS count
+        FROM
+            ((((food
+        INNER JOIN
+            food_sales
+            ON food.id = food_id)
+        INNER JOIN
+            person
+            ON person.id = chef_id)
+        INNER JOIN
+            employee
+            ON chef_id = employee.id)
+        INNER JOIN
+            branch
+            ON employee.branch_id = branch.id)
+        WHERE
+            sold_count > 0
+        GROUP BY
+            full_name, branch.name
+        ORDER BY
+            count DESC
+    """
+}
+
+# References to the live order tables in the sample queries
+_order_tables = re.compile(r"(?<![.\w])(orders|order_foods)(?![.\w])")
+
+# Query of sample report 'number'. With 'archived' the report also reads the
+# archived orders; otherwise 'summary' reads the summary tables where there
+# is a variant, they describe the live orders like the plain queries
+def report_query(number, summary=False, archived=False):
+
+    if archived:
+        return _order_tables.sub(r"all_\1 AS \1", queries[number-1])
+    if summary and number in summary_queries:
+        return summary_queries[number]
+    return queries[number-1]
+
+# Short description of every sample query
+query_titles = [
+    "ID, Full Name and Gender of all employees.",
+    "Food Name, Branch Name and price of foods that are priced between 10000 and 20000.",
+    "Branch Name, Full Name, and Total Purchase of #1 buyer of branch 'BestFood_1'.",
+    "Branch Name, Order Count and Income of all branches in 1400.",
+    "Full Name, Branch Name and count of cooking of the chefs who cooked the most food."
+]
 
-    queries = [
-        """
-            SELECT	
-                id, first_name || ' ' || last_name AS full_name, gender
-            FROM
-                person
-            WHERE
-                id IN (
-                    SELECT id FROM employee
-                )
-            ORDER BY	
-                gender asc
-        """,
-
-        """
-            SELECT	
-                food.name, branch.name, cost
-            FROM
-                food
-            INNER JOIN
-                branch
-                ON branch_id = branch.id
-            WHERE
-                cost between 10000 and 20000
-            ORDER BY	
-                food.name asc
-        """,
-
-        """
-            SELECT	
-                branch.name AS branch_name,
-                first_name || ' ' || last_name AS full_name,
-                phone_number,
-                SUM(total_cost) AS total_purchase,
-                COUNT(orders.id) AS purchase_count                
-            FROM 
-                ((orders
-            INNER JOIN
-                person
-                ON orders.customer_id = person.id)
-            INNER JOIN
-                branch
-                ON branch_id = branch.id)
-            WHERE
-                branch.name = 'BestFood_1'
-            GROUP BY
-                branch.name, full_name, phone_number
-            ORDER BY	
-                total_purchase desc
-            FETCH FIRST 1 ROW ONLY
-        """,
-
-        """
-            SELECT
-                name AS branch_name,
-                COUNT(orders.id),
-                SUM(total_cost) AS purchase
-            FROM
-                orders
-            LEFT OUTER JOIN
-                branch
-                ON branch_id = branch.id
-            WHERE
-                order_date >= '1400-01-01'
-            GROUP BY
-                branch_name
-            HAVING
-                SUM(total_cost) >= 0
-            ORDER BY
-                branch_name
-        """,
-
-        """
-            SELECT
-                first_name || ' ' || last_name AS full_name,
-                branch.name,
-                COUNT(food_id) AS count
-            FROM
-                ((((food
-            INNER JOIN
-                order_foods
-                ON food.id = food_id)
-            INNER JOIN
-                person
-                ON person.id = chef_id)
-            INNER JOIN
-                employee
-                ON chef_id = employee.id)
-            INNER JOIN
-                branch
-                ON employee.branch_id = branch.id)
-            GROUP BY
-                full_name, branch.name
-            ORDER BY
-                count DESC
-        """
-    ]
+def sample_queries():
 
     print(":: List of all Sample Queries:")
-    print("   1. ID, Full Name and Gender of all employees.")
-    print("   2. Food Name, Branch Name and price of foods that are priced between 10000 and 20000.")
-    print("   3. Branch Name, Full Name, and Total Purchase of #1 buyer of branch 'BestFood_1'.")
-    print("   4. Branch Name, Order Count and Income of all branches in 1400.")
-    print("   5. Full Name, Branch Name and count of cooking of the chefs who cooked the most food.")
+    for number, title in enumerate(query_titles, 1):
+        print("   {0}. {1}".format(number, title))
 
     query_number = int(input(">> Enter the query number to display the result: "))
 
-    rows = lib.execute_query(queries[query_number-1])
+    archived = summary = False
+    if _order_tables.search(queries[query_number-1]):
+        archived = input(">> Include the archived orders? (y/n): ").strip().lower() == 'y'
+    if query_number in summary_queries and not archived:
+        summary = input(">> Read from the summary tables? (y/n): ").strip().lower() == 'y'
+    query = report_query(query_number, summary, archived)
+
+    try:
+        # Rows are printed while the server-side cursor streams them
+        for row in lib.stream_query(query):
+            print("   {}".format(row))
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(error)
 
-    for row in rows:
-        print("   {}".format(row))
+# Turn an inserted row given as a list or a column mapping into a tuple
+def batch_row(table_name, row):
+
+    if isinstance(row, dict):
+        return tuple(row[column] for column in tables_columns[table_name])
+    return tuple(row)
+
+# Replay a JSONL file of operations, one JSON object per line:
+#   {"op": "insert", "table": "orders", "row": [...] or {"column": value, ...}}
+#   {"op": "report", "query": 4, "summary": false, "archived": false}
+# Consecutive inserts into the same table are sent as one bulk write, and
+# every operation shares a single pooled connection. A failed batch or
+# report is rolled back and reported without stopping the replay
+def run_batch(path, batch_size=1000, page_size=100, out=sys.stdout):
+
+    stats = {"operations": 0, "rows": 0, "reports": 0, "errors": 0}
+    pending_table, pending = None, []
+
+    def flush(conn):
+        nonlocal pending_table, pending
+        if pending:
+            try:
+                insert_rows(pending_table, pending, conn, page_size)
+                conn.commit()
+                lib.invalidate_cache(pending_table)
+                stats["rows"] += len(pending)
+            except (Exception, psycopg2.DatabaseError) as error:
+                conn.rollback()
+                stats["errors"] += 1
+                print("!! {0} rows into '{1}' failed: {2}".format(len(pending), pending_table, error), file=out)
+        pending_table, pending = None, []
+
+    start = time.perf_counter()
+    with lib.get_connection() as conn, open(path) as lines:
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            stats["operations"] += 1
+            try:
+                operation = json.loads(line)
+                kind = operation["op"]
+                if kind == "insert":
+                    table_name = operation["table"]
+                    row = batch_row(table_name, operation["row"])
+                    if table_name != pending_table or len(pending) >= batch_size:
+                        flush(conn)
+                    pending_table = table_name
+                    pending.append(row)
+                    continue
+                if kind != "report":
+                    raise ValueError("unknown operation '{0}'".format(kind))
+
+                # A report reads everything inserted before it
+                flush(conn)
+                query_number = int(operation["query"])
+                query = report_query(query_number, operation.get("summary"), operation.get("archived"))
+                cur = conn.cursor()
+                cur.execute(query)
+                rows = cur.fetchall()
+                cur.close()
+                conn.commit()
+                stats["reports"] += 1
+                print(":: Report {0}: {1} rows".format(query_number, len(rows)), file=out)
+                for row in rows:
+                    print("   {}".format(row), file=out)
+            except (Exception, psycopg2.DatabaseError) as error:
+                conn.rollback()
+                stats["errors"] += 1
+                print("!! Line {0}: {1}".format(number, error), file=out)
+        flush(conn)
+
+    stats["seconds"] = time.perf_counter() - start
+    stats["rows_per_second"] = stats["rows"] / stats["seconds"] if stats["seconds"] else 0.0
+    print(":: {operations} operations, {rows} rows inserted, {reports} reports, {errors} errors "
+          "in {seconds:.2f}s ({rows_per_second:.0f} rows/s)".format(**stats), file=out)
+    return stats
 
 def main():
 
@@ -201,6 +472,11 @@ def main():
        0 - Initialize a complete sample database.
        1 - Insert data into a table.
        2 - Sample Queries.
+       3 - Generate a synthetic database.
+       4 - Place an order.
+       5 - Find a customer.
+       6 - Show orders.
+       7 - Live branch dashboard (Ctrl-C to return).
        9 - Close the app.""")
 
     # Initialization of sample database
@@ -224,9 +500,32 @@ def main():
         elif user_input == '2':
             sample_queries()
 
+        elif user_input == '3':
+            generated_database()
+
+        elif user_input == '4':
+            order_entry()
+
+        elif user_input == '5':
+            customer_search()
+
+        elif user_input == '6':
+            order_receipts()
+
+        elif user_input == '7':
+            dashboard.run()
+
         elif user_input == '9':
             print("!! API closed.")
             exit()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    if len(sys.argv) > 1:
+        parser = argparse.ArgumentParser(description="Replay a JSONL file of inserts and reports.")
+        parser.add_argument("--batch", required=True, metavar="FILE", help="JSONL operation file")
+        parser.add_argument("--batch-size", type=int, default=1000, help="most rows in one bulk write")
+        parser.add_argument("--page-size", type=int, default=100, help="statements sent per round trip")
+        args = parser.parse_args()
+        run_batch(args.batch, args.batch_size, args.page_size)
+    else:
+        main()
\ No newline at end of file
@@ -0,0 +1,341 @@
+import asyncio
+import collections
+import re
+import time
+import weakref
+from contextlib import asynccontextmanager
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+import library as lib
+
+# Asyncio counterparts of the library functions.
+# They run on psycopg2's asynchronous connections: the driver never blocks and
+# the event loop waits on the socket, so many orders and reports can share one
+# loop. Configuration, SQL, the query cache and the metrics are the library's.
+
+# Requests allowed to wait for a connection before getconn() refuses new ones
+max_waiting = 256
+
+# Wait until the pending operation of an asynchronous connection completes
+async def _wait(conn):
+
+    loop = asyncio.get_running_loop()
+    while True:
+        state = conn.poll()
+        if state == psycopg2.extensions.POLL_OK:
+            return
+
+        future = loop.create_future()
+        ready = lambda: future.done() or future.set_result(None)
+        fd = conn.fileno()
+        if state == psycopg2.extensions.POLL_READ:
+            loop.add_reader(fd, ready)
+            remove = loop.remove_reader
+        elif state == psycopg2.extensions.POLL_WRITE:
+            loop.add_writer(fd, ready)
+            remove = loop.remove_writer
+        else:
+            raise psycopg2.OperationalError("unexpected poll state {0}".format(state))
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Stop the statement on the server too, the connection is closed by putconn()
+            try:
+                conn.cancel()
+            except psycopg2.Error:
+                pass
+            raise
+        finally:
+            remove(fd)
+
+# Execute a statement and return its cursor once the result has arrived
+async def execute(conn, query, params=None):
+
+    cur = conn.cursor()
+    cur.execute(query, params)
+    await _wait(conn)
+    return cur
+
+# A pool of asynchronous PostgreSQL connections for one event loop.
+# getconn() waits up to 'timeout' seconds for a free connection and fails at
+# once when 'max_waiting' requests are already waiting, so a burst is pushed
+# back to the caller instead of queueing without limit. Connections idle for
+# longer than 'health_check' seconds are pinged before they are handed out.
+class AsyncConnectionPool:
+
+    def __init__(self, params, minconn=1, maxconn=10, timeout=30.0, health_check=30.0, max_waiting=max_waiting):
+        self.params = params
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check = health_check
+        self.max_waiting = max_waiting
+        self.waiting = 0
+        self.closed = False
+        self._idle = collections.deque()
+        self._slots = asyncio.Semaphore(maxconn)
+
+    async def _connect(self):
+        conn = psycopg2.connect(async_=1, **self.params)
+        await _wait(conn)
+        return conn
+
+    # Open 'minconn' connections ahead of the first requests
+    async def open(self):
+        while len(self._idle) < self.minconn:
+            self._idle.append((await self._connect(), time.monotonic()))
+
+    # Check that an idle connection is still usable
+    async def _healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.health_check:
+            return True
+
+        try:
+            (await execute(conn, "SELECT 1")).close()
+            return True
+        except psycopg2.Error:
+            return False
+
+    # Take a healthy connection out of the pool
+    async def getconn(self):
+        if self.closed:
+            raise psycopg2.pool.PoolError("connection pool is closed")
+        if not self._slots.locked():
+            await self._slots.acquire()
+        elif self.max_waiting and self.waiting >= self.max_waiting:
+            raise psycopg2.pool.PoolError("{0} requests already waiting for a connection".format(self.waiting))
+        else:
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                raise psycopg2.pool.PoolError("no connection available after {0} seconds".format(self.timeout)) from None
+            finally:
+                self.waiting -= 1
+
+        try:
+            while self._idle:
+                conn, last_used = self._idle.pop()
+                if await self._healthy(conn, last_used):
+                    return conn
+                conn.close()
+            return await self._connect()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    # Give a connection back to the pool, a connection that is not idle is closed
+    def putconn(self, conn, close=False):
+        try:
+            idle = not conn.closed and conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+            if close or self.closed or not idle:
+                conn.close()
+            else:
+                self._idle.append((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    # Close every idle connection of the pool
+    def closeall(self):
+        self.closed = True
+        while self._idle:
+            self._idle.pop()[0].close()
+
+# The connection pool of the running event loop, the settings it was built
+# with and the loop it belongs to
+_pool = None
+_pool_key = None
+_pool_loop = None
+
+# Return the connection pool of the running event loop, built on first use
+def get_pool():
+    global _pool, _pool_key, _pool_loop
+
+    params = lib.config()
+    settings = lib.pool_config()
+    key = (tuple(sorted(params.items())), tuple(sorted(settings.items())))
+    loop = asyncio.get_running_loop()
+
+    if _pool is None or _pool.closed or _pool_key != key or _pool_loop is not loop:
+        if _pool is not None:
+            _pool.closeall()
+        _pool = AsyncConnectionPool(params, **settings)
+        _pool_key = key
+        _pool_loop = loop
+
+    return _pool
+
+# Close the connection pool of the running event loop
+async def close_pool():
+    global _pool
+
+    if _pool is not None:
+        _pool.closeall()
+        _pool = None
+
+# Borrow a connection from the pool for the duration of the block.
+# Asynchronous connections are in autocommit mode, see transaction().
+# A connection left mid-statement by an error or a cancelled task is closed.
+@asynccontextmanager
+async def get_connection(call=lib._NO_CALL):
+
+    pool = get_pool()
+    with call.phase("connect"):
+        conn = await pool.getconn()
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
+
+# Run the block in one transaction, committed on success and rolled back on error
+@asynccontextmanager
+async def transaction(conn, call=lib._NO_CALL):
+
+    (await execute(conn, "BEGIN")).close()
+    try:
+        yield conn
+    except BaseException:
+        # A cancelled statement leaves the connection busy, putconn() closes it
+        if not conn.closed and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_ACTIVE:
+            (await execute(conn, "ROLLBACK")).close()
+        raise
+    with call.phase("commit"):
+        (await execute(conn, "COMMIT")).close()
+
+# Execute a query and return all its rows, like library.execute_query()
+async def execute_query(query, params=None):
+
+    cache = lib.query_cache
+    key = None
+    if cache is not None:
+        normalized = lib.normalize_query(query)
+        if normalized[:6].upper() == "SELECT":
+            key = (normalized, repr(params))
+            rows = cache.get(key)
+            if rows is not None:
+                return rows
+            tables = lib.query_tables(normalized)
+            generation = cache.generation(tables)
+
+    rows = []
+    try:
+        call = lib.instrument("query", query=query, params=params)
+        with call:
+            async with get_connection(call) as conn:
+                with call.phase("execute"):
+                    cur = await execute(conn, query, params)
+                with call.phase("fetch"):
+                    rows = cur.fetchall()
+                cur.close()
+            call.rows = len(rows)
+
+        if key is not None:
+            cache.put(key, rows, tables, generation)
+
+        return rows
+
+    # If any exception occurred, display the error message
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(error)
+
+# The VALUES row of an INSERT statement, repeated for multi-row inserts
+_values_row = re.compile(r"VALUES\s*(\((?:[^()]|\([^()]*\))*\))", re.IGNORECASE)
+
+# Insert rows into a table in one transaction, 'batch_size' rows per
+# multi-row INSERT, and return the number of rows.
+# COPY is not available on asynchronous connections.
+async def insert_rows(table_name, rows, batch_size=1000):
+
+    if lib.partitioned_tables(cached_only=True) is not None:
+        statement = lib.insert_statement(table_name)
+    else:
+        # The layout is looked up with a blocking query: keep it off the event loop
+        statement = await asyncio.to_thread(lib.insert_statement, table_name)
+    rows = [lib.database_row(table_name, row) for row in rows]
+    match = _values_row.search(statement)
+    head, row_template, tail = statement[:match.start(1)], match.group(1), statement[match.end(1):]
+
+    count = 0
+    call = lib.instrument("insert", table_name)
+    try:
+        with call:
+            async with get_connection(call) as conn, transaction(conn, call):
+                cur = conn.cursor()
+                with call.phase("execute"):
+                    for start in range(0, len(rows), batch_size):
+                        batch = rows[start:start + batch_size]
+                        values = b",".join(cur.mogrify(row_template, row) for row in batch)
+                        cur.execute(head.encode() + values + tail.encode())
+                        await _wait(conn)
+                        count += len(batch)
+                cur.close()
+            call.rows = count
+    finally:
+        lib.invalidate_cache(table_name)
+
+    return count
+
+# Insert rows into a table, like library.insert_data()
+async def insert_data(table_name, data_list):
+
+    try:
+        await insert_rows(table_name, data_list)
+
+    # If any exception occurred, display the error message
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(error)
+
+# Create the tables, like library.create_tables().
+# The DDL runs once at setup, on a worker thread so the loop keeps serving.
+async def create_tables(**options):
+    await asyncio.to_thread(lib.create_tables, **options)
+
+# Statements prepared on every asynchronous connection
+_prepared = weakref.WeakKeyDictionary()
+
+# Execute a named prepared statement, preparing it on first use of a connection
+async def execute_prepared(conn, name, statement, types, params):
+
+    prepared = _prepared.setdefault(conn, set())
+    if name not in prepared:
+        (await execute(conn, "PREPARE {0} ({1}) AS {2}".format(name, ", ".join(types), statement))).close()
+        prepared.add(name)
+
+    return await execute(conn, "EXECUTE {0} ({1})".format(name, ", ".join(["%s"] * len(params))), params)
+
+# Place an order with its items and return (order id, total cost), like
+# library.place_order(). Raises ValueError when the order is rejected.
+async def place_order(customer, waiter, accountant, salon, food_ids, order_date=None, reg_time=None):
+
+    food_ids = list(food_ids)
+    if not food_ids:
+        raise ValueError("an order needs at least one food")
+
+    values = (customer, waiter, accountant, salon, food_ids, order_date, reg_time)
+    cache = lib.lookup_cache
+    if lib.partitioned_tables(cached_only=True) is not None and (cache is None or cache.holds(waiter, food_ids)):
+        name, statement, types, params = lib.place_order_call(*values)
+    else:
+        # The layout is looked up, or the lookup cache reads through, with a
+        # blocking query: keep it off the event loop
+        name, statement, types, params = await asyncio.to_thread(lib.place_order_call, *values)
+
+    call = lib.instrument("place_order", "orders")
+    with call:
+        async with get_connection(call) as conn:
+            with call.phase("execute"):
+                cur = await execute_prepared(conn, name, statement, types, params)
+                order = cur.fetchone()
+            call.rows = 1 + len(food_ids) if order is not None else 0
+            cur.close()
+
+    lib.invalidate_cache("orders", "order_foods")
+
+    if order is None:
+        raise ValueError("unknown waiter {0} or a food outside the waiter's branch".format(waiter))
+
+    return order[0], order[1]
@@ -0,0 +1,574 @@
+import argparse
+import asyncio
+import datetime
+import json
+import math
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+import psycopg2
+import api
+import async_library
+import library as lib
+
+# Value at a percentile of a sorted list (nearest rank)
+def percentile(values, percent):
+    if not values:
+        return None
+    rank = max(1, int(math.ceil(percent / 100.0 * len(values))))
+    return values[rank - 1]
+
+# Run a query 'warmup' + 'runs' times and measure the timed runs
+def measure_query(query, runs, warmup):
+
+    latencies = []
+    row_count = 0
+
+    with lib.get_connection() as conn:
+        cur = conn.cursor()
+
+        for run in range(warmup + runs):
+            start = time.perf_counter()
+            cur.execute(query)
+            rows = cur.fetchall()
+            elapsed = time.perf_counter() - start
+
+            if run >= warmup:
+                latencies.append(elapsed * 1000.0)
+            row_count = len(rows)
+
+        # Plan of the last run, with real row counts and buffer usage
+        cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query)
+        plan = cur.fetchone()[0]
+
+        cur.close()
+
+    latencies.sort()
+
+    return {
+        "runs":     runs,
+        "rows":     row_count,
+        "p50_ms":   percentile(latencies, 50),
+        "p95_ms":   percentile(latencies, 95),
+        "p99_ms":   percentile(latencies, 99),
+        "min_ms":   latencies[0],
+        "max_ms":   latencies[-1],
+        "plan":     plan
+    }
+
+# Load a database of the given scale factor from scratch
+def load_scale(seed, scale_factor, partition_by=None):
+    lib.drop_tables()
+    # The generated orders fall in the years 1398 to 1401
+    lib.create_tables(partition_by, partition_start="1398-01-01", partitions_ahead=4 if partition_by == "year" else 48)
+    if not lib.load_generated_data(seed, scale_factor):
+        raise RuntimeError("loading scale factor {0} failed".format(scale_factor))
+
+    with lib.get_connection(autocommit=True) as conn:
+        cur = conn.cursor()
+        cur.execute("VACUUM ANALYZE")
+        cur.close()
+
+# Benchmark every sample query at every scale factor and write a JSON report
+def run(scale_factors, runs, warmup, seed, output, load=True, partition_by=None):
+
+    report = {
+        "created":  time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "seed":     seed,
+        "runs":     runs,
+        "warmup":   warmup,
+        "layout":   partition_by or "heap",
+        "scales":   {}
+    }
+
+    for scale_factor in scale_factors:
+        if load:
+            load_scale(seed, scale_factor, partition_by)
+
+        print(":: Scale factor {0}:".format(scale_factor))
+        # Summary-table variants are reported as '3s', '4s' and '5s'
+        workload = [(str(number), query) for number, query in enumerate(api.queries, 1)]
+        workload += [(str(number) + "s", query) for number, query in sorted(api.summary_queries.items())]
+
+        results = {}
+        for number, query in workload:
+            result = measure_query(query, runs, warmup)
+            results[number] = result
+            print("   Query {0:<2}: p50 {1:.2f} ms   p95 {2:.2f} ms   p99 {3:.2f} ms   {4} rows".format(
+                number, result["p50_ms"], result["p95_ms"], result["p99_ms"], result["rows"]))
+
+        report["scales"][str(scale_factor)] = results
+
+    with open(output, "w") as report_file:
+        json.dump(report, report_file, indent=2)
+
+    print(":: Report written to '{0}'.".format(output))
+
+    return report
+
+# Staff, salons and foods of one branch to place benchmark orders with
+def order_fixture(branch_id=None):
+
+    with lib.get_connection() as conn:
+        cur = conn.cursor()
+        if branch_id is None:
+            cur.execute("SELECT MIN(id) FROM branch")
+            branch_id = cur.fetchone()[0]
+
+        cur.execute("SELECT id, post FROM employee WHERE branch_id = %s", (branch_id,))
+        staff = cur.fetchall()
+        cur.execute("SELECT id, cost FROM food WHERE branch_id = %s", (branch_id,))
+        foods = cur.fetchall()
+        cur.execute("SELECT id FROM salon ORDER BY id LIMIT 1")
+        salon = cur.fetchone()[0]
+        cur.execute("SELECT id FROM customer ORDER BY id LIMIT 1")
+        customer = cur.fetchone()[0]
+        cur.close()
+
+    return {
+        "branch_id":    branch_id,
+        "customer":     customer,
+        "waiter":       next(id for id, post in staff if post == "Waiter"),
+        "accountant":   next(id for id, post in staff if post == "Accountants"),
+        "salon":        salon,
+        "foods":        foods
+    }
+
+# Time 'count' orders through place_order() and through the two-call path
+# of api.insert_row() for the order and lib.insert_data() for its items
+def benchmark_orders(count, items):
+
+    fixture = order_fixture()
+    foods = fixture["foods"][:items]
+    food_ids = [food_id for food_id, _ in foods]
+    total_cost = sum(cost for _, cost in foods)
+    results = {}
+
+    # Two calls, the caller has to guess the SERIAL id of the new order
+    next_id = lib.execute_query("SELECT COALESCE(MAX(id), 0) FROM orders", primary=True)[0][0] + 1
+    start = time.perf_counter()
+    for order_id in range(next_id, next_id + count):
+        api.insert_row("orders", (fixture["branch_id"], fixture["customer"], fixture["waiter"], fixture["accountant"],
+                                  fixture["salon"], "1400-01-01", "12:00", total_cost))
+        lib.insert_data("order_foods", [(order_id, food_id) for food_id in food_ids])
+    results["two_calls"] = count / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _ in range(count):
+        lib.place_order(fixture["customer"], fixture["waiter"], fixture["accountant"], fixture["salon"],
+                        food_ids, "1400-01-01", "12:00")
+    results["place_order"] = count / (time.perf_counter() - start)
+
+    print(":: Order placement with {0} items, {1} orders each:".format(len(food_ids), count))
+    for path, rate in results.items():
+        print("   {0:<12} {1:8.0f} orders/s".format(path, rate))
+    print("   speedup      {0:8.2f}x".format(results["place_order"] / results["two_calls"]))
+
+    return results
+
+# Orders per second and latency of 'count' orders placed by 'concurrency'
+# threads through place_order() and by as many tasks on one event loop
+# through async_library.place_order()
+def benchmark_ingest(count, items, concurrencies):
+
+    fixture = order_fixture()
+    food_ids = [food_id for food_id, _ in fixture["foods"][:items]]
+    order = (fixture["customer"], fixture["waiter"], fixture["accountant"], fixture["salon"],
+             food_ids, "1400-01-01", "12:00")
+
+    def sync_order(_):
+        start = time.perf_counter()
+        lib.place_order(*order)
+        return time.perf_counter() - start
+
+    async def async_order(slots):
+        async with slots:
+            start = time.perf_counter()
+            await async_library.place_order(*order)
+            return time.perf_counter() - start
+
+    async def async_run(concurrency):
+        slots = asyncio.Semaphore(concurrency)
+        try:
+            return await asyncio.gather(*(async_order(slots) for _ in range(count)))
+        finally:
+            await async_library.close_pool()
+
+    results = {}
+    for concurrency in concurrencies:
+        for path in ("threads", "asyncio"):
+            start = time.perf_counter()
+            if path == "threads":
+                with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                    latencies = list(executor.map(sync_order, range(count)))
+            else:
+                latencies = asyncio.run(async_run(concurrency))
+            seconds = time.perf_counter() - start
+
+            latencies.sort()
+            results.setdefault(concurrency, {})[path] = {
+                "orders_per_second":    count / seconds,
+                "p50_ms":               percentile(latencies, 50) * 1000,
+                "p99_ms":               percentile(latencies, 99) * 1000
+            }
+
+    print(":: Ingest of {0} orders with {1} items:".format(count, len(food_ids)))
+    for concurrency, paths in results.items():
+        for path, result in paths.items():
+            print("   {0:>4} concurrent  {1:<8} {2:8.0f} orders/s   p50 {3:7.2f} ms   p99 {4:7.2f} ms".format(
+                concurrency, path, result["orders_per_second"], result["p50_ms"], result["p99_ms"]))
+
+    return results
+
+# Add generated customers until 'person' holds 'persons' rows
+def add_persons(persons, seed):
+
+    with lib.get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT COALESCE(MAX(id), 0), COUNT(*) FROM person")
+        last_id, count = cur.fetchone()
+        cur.close()
+
+    missing = persons - count
+    if missing <= 0:
+        return 0
+
+    rng = random.Random(seed)
+
+    def people():
+        for person_id in range(last_id + 1, last_id + missing + 1):
+            first_name, gender = rng.choice(lib._first_names)
+            yield (person_id, first_name, rng.choice(lib._last_names), gender, str(rng.randint(9000000000, 9999999999)))
+
+    start = time.perf_counter()
+    lib.copy_data("person", people())
+    lib.copy_data("customer", ((person_id,) for person_id in range(last_id + 1, last_id + missing + 1)))
+    with lib.get_connection(autocommit=True) as conn:
+        cur = conn.cursor()
+        cur.execute("VACUUM ANALYZE person, customer")
+        cur.close()
+    print(":: Added {0} customers in {1:.1f}s.".format(missing, time.perf_counter() - start))
+
+    return missing
+
+# Searches of every kind of customer lookup, built from the names and phone
+# numbers of random persons
+def lookup_searches(cur, runs, rng):
+
+    cur.execute("SELECT MAX(id) FROM person")
+    last_id = cur.fetchone()[0]
+    cur.execute("SELECT first_name, last_name, phone_number FROM person WHERE id = ANY(%s)",
+                ([rng.randint(1, last_id) for _ in range(runs * 2)],))
+    people = cur.fetchall()[:runs]
+
+    return {
+        "phone_4":      [{"phone": phone[:4]} for first, last, phone in people],
+        "phone_7":      [{"phone": phone[:7]} for first, last, phone in people],
+        "last_name":    [{"last_name": last[:3]} for first, last, phone in people],
+        "first_name":   [{"first_name": first[:3]} for first, last, phone in people],
+        "full_name":    [{"first_name": first[:2], "last_name": last[:4]} for first, last, phone in people],
+        "name_part":    [{"name": (first + " " + last)[len(first)-2:len(first)+3]} for first, last, phone in people]
+    }
+
+# Milliseconds of every search on its first page and on page 'depth', reached
+# by following the cursors of the pages before it
+def measure_lookups(cur, searches, depth, limit):
+
+    first, deep = [], []
+    for search in searches:
+        after = None
+        for page in range(1, depth + 1):
+            query, params, key_count = lib.customer_lookup_query(limit=limit, after=after, **search)
+            start = time.perf_counter()
+            cur.execute(query, params)
+            rows = cur.fetchall()
+            elapsed = (time.perf_counter() - start) * 1000.0
+            if page == 1:
+                first.append(elapsed)
+            if len(rows) <= limit:
+                break
+            after = list(rows[limit-1][-key_count:])
+        else:
+            deep.append(elapsed)
+
+    first.sort()
+    deep.sort()
+    return {
+        "p50_ms":       percentile(first, 50),
+        "p95_ms":       percentile(first, 95),
+        "p99_ms":       percentile(first, 99),
+        "deep_p50_ms":  percentile(deep, 50),
+        "deep_p99_ms":  percentile(deep, 99)
+    }
+
+# Latency of the customer lookups with their indexes and, with 'compare',
+# without them: the indexes are dropped in a transaction that is rolled back
+def benchmark_lookup(runs, depth, seed, limit=20, compare=True):
+
+    rng = random.Random(seed)
+    results = {}
+
+    with lib.get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM person")
+        persons = cur.fetchone()[0]
+        searches = lookup_searches(cur, runs, rng)
+        conn.commit()
+
+        for kind, kind_searches in searches.items():
+            results[kind] = {"indexed": measure_lookups(cur, kind_searches, depth, limit)}
+
+        if compare:
+            names = [name for name, table_name, definition in lib.indexes + lib.trigram_indexes
+                     if table_name == "person"]
+            cur.execute("DROP INDEX IF EXISTS " + ", ".join(names))
+            for kind, kind_searches in searches.items():
+                results[kind]["scan"] = measure_lookups(cur, kind_searches[:max(1, runs // 10)], depth, limit)
+            conn.rollback()
+
+        cur.close()
+
+    print(":: Customer lookups over {0} persons, {1} rows per page, page {2} as the deep page:".format(
+        persons, limit, depth))
+    for kind, paths in results.items():
+        for path, result in paths.items():
+            print("   {0:<11} {1:<8} p50 {2:8.2f} ms   p95 {3:8.2f} ms   p99 {4:8.2f} ms   deep p50 {5}".format(
+                kind, path, result["p50_ms"], result["p95_ms"], result["p99_ms"],
+                "-" if result["deep_p50_ms"] is None else "{0:.2f} ms".format(result["deep_p50_ms"])))
+
+    return results
+
+# Assemble orders one query at a time, the way a receipt was put together:
+# the order, its customer and staff, its items and then the food of every item.
+# Returns the number of orders and the number of queries sent, one round trip each.
+def fetch_orders_one_by_one(cur, order_ids):
+
+    queries = 0
+    orders = []
+    for order_id in order_ids:
+        cur.execute("SELECT id, branch_id, order_date, reg_time, salon_id, customer_id, waiter_id, accountant_id, "
+                    "total_cost FROM orders WHERE id = %s", (order_id,))
+        queries += 1
+        row = cur.fetchone()
+        if row is None:
+            continue
+        cur.execute("SELECT name FROM branch WHERE id = %s", (row[1],))
+        branch = cur.fetchone()[0]
+        names = []
+        for person_id in row[5:8]:
+            cur.execute("SELECT first_name || ' ' || last_name FROM person WHERE id = %s", (person_id,))
+            names.append(cur.fetchone()[0])
+        cur.execute("SELECT id, food_id FROM order_foods WHERE order_id = %s ORDER BY id", (order_id,))
+        items = []
+        for item_id, food_id in cur.fetchall():
+            cur.execute("SELECT name, type, cost FROM food WHERE id = %s", (food_id,))
+            items.append(lib.OrderItem(item_id, food_id, *cur.fetchone()))
+        queries += 5 + len(items)
+        orders.append(lib.Order(row[0], row[1], branch, row[2], row[3], row[4], row[5], names[0],
+                                row[6], names[1], row[7], names[2], row[8], items))
+
+    return len(orders), queries
+
+# Time assembling 'count' random orders, and the orders of a branch over 'days'
+# days, one query at a time and through lib.fetch_orders(). Every query is a
+# round trip, so the time on a network 'rtt' milliseconds away is projected by
+# adding that much per query to the time measured here.
+def benchmark_details(count, days, chunk_size, rtt, seed):
+
+    rng = random.Random(seed)
+    with lib.get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT MIN(id), MAX(id) FROM orders")
+        low, high = cur.fetchone()
+        if low is None:
+            raise ValueError("there are no orders to fetch")
+        order_ids = rng.sample(range(low, high + 1), min(count, high - low + 1))
+        cur.execute("SELECT branch_id, order_date FROM orders WHERE id = %s", (rng.randint(low, high),))
+        row = cur.fetchone() or (1, datetime.date.today())
+        branch_id, first = row
+        last = first + datetime.timedelta(days=days - 1)
+        cur.execute("SELECT id FROM orders WHERE branch_id = %s AND order_date BETWEEN %s AND %s ORDER BY order_date, id",
+                    (branch_id, first, last))
+        range_ids = [order_id for order_id, in cur.fetchall()]
+
+        results = {}
+        for name, ids, fetch in (
+                ("ids", order_ids, lambda: lib.fetch_orders(order_ids, chunk_size=chunk_size, primary=True)),
+                ("range", range_ids, lambda: lib.fetch_orders(first=first, last=last, branch_id=branch_id,
+                                                              chunk_size=chunk_size, primary=True))):
+            start = time.perf_counter()
+            orders, queries = fetch_orders_one_by_one(cur, ids)
+            one_by_one = time.perf_counter() - start
+            conn.commit()
+
+            start = time.perf_counter()
+            chunks = list(fetch())
+            batched = time.perf_counter() - start
+            if sum(len(chunk) for chunk in chunks) != orders:
+                raise ValueError("fetch_orders() returned {0} orders instead of {1}".format(
+                    sum(len(chunk) for chunk in chunks), orders))
+
+            results[name] = {
+                "orders":       orders,
+                "one_by_one":   {"queries": queries, "ms": one_by_one * 1000,
+                                 "projected_ms": (one_by_one + queries * rtt / 1000) * 1000},
+                # The orders query, a fetch and an items query per chunk, and the fetch that ends the rows
+                "batched":      {"queries": 2 + 2 * len(chunks), "ms": batched * 1000,
+                                 "projected_ms": (batched + (2 + 2 * len(chunks)) * rtt / 1000) * 1000}
+            }
+        cur.close()
+
+    print(":: Order details, {0} orders per chunk, projected at {1} ms per round trip:".format(chunk_size, rtt))
+    for name, result in results.items():
+        print("   {0:<6} {1:6} orders".format(name, result["orders"]))
+        for path in ("one_by_one", "batched"):
+            print("          {0:<11} {1:7} round trips {2:10.2f} ms   projected {3:10.2f} ms".format(
+                path, result[path]["queries"], result[path]["ms"], result[path]["projected_ms"]))
+
+    return results
+
+# Wall-clock time of a fresh load of generated data, serial and in parallel
+def benchmark_load(scale_factor, seed, workers, executors):
+
+    results = {}
+    runs = [("serial", None)] + [(executor, executor) for executor in executors]
+
+    for name, executor in runs:
+        lib.drop_tables()
+        lib.create_tables()
+
+        start = time.perf_counter()
+        if executor is None:
+            check = lib.load_generated_data(seed, scale_factor)
+        else:
+            check = lib.parallel_load_generated_data(seed, scale_factor, workers, executor)
+        if not check:
+            raise RuntimeError("the {0} load failed".format(name))
+        results[name] = time.perf_counter() - start
+
+    print(":: Loading scale factor {0} with {1} workers:".format(scale_factor, workers))
+    for name, seconds in results.items():
+        print("   {0:<8} {1:8.2f} s   speedup {2:5.2f}x".format(name, seconds, results["serial"] / seconds))
+
+    return results
+
+# Compare two reports, a query regresses when a percentile grows more than 'threshold'
+def compare(baseline_file, current_file, threshold):
+
+    with open(baseline_file) as report_file:
+        baseline = json.load(report_file)
+    with open(current_file) as report_file:
+        current = json.load(report_file)
+
+    regressions = 0
+    print(":: Comparing '{0}' with '{1}' (threshold {2:.0%}):".format(current_file, baseline_file, threshold))
+
+    for scale_factor, results in sorted(current["scales"].items()):
+        for number, result in sorted(results.items()):
+            old = baseline["scales"].get(scale_factor, {}).get(number)
+            if old is None:
+                continue
+
+            for key in ("p50_ms", "p95_ms", "p99_ms"):
+                change = (result[key] - old[key]) / old[key] if old[key] else 0.0
+                status = "REGRESSION" if change > threshold else "ok"
+                if change > threshold:
+                    regressions += 1
+                print("   SF {0}  query {1}  {2}: {3:.2f} -> {4:.2f} ms ({5:+.1%})  {6}".format(
+                    scale_factor, number, key[:3], old[key], result[key], change, status))
+
+            if result["rows"] != old["rows"]:
+                print("   SF {0}  query {1}  rows: {2} -> {3}".format(scale_factor, number, old["rows"], result["rows"]))
+
+    print(":: {0} regression(s) found.".format(regressions))
+
+    return regressions
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Benchmark the sample queries of the restaurant database.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="load each scale factor and time the sample queries")
+    run_parser.add_argument("--scale", type=float, nargs="+", default=[0.001, 0.01, 0.1], help="scale factors to load")
+    run_parser.add_argument("--runs", type=int, default=20, help="timed runs of each query")
+    run_parser.add_argument("--warmup", type=int, default=3, help="untimed runs before measuring")
+    run_parser.add_argument("--seed", type=int, default=0, help="seed of the generated data")
+    run_parser.add_argument("--output", default="benchmark.json", help="JSON report file")
+    run_parser.add_argument("--no-load", action="store_true", help="measure the current database as it is")
+    run_parser.add_argument("--partition-by", choices=lib.partition_periods, help="partition the orders by period")
+
+    orders_parser = commands.add_parser("orders", help="compare place_order() with the two-call insert path")
+    orders_parser.add_argument("--count", type=int, default=1000, help="orders placed by each path")
+    orders_parser.add_argument("--items", type=int, default=3, help="items per order")
+    orders_parser.add_argument("--scale", type=float, help="load this scale factor first")
+    orders_parser.add_argument("--seed", type=int, default=0, help="seed of the generated data")
+
+    ingest_parser = commands.add_parser("ingest", help="compare threaded and asyncio order ingest")
+    ingest_parser.add_argument("--count", type=int, default=2000, help="orders placed by each path")
+    ingest_parser.add_argument("--items", type=int, default=3, help="items per order")
+    ingest_parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50],
+                               help="orders in flight at once")
+    ingest_parser.add_argument("--scale", type=float, help="load this scale factor first")
+    ingest_parser.add_argument("--seed", type=int, default=0, help="seed of the generated data")
+
+    lookup_parser = commands.add_parser("lookup", help="time the customer lookups with and without their indexes")
+    lookup_parser.add_argument("--persons", type=int, help="add generated customers up to this many persons first")
+    lookup_parser.add_argument("--runs", type=int, default=200, help="searches of every kind")
+    lookup_parser.add_argument("--depth", type=int, default=10, help="page measured as the deep page")
+    lookup_parser.add_argument("--limit", type=int, default=20, help="rows per page")
+    lookup_parser.add_argument("--no-compare", action="store_true", help="skip the run without the indexes")
+    lookup_parser.add_argument("--seed", type=int, default=0, help="seed of the persons and the searches")
+
+    details_parser = commands.add_parser("details", help="compare fetch_orders() with one query per order and item")
+    details_parser.add_argument("--count", type=int, default=500, help="random orders fetched by id")
+    details_parser.add_argument("--days", type=int, default=7, help="days of one branch's orders fetched by range")
+    details_parser.add_argument("--chunk-size", type=int, default=500, help="orders per chunk of fetch_orders()")
+    details_parser.add_argument("--rtt", type=float, default=1.0, help="round trip in ms the times are projected at")
+    details_parser.add_argument("--seed", type=int, default=0, help="seed of the fetched orders")
+
+    load_parser = commands.add_parser("load", help="compare the serial and the parallel loader")
+    load_parser.add_argument("--scale", type=float, default=0.1, help="scale factor to load")
+    load_parser.add_argument("--seed", type=int, default=0, help="seed of the generated data")
+    load_parser.add_argument("--workers", type=int, default=4, help="parallel workers")
+    load_parser.add_argument("--executor", choices=("thread", "process"), nargs="+", default=["thread", "process"],
+                             help="kinds of parallel workers to measure")
+
+    compare_parser = commands.add_parser("compare", help="flag regressions between two reports")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.10, help="allowed relative slowdown")
+
+    args = parser.parse_args()
+
+    try:
+        if args.command == "run":
+            scales = args.scale[:1] if args.no_load else args.scale
+            run(scales, args.runs, args.warmup, args.seed, args.output, load=not args.no_load,
+                partition_by=args.partition_by)
+        elif args.command == "load":
+            benchmark_load(args.scale, args.seed, args.workers, args.executor)
+        elif args.command == "orders":
+            if args.scale is not None:
+                load_scale(args.seed, args.scale)
+            benchmark_orders(args.count, args.items)
+        elif args.command == "lookup":
+            if args.persons is not None:
+                add_persons(args.persons, args.seed)
+            benchmark_lookup(args.runs, args.depth, args.seed, args.limit, not args.no_compare)
+        elif args.command == "details":
+            benchmark_details(args.count, args.days, args.chunk_size, args.rtt, args.seed)
+        elif args.command == "ingest":
+            if args.scale is not None:
+                load_scale(args.seed, args.scale)
+            benchmark_ingest(args.count, args.items, args.concurrency)
+        else:
+            if compare(args.baseline, args.current, args.threshold):
+                exit(1)
+
+    except (Exception, psycopg2.DatabaseError) as error:
+        print("!! {0}".format(error))
+        exit(1)
+
+if __name__ == '__main__':
+    main()
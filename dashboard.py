@@ -0,0 +1,243 @@
+import argparse
+import datetime
+import heapq
+import json
+import select
+import sys
+import time
+import psycopg2
+import library as lib
+
+# Live order count, revenue and top dishes of every branch for one day.
+# The numbers are aggregated once at startup; from then on they are kept in
+# memory from the notifications of library.orders_notify_commands(), so the
+# display refreshes at a fixed rate without another aggregate query, however
+# many managers are watching. The triggers are installed with
+# 'manage.py install-orders-notify'. Notifications are only sent by the
+# primary, so the dashboard always connects to it.
+
+# Name of the dashboard's connection in pg_stat_activity
+application_name = "rms-dashboard"
+
+# Whether a transaction is visible in a txid_current_snapshot() text
+def _visible(snapshot, xid):
+    xmin, xmax, in_progress = snapshot
+    return xid < xmin or (xid < xmax and xid not in in_progress)
+
+# Per-branch numbers of one day, built from a snapshot and notifications
+class Dashboard:
+
+    def __init__(self, date=None, top=3, reconnect_delay=1.0):
+        # Without a date the dashboard follows today and starts over at midnight
+        self.follow_today = date is None
+        self.date = lib._to_date(date) if date is not None else datetime.date.today()
+        self.top = top
+        self.reconnect_delay = reconnect_delay
+        self.live = False
+        self.error = None
+        self.snapshots = 0
+        self.applied = 0
+        self.skipped = 0
+        self.branches = {}
+        self.foods = {}
+        self._clear()
+        self._snapshot = (0, 0, frozenset())
+        self._conn = None
+
+    def _clear(self):
+        self.orders = {}
+        self.revenue = {}
+        self.sold = {}
+
+    # Names of the branches and foods, reloaded when a notification names a new one
+    def _load_names(self, cur):
+        cur.execute("SELECT id, name FROM branch")
+        self.branches = dict(cur.fetchall())
+        cur.execute("SELECT id, name FROM food")
+        self.foods = dict(cur.fetchall())
+
+    # Aggregate the orders of the day once, in one snapshot. The connection
+    # already LISTENs, so a notification either arrives afterwards or belongs
+    # to a transaction the snapshot holds, and then it is skipped.
+    def load(self, conn):
+        cur = conn.cursor()
+        cur.execute("BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY")
+        try:
+            cur.execute("SELECT txid_current_snapshot()::TEXT")
+            xmin, xmax, in_progress = cur.fetchone()[0].split(":")
+            self._load_names(cur)
+            cur.execute("""
+                SELECT branch_id, COUNT(*), SUM(total_cost::DOUBLE PRECISION)
+                FROM orders
+                WHERE order_date = %s
+                GROUP BY branch_id
+            """, (self.date,))
+            orders = cur.fetchall()
+            cur.execute("""
+                SELECT orders.branch_id, order_foods.food_id, COUNT(*)
+                FROM orders
+                JOIN order_foods ON order_foods.order_id = orders.id
+                WHERE orders.order_date = %s
+                GROUP BY 1, 2
+            """, (self.date,))
+            sold = cur.fetchall()
+        finally:
+            cur.execute("COMMIT")
+            cur.close()
+
+        self._clear()
+        for branch_id, count, revenue in orders:
+            self.orders[branch_id] = count
+            self.revenue[branch_id] = revenue
+        for branch_id, food_id, count in sold:
+            self.sold.setdefault(branch_id, {})[food_id] = count
+        self._snapshot = (int(xmin), int(xmax), frozenset(int(xid) for xid in in_progress.split(",") if xid))
+        self.snapshots += 1
+
+    # Add the changes of one notification, returns whether it names a branch
+    # or a food the dashboard has no name for
+    def apply(self, payload):
+        change = json.loads(payload)
+        if change["d"] != self.date.isoformat():
+            return False
+        if _visible(self._snapshot, change["x"]):
+            self.skipped += 1
+            return False
+
+        branch_id = change["b"]
+        if "n" in change:
+            self.orders[branch_id] = self.orders.get(branch_id, 0) + change["n"]
+            self.revenue[branch_id] = self.revenue.get(branch_id, 0.0) + change["r"]
+        else:
+            sold = self.sold.setdefault(branch_id, {})
+            for food_id, count in change["f"].items():
+                sold[int(food_id)] = sold.get(int(food_id), 0) + count
+        self.applied += 1
+
+        return branch_id not in self.branches or any(int(food_id) not in self.foods for food_id in change.get("f", ()))
+
+    # Open the listening connection and take the snapshot
+    def connect(self):
+        self.close()
+        conn = psycopg2.connect(application_name=application_name, **lib.config())
+        conn.autocommit = True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT COUNT(*) FROM pg_trigger WHERE tgname IN ('orders_notify', 'order_foods_notify')")
+            if cur.fetchone()[0] < 2:
+                raise RuntimeError("new orders are not announced, run 'manage.py install-orders-notify'")
+            cur.execute("LISTEN {0}".format(lib.orders_channel))
+            cur.close()
+            self.load(conn)
+        except BaseException:
+            conn.close()
+            raise
+        self._conn = conn
+        self.live = True
+        self.error = None
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        self.live = False
+
+    # Apply the notifications that arrive in the next 'timeout' seconds.
+    # A lost connection is reopened, with a new snapshot, after 'reconnect_delay'.
+    def wait(self, timeout):
+        deadline = time.monotonic() + timeout
+        try:
+            if self._conn is None:
+                self.connect()
+            elif self.follow_today and datetime.date.today() != self.date:
+                self.date = datetime.date.today()
+                self.load(self._conn)
+
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                if select.select([self._conn], [], [], remaining)[0]:
+                    self._conn.poll()
+                    notifies = list(self._conn.notifies)
+                    self._conn.notifies.clear()
+                    unknown = [self.apply(notify.payload) for notify in notifies]
+                    if any(unknown):
+                        cur = self._conn.cursor()
+                        self._load_names(cur)
+                        cur.close()
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            self.error = str(error).strip()
+            self.close()
+            time.sleep(max(0.0, min(self.reconnect_delay, deadline - time.monotonic())))
+
+    # Top dishes of a branch as (name, items sold)
+    def top_dishes(self, branch_id):
+        sold = self.sold.get(branch_id, {})
+        best = heapq.nlargest(self.top, sold.items(), key=lambda item: item[1])
+        return [(self.foods.get(food_id, "food {0}".format(food_id)), count) for food_id, count in best]
+
+    # The display: one line per branch, the best selling 'rows' branches first
+    def render(self, rows=20):
+        year, month, day = lib.gregorian_to_jalali(self.date)
+        state = "live" if self.live else "reconnecting: {0}".format(self.error)
+        lines = [":: Branches on {0}-{1:02d}-{2:02d} at {3:%H:%M:%S}, {4}".format(
+            year, month, day, datetime.datetime.now(), state)]
+        lines.append("   {0:<16} {1:>8} {2:>14}   {3}".format("Branch", "Orders", "Revenue", "Top dishes"))
+
+        branch_ids = sorted(self.orders, key=lambda branch_id: (-self.revenue.get(branch_id, 0.0), branch_id))
+        for branch_id in branch_ids[:rows]:
+            dishes = ", ".join("{0} {1}".format(name, count) for name, count in self.top_dishes(branch_id))
+            lines.append("   {0:<16} {1:>8} {2:>14,.0f}   {3}".format(
+                self.branches.get(branch_id, "branch {0}".format(branch_id)),
+                self.orders[branch_id], self.revenue.get(branch_id, 0.0), dishes))
+        if len(branch_ids) > rows:
+            lines.append("   ... {0} more branches".format(len(branch_ids) - rows))
+
+        lines.append("   {0:<16} {1:>8} {2:>14,.0f}".format(
+            "Total", sum(self.orders.values()), sum(self.revenue.values())))
+        lines.append("   {0} notifications applied, {1} already in the snapshot, {2} snapshot(s)".format(
+            self.applied, self.skipped, self.snapshots))
+        return "\n".join(lines)
+
+# Refresh the display every 'refresh' seconds until interrupted, or after
+# 'frames' refreshes. A terminal is redrawn in place, other outputs get one
+# frame after the other.
+def run(date=None, refresh=1.0, top=3, rows=20, frames=None, out=sys.stdout):
+
+    dashboard = Dashboard(date, top)
+    redraw = out.isatty()
+    shown = 0
+    try:
+        while frames is None or shown < frames:
+            dashboard.wait(refresh)
+            out.write(("\033[H\033[J" if redraw else "\n") + dashboard.render(rows) + "\n")
+            out.flush()
+            shown += 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        dashboard.close()
+
+    return dashboard
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Live branch dashboard of the restaurant database.")
+    parser.add_argument("--date", help="day to show, e.g. 1401-06-01 (default: today, following midnight)")
+    parser.add_argument("--refresh", type=float, default=1.0, help="seconds between refreshes")
+    parser.add_argument("--top", type=int, default=3, help="top dishes shown per branch")
+    parser.add_argument("--rows", type=int, default=20, help="branches shown, by revenue")
+    parser.add_argument("--frames", type=int, help="stop after this many refreshes")
+    args = parser.parse_args()
+
+    try:
+        run(args.date, args.refresh, args.top, args.rows, args.frames)
+
+    except (Exception, psycopg2.DatabaseError) as error:
+        print("!! {0}".format(error))
+        exit(1)
+
+if __name__ == '__main__':
+    main()
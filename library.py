@@ -1,8 +1,42 @@
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from configparser import ConfigParser
+from contextlib import contextmanager, nullcontext
+import bisect
+import datetime
+import functools
+import hashlib
+import itertools
+import logging
+import multiprocessing
+import os
+import random
+import re
+import select
+import struct
+import sys
+import threading
+import time
+import weakref
 import psycopg2
+import psycopg2.errors
+import psycopg2.pool
+
+# Parsed sections of the Database file, keyed by (filename, section)
+_config_cache = {}
 
 # Read the Database file and return connection parameters
 def config(filename='database.ini', section='postgresql'):
+    # The file is parsed again only when its modification time changes
+    try:
+        mtime = os.path.getmtime(filename)
+    except OSError:
+        mtime = None
+
+    cached = _config_cache.get((filename, section))
+    if cached is not None and cached[0] == mtime:
+        return dict(cached[1])
+
     # create a parser
     parser = ConfigParser()
     # read config file
@@ -17,312 +51,3148 @@ def config(filename='database.ini', section='postgresql'):
     else:
         raise Exception('Section {0} not found in the {1} file'.format(section, filename))
 
-    return db
+    _config_cache[(filename, section)] = (mtime, db)
 
-# Connect to the PostgreSQL database server
-def connect():
+    return dict(db)
+
+# Read the connection pool settings, defaults are used without a [pool] section.
+# psycopg2 keeps at most 'minconn' connections open while idle and closes the
+# others as they are returned, so 'minconn' is both the connections opened up
+# front and the most kept for reuse. It defaults to 'maxconn': with fewer,
+# concurrent callers reconnect on almost every call.
+def pool_config(filename='database.ini'):
+
+    settings = {
+        "minconn":          10,
+        "maxconn":          10,
+        "timeout":          30.0,
+        "health_check":     30.0
+    }
+
+    try:
+        params = config(filename, 'pool')
+    except Exception:
+        params = {}
+
+    for key, value in params.items():
+        if key in ("minconn", "maxconn"):
+            settings[key] = int(value)
+        elif key in ("timeout", "health_check"):
+            settings[key] = float(value)
+
+    return settings
+
+# A thread-safe pool of PostgreSQL connections.
+# getconn() blocks up to 'timeout' seconds when all connections are in use,
+# and connections idle for longer than 'health_check' seconds are pinged
+# before they are handed out again.
+class ConnectionPool:
+
+    def __init__(self, params, minconn=1, maxconn=10, timeout=30.0, health_check=30.0):
+        self.params = params
+        self.timeout = timeout
+        self.health_check = health_check
+        self._pool = psycopg2.pool.ThreadedConnectionPool(minconn, maxconn, **params)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._last_used = {}
+        self._retired = False
+
+    @property
+    def closed(self):
+        return self._pool.closed
+
+    # Check that a connection is still usable
+    def _healthy(self, conn):
+        if conn.closed:
+            return False
+
+        last_used = self._last_used.get(conn)
+        if last_used is not None and time.monotonic() - last_used < self.health_check:
+            return True
+
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    # Take a healthy connection out of the pool
+    def getconn(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise psycopg2.pool.PoolError("no connection available after {0} seconds".format(self.timeout))
+
+        try:
+            while True:
+                conn = self._pool.getconn()
+                if self._healthy(conn):
+                    return conn
+
+                # Drop the broken connection, the pool opens a new one
+                self._last_used.pop(conn, None)
+                self._pool.putconn(conn, close=True)
+        except Exception:
+            self._slots.release()
+            raise
+
+    # Give a connection back to the pool
+    def putconn(self, conn):
+        try:
+            if self._pool.closed:
+                conn.close()
+            elif conn.closed or self._retired:
+                self._last_used.pop(conn, None)
+                self._pool.putconn(conn, close=True)
+            else:
+                self._last_used[conn] = time.monotonic()
+                self._pool.putconn(conn)
+        finally:
+            self._slots.release()
+
+    # Close every connection of the pool
+    def closeall(self):
+        if not self._pool.closed:
+            self._pool.closeall()
+        self._last_used.clear()
+
+    # Close the idle connections and keep none from now on. Connections other
+    # threads still hold are closed as they are given back.
+    def retire(self):
+        self._retired = True
+        with self._pool._lock:
+            idle, self._pool._pool = self._pool._pool, []
+        for conn in idle:
+            self._last_used.pop(conn, None)
+            conn.close()
 
+# The process-wide connection pool, the settings it was built with and the
+# process that built it
+_pool = None
+_pool_key = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+# Pools inherited through fork(), kept alive so that closing them cannot
+# shut down the connections of the parent process
+_inherited_pools = []
+
+# Return the shared connection pool, it is rebuilt when database.ini changes
+def get_pool():
+    global _pool, _pool_key, _pool_pid
+
+    params = config()
+    settings = pool_config()
+    key = (tuple(sorted(params.items())), tuple(sorted(settings.items())))
+
+    with _pool_lock:
+        # A forked child must not touch the connections of its parent
+        if _pool is not None and _pool_pid != os.getpid():
+            _inherited_pools.append(_pool)
+            _pool = None
+
+        if _pool is None or _pool.closed or _pool_key != key:
+            if _pool is not None:
+                _pool.closeall()
+            _pool = ConnectionPool(params, **settings)
+            _pool_key = key
+            _pool_pid = os.getpid()
+
+    return _pool
+
+# Close the shared connection pool
+def close_pool():
+    global _pool, _pool_key
+
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+        _pool = None
+        _pool_key = None
+
+    close_replicas()
+
+# Replica sections of the Database file, keyed by filename
+_replica_sections = {}
+
+# Read the read replica sections of the Database file, '[replica]' or
+# '[replica.<name>]', and return (name, connection parameters) in file order.
+# Parameters missing from a replica section are taken from [postgresql].
+def replica_config(filename='database.ini'):
+    try:
+        mtime = os.path.getmtime(filename)
+    except OSError:
+        mtime = None
+
+    cached = _replica_sections.get(filename)
+    if cached is None or cached[0] != mtime:
+        parser = ConfigParser()
+        parser.read(filename)
+        sections = [section for section in parser.sections() if section == "replica" or section.startswith("replica.")]
+        cached = _replica_sections[filename] = (mtime, sections)
+
+    if not cached[1]:
+        return []
+
+    primary = config(filename)
+    return [(section.partition(".")[2] or section, dict(primary, **config(filename, section))) for section in cached[1]]
+
+# Read the read routing settings, defaults are used without a [routing] section.
+# Replicas lagging more than 'max_lag' seconds behind the primary are skipped,
+# and the lag of a replica is measured at most once every 'lag_check' seconds.
+def routing_config(filename='database.ini'):
+
+    settings = {
+        "max_lag":      None,
+        "lag_check":    5.0
+    }
+
+    try:
+        params = config(filename, 'routing')
+    except Exception:
+        params = {}
+
+    for key, value in params.items():
+        if key == "max_lag":
+            settings[key] = float(value) if value.strip() else None
+        elif key == "lag_check":
+            settings[key] = float(value)
+
+    return settings
+
+# Replication lag of a standby in seconds, 0 on a primary and on a standby
+# that has replayed everything it received, NULL before the first replay
+replica_lag_query = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+"""
+
+# Log of the replicas that become unavailable or fall behind
+replica_log = logging.getLogger("library.replica")
+
+# A read replica with its own connection pool.
+# The pool is opened by the first check(), so an unreachable replica is
+# skipped instead of failing the reads, and retried at the next check.
+# Checks run in a background thread, a read never waits for one: until the
+# first check succeeds the reads go to the primary.
+class Replica:
+
+    def __init__(self, name, params, settings):
+        self.name = name
+        self.params = params
+        self.settings = settings
+        self.pool = None
+        self.lag = None
+        self.error = None
+        self._checked = None
+        self._lock = threading.Lock()
+
+    @property
+    def available(self):
+        return self.pool is not None and self.error is None
+
+    # Start measuring the replication lag, at most once every 'interval'
+    # seconds. Only one check runs at a time, the reads keep using the last result.
+    # With 'wait' the check runs in the calling thread, after a running one.
+    def check(self, interval, wait=False):
+        if not self._lock.acquire(blocking=wait):
+            return
+        checked = self._checked
+        if checked is not None and time.monotonic() - checked < interval:
+            self._lock.release()
+            return
+
+        self._checked = time.monotonic()
+        if wait:
+            self._check()
+            return
+        try:
+            threading.Thread(target=self._check, name="replica-check-{0}".format(self.name), daemon=True).start()
+        except BaseException:
+            self._lock.release()
+            raise
+
+    # Open the pool when there is none and measure the lag, in the checker thread
+    def _check(self):
+        try:
+            pool = self.pool
+            if pool is None:
+                pool = self.pool = ConnectionPool(self.params, **self.settings)
+            conn = pool.getconn()
+            try:
+                cur = conn.cursor()
+                cur.execute(replica_lag_query)
+                lag = cur.fetchone()[0]
+                cur.close()
+                conn.rollback()
+            finally:
+                pool.putconn(conn)
+            self.lag = None if lag is None else float(lag)
+            if self.error is not None:
+                replica_log.warning("replica %s is available again", self.name)
+            self.error = None
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            self.fail(error)
+
+        finally:
+            self._lock.release()
+
+    # Take the replica out of the rotation until its next check. Its pooled
+    # connections are likely broken too, the next check opens a new pool.
+    # Other threads may still read on the old one, so it is only retired.
+    def fail(self, error):
+        if self.error is None:
+            replica_log.warning("replica %s is unavailable: %s", self.name, str(error).strip())
+        self.error = str(error).strip()
+        self._checked = time.monotonic()
+        pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.retire()
+
+    # Whether reads may go to the replica
+    def usable(self, max_lag):
+        if not self.available:
+            return False
+        return max_lag is None or (self.lag is not None and self.lag <= max_lag)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.closeall()
+
+# The replicas of the process, the settings they were built with and the
+# process that built them
+_replicas = []
+_replicas_key = None
+_replicas_pid = None
+_replica_turn = itertools.count()
+
+# Reads served by the primary and by each replica, keyed by name
+_reads = {}
+_reads_lock = threading.Lock()
+
+# Return the replicas, they are rebuilt when database.ini changes
+def get_replicas():
+    global _replicas, _replicas_key, _replicas_pid
+
+    nodes = replica_config()
+    settings = pool_config()
+    key = (tuple((name, tuple(sorted(params.items()))) for name, params in nodes), tuple(sorted(settings.items())))
+
+    with _pool_lock:
+        # A forked child must not touch the connections of its parent
+        if _replicas and _replicas_pid != os.getpid():
+            _inherited_pools.extend(replica.pool for replica in _replicas if replica.pool is not None)
+            _replicas = []
+            _replicas_key = None
+
+        if _replicas_key != key:
+            for replica in _replicas:
+                replica.close()
+            _replicas = [Replica(name, params, settings) for name, params in nodes]
+            _replicas_key = key
+            _replicas_pid = os.getpid()
+
+    return _replicas
+
+# Close the pools of the replicas
+def close_replicas():
+    global _replicas, _replicas_key
+
+    with _pool_lock:
+        for replica in _replicas:
+            replica.close()
+        _replicas = []
+        _replicas_key = None
+
+# Choose the replica for the next read, round robin over the replicas that are
+# reachable and within the lag limit. None sends the read to the primary.
+def read_replica():
+
+    replicas = get_replicas()
+    if not replicas:
+        return None
+
+    settings = routing_config()
+    start = next(_replica_turn)
+    for offset in range(len(replicas)):
+        replica = replicas[(start + offset) % len(replicas)]
+        replica.check(settings["lag_check"])
+        if replica.usable(settings["max_lag"]):
+            return replica
+
+    return None
+
+# State of the primary and of every replica, for monitoring
+def replica_status():
+
+    settings = routing_config()
+    status = [{"name": "primary", "host": config().get("host"), "port": config().get("port"),
+               "available": True, "lag": 0.0, "reads": _reads.get("primary", 0)}]
+    for replica in get_replicas():
+        replica.check(settings["lag_check"], wait=True)
+        status.append({
+            "name":         replica.name,
+            "host":         replica.params.get("host"),
+            "port":         replica.params.get("port"),
+            "available":    replica.usable(settings["max_lag"]),
+            "lag":          replica.lag,
+            "reads":        _reads.get(replica.name, 0),
+            "error":        replica.error
+        })
+
+    return status
+
+# Upper bounds of the latency histogram buckets, in seconds
+latency_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+# Log of the statements slower than the slow query threshold
+slow_query_log = logging.getLogger("library.slow_query")
+
+# Timing of one instrumented database call, see instrument()
+class _Call:
+
+    def __init__(self, recorder, operation, target, query, params):
+        self.recorder = recorder
+        self.operation = operation
+        self.target = target
+        self.query = query
+        self.params = params
+        self.rows = 0
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, kind, error, traceback):
+        # A consumer closing a stream early is not a failure
+        failed = error is not None and not isinstance(error, GeneratorExit)
+        self.recorder.record(self, time.perf_counter() - self.start, failed)
+        return False
+
+# Stand-in for _Call while the metrics are disabled
+class _NoCall:
+
+    rows = 0
+    _phase = nullcontext()
+
+    def phase(self, name):
+        return self._phase
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, error, traceback):
+        return False
+
+_NO_CALL = _NoCall()
+
+# Call counts, row counts, per-phase times (connect, execute, fetch, commit)
+# and latency histograms of the database calls, per operation and target.
+# A target is a table name or a query fingerprint.
+class Metrics:
+
+    def __init__(self, slow_query_threshold=None):
+        self.slow_query_threshold = slow_query_threshold
+        self._series = {}
+        self._queries = {}
+        self._lock = threading.Lock()
+
+    # Add a finished call
+    def record(self, call, seconds, failed):
+        key = (call.operation, call.target)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {
+                    "calls":    0,
+                    "errors":   0,
+                    "rows":     0,
+                    "seconds":  0.0,
+                    "phases":   {},
+                    "buckets":  [0] * len(latency_buckets)
+                }
+                if call.query is not None and call.target.startswith("query_"):
+                    self._queries[call.target] = normalize_query(call.query)
+
+            series["calls"] += 1
+            series["errors"] += failed
+            series["rows"] += call.rows
+            series["seconds"] += seconds
+            for name, phase_seconds in call.phases.items():
+                series["phases"][name] = series["phases"].get(name, 0.0) + phase_seconds
+            series["buckets"][bisect.bisect_left(latency_buckets, seconds)] += 1
+
+        if self.slow_query_threshold is not None and seconds >= self.slow_query_threshold and call.query is not None:
+            _log_slow_query(call, seconds)
+
+    # Copy of every series as plain data
+    def snapshot(self):
+        with self._lock:
+            return {
+                "series": [
+                    {
+                        "operation":        operation,
+                        "target":           target,
+                        "calls":            series["calls"],
+                        "errors":           series["errors"],
+                        "rows":             series["rows"],
+                        "seconds":          series["seconds"],
+                        "phases":           dict(series["phases"]),
+                        "latency_buckets":  dict(zip([str(bound) for bound in latency_buckets], series["buckets"]))
+                    }
+                    for (operation, target), series in sorted(self._series.items())
+                ],
+                "queries": dict(self._queries)
+            }
+
+    # The series in the Prometheus text exposition format
+    def prometheus(self):
+        lines = []
+        counters = (("calls", "Database calls"), ("errors", "Failed database calls"), ("rows", "Rows read or written"))
+
+        with self._lock:
+            items = sorted(self._series.items())
+
+            for name, help_text in counters:
+                lines.append("# HELP rms_db_{0}_total {1}.".format(name, help_text))
+                lines.append("# TYPE rms_db_{0}_total counter".format(name))
+                for (operation, target), series in items:
+                    lines.append('rms_db_{0}_total{{operation="{1}",target="{2}"}} {3}'.format(
+                        name, operation, target, series[name]))
+
+            lines.append("# HELP rms_db_phase_seconds_total Time spent in each phase of the database calls.")
+            lines.append("# TYPE rms_db_phase_seconds_total counter")
+            for (operation, target), series in items:
+                for phase, seconds in sorted(series["phases"].items()):
+                    lines.append('rms_db_phase_seconds_total{{operation="{0}",target="{1}",phase="{2}"}} {3:.6f}'.format(
+                        operation, target, phase, seconds))
+
+            lines.append("# HELP rms_db_latency_seconds Latency of the database calls.")
+            lines.append("# TYPE rms_db_latency_seconds histogram")
+            for (operation, target), series in items:
+                cumulative = 0
+                for bound, count in zip(latency_buckets, series["buckets"]):
+                    cumulative += count
+                    lines.append('rms_db_latency_seconds_bucket{{operation="{0}",target="{1}",le="{2}"}} {3}'.format(
+                        operation, target, "+Inf" if bound == float("inf") else bound, cumulative))
+                lines.append('rms_db_latency_seconds_sum{{operation="{0}",target="{1}"}} {2:.6f}'.format(
+                    operation, target, series["seconds"]))
+                lines.append('rms_db_latency_seconds_count{{operation="{0}",target="{1}"}} {2}'.format(
+                    operation, target, series["calls"]))
+
+        return "\n".join(lines) + "\n"
+
+# The metrics of this process, None while instrumentation is disabled
+metrics = None
+
+# Turn on the instrumentation, statements slower than 'slow_query_threshold'
+# seconds are logged to 'library.slow_query' with their plan
+def enable_metrics(slow_query_threshold=None):
+    global metrics
+    metrics = Metrics(slow_query_threshold)
+    return metrics
+
+# Turn off the instrumentation
+def disable_metrics():
+    global metrics
+    metrics = None
+
+# Metrics snapshot as a dict for JSON, or None while disabled
+def metrics_snapshot():
+    if metrics is None:
+        return None
+    return metrics.snapshot()
+
+# Metrics in the Prometheus text format, empty while disabled
+def metrics_prometheus():
+    if metrics is None:
+        return ""
+    return metrics.prometheus()
+
+# Short stable name of a query for the metrics
+def query_fingerprint(query):
+    return "query_" + hashlib.md5(normalize_query(query).encode("utf-8")).hexdigest()[:10]
+
+# Start timing a database call, use it as 'with instrument(...) as call'.
+# Returns a shared no-op object while the metrics are disabled.
+def instrument(operation, target=None, query=None, params=None):
+    recorder = metrics
+    if recorder is None:
+        return _NO_CALL
+    if target is None:
+        target = query_fingerprint(query)
+    return _Call(recorder, operation, target, query, params)
+
+# Log a slow statement with its EXPLAIN plan, when the plan can be produced
+def _log_slow_query(call, seconds):
+    plan = None
+    if call.operation in ("query", "stream", "insert"):
+        try:
+            with get_connection() as conn:
+                cur = conn.cursor()
+                cur.execute("EXPLAIN " + call.query, call.params)
+                plan = "\n".join(row[0] for row in cur.fetchall())
+                cur.close()
+        except (Exception, psycopg2.DatabaseError) as error:
+            plan = "plan unavailable: {0}".format(error)
+
+    slow_query_log.warning("slow %s on %s took %.1f ms\n%s\nparams: %r\n%s",
+                           call.operation, call.target, seconds * 1000.0,
+                           normalize_query(call.query), call.params, plan or "")
+
+# Borrow a connection from the shared pool.
+# The transaction is committed when the block succeeds and rolled back otherwise,
+# with 'autocommit' every statement commits on its own. The checkout and the
+# commit are timed as the 'connect' and 'commit' phases of 'call'.
+# With 'read_only' the connection comes from a replica when one is usable.
+@contextmanager
+def get_connection(autocommit=False, call=_NO_CALL, read_only=False):
+
+    replica = read_replica() if read_only else None
     conn = None
+    with call.phase("connect"):
+        if replica is not None:
+            pool = replica.pool
+            try:
+                conn = pool.getconn()
+            except psycopg2.OperationalError as error:
+                # The replica went away since its last check, read from the primary
+                replica.fail(error)
+                replica = None
+        if conn is None:
+            pool = get_pool()
+            conn = pool.getconn()
+
+    if read_only:
+        name = "primary" if replica is None else replica.name
+        with _reads_lock:
+            _reads[name] = _reads.get(name, 0) + 1
     try:
-        # Read connection parameters
-        params = config()
+        if autocommit:
+            conn.autocommit = True
+        yield conn
+        with call.phase("commit"):
+            conn.commit()
+    except BaseException as error:
+        if not conn.closed:
+            conn.rollback()
+        elif replica is not None and isinstance(error, psycopg2.OperationalError):
+            replica.fail(error)
+        raise
+    finally:
+        if autocommit and not conn.closed:
+            conn.autocommit = False
+        pool.putconn(conn)
+
+# Connect to the PostgreSQL database server
+def connect():
 
-        # Connect to the PostgreSQL server
+    try:
+        # Take a connection from the pool
         print(':: Connecting to the PostgreSQL database ...\n')
-        conn = psycopg2.connect(**params)
-		
-        # Create a cursor
-        cur = conn.cursor()
-        
-	    # Execute a statement
-        print(':: PostgreSQL database version:')
-        cur.execute('SELECT version()')
-
-        # Display the PostgreSQL database server version
-        db_version = cur.fetchone()
-        print("   {0}".format(db_version) + "\n")
-       
-	    # Close the communication with the PostgreSQL
-        cur.close()
+        with get_connection() as conn:
+
+            # Create a cursor
+            cur = conn.cursor()
+
+            # Execute a statement
+            print(':: PostgreSQL database version:')
+            cur.execute('SELECT version()')
+
+            # Display the PostgreSQL database server version
+            db_version = cur.fetchone()
+            print("   {0}".format(db_version) + "\n")
+
+            # Close the communication with the PostgreSQL
+            cur.close()
+
+        print(":: Database connection returned to the pool.")
 
         return True
 
     except (Exception, psycopg2.DatabaseError) as error:
         print("!! {0}".format(error))
+
+        return False
+
+# Statements that create the tables, in foreign key order
+commands = (
+    """
+    CREATE TABLE IF NOT EXISTS branch (
+        id              INTEGER NOT NULL PRIMARY KEY,
+        name            TEXT NOT NULL,
+        state           TEXT NOT NULL,
+        city            TEXT NOT NULL,
+        street          TEXT NOT NULL,
+        date            DATE NOT NULL
+    )
+    """,
+
+    """
+    CREATE TABLE IF NOT EXISTS person (
+        id              INTEGER NOT NULL PRIMARY KEY,
+        first_name      TEXT NOT NULL,
+        last_name       TEXT NOT NULL,
+        gender          TEXT NOT NULL,
+        phone_number    TEXT NOT NULL
+    )
+    """,
+
+    """
+    CREATE TABLE IF NOT EXISTS employee (
+        id              INTEGER PRIMARY KEY,
+        branch_id       INTEGER NOT NULL,
+        post            TEXT NOT NULL,
+        degree          TEXT NOT NULL,
+        birth_date      DATE NOT NULL,
+        salary          REAL NOT NULL,
+        state           TEXT NOT NULL,
+        married         TEXT NOT NULL,
+
+        CONSTRAINT fk_person
+            FOREIGN KEY (id)
+                REFERENCES person (id)
+                ON UPDATE CASCADE ON DELETE CASCADE,
+
+        CONSTRAINT fk_branch
+            FOREIGN KEY (branch_id)
+                REFERENCES branch (id)
+                ON DELETE CASCADE
+    )
+    """,
+
+    """
+    CREATE TABLE IF NOT EXISTS customer (
+        id              INTEGER PRIMARY KEY,
+
+        CONSTRAINT fk_person
+            FOREIGN KEY (id)
+                REFERENCES person (id)
+                ON UPDATE CASCADE ON DELETE CASCADE
+    )
+    """,
+
+    """
+    CREATE TABLE IF NOT EXISTS salon (
+        id              INTEGER NOT NULL PRIMARY KEY,
+        capacity        INTEGER NOT NULL,
+        type            TEXT NOT NULL,
+        floor           INTEGER NOT NULL
+    )
+    """,
+
+    """
+    CREATE TABLE IF NOT EXISTS orders (
+        id              SERIAL PRIMARY KEY,
+        branch_id       INTEGER NOT NULL,
+        customer_id     INTEGER NOT NULL,
+        waiter_id       INTEGER NOT NULL,
+        accountant_id   INTEGER NOT NULL,
+        salon_id        INTEGER NOT NULL,
+        order_date      DATE NOT NULL,
+        reg_time        TIME NOT NULL,
+        total_cost      REAL NOT NULL,
+        
+        CONSTRAINT fk_branch
+            FOREIGN KEY (branch_id)
+                REFERENCES branch (id)
+                ON DELETE CASCADE,
+
+        CONSTRAINT fk_customer
+            FOREIGN KEY (customer_id)
+                REFERENCES customer (id)
+                ON DELETE CASCADE,
+
+        CONSTRAINT fk_employee
+            FOREIGN KEY (waiter_id)
+                REFERENCES employee (id)
+                ON DELETE CASCADE,
+
+            FOREIGN KEY (accountant_id)
+                REFERENCES employee (id)
+                ON DELETE CASCADE,
+
+        CONSTRAINT fk_salon
+            FOREIGN KEY (salon_id)
+                REFERENCES salon (id)
+                ON DELETE CASCADE
+    )
+    """,
+
+    """
+    CREATE TABLE IF NOT EXISTS food (
+        id              INTEGER NOT NULL PRIMARY KEY,
+        branch_id       INTEGER NOT NULL,
+        chef_id         INTEGER NOT NULL,
+        name            TEXT NOT NULL,
+        type            TEXT NOT NULL,
+        cost            REAL NOT NULL,
+
+        CONSTRAINT fk_branch
+            FOREIGN KEY (branch_id)
+                REFERENCES branch (id)
+                ON DELETE CASCADE,
         
+        CONSTRAINT fk_employee
+            FOREIGN KEY (chef_id)
+                REFERENCES employee (id)
+                ON DELETE CASCADE
+    )
+    """,
+
+    """
+    CREATE TABLE IF NOT EXISTS order_foods (
+        id              SERIAL PRIMARY KEY,
+        order_id        INTEGER NOT NULL,
+        food_id         INTEGER NOT NULL,
+
+        CONSTRAINT fk_orders
+            FOREIGN KEY (order_id)
+                REFERENCES orders (id)
+                ON DELETE CASCADE,
+
+        CONSTRAINT fk_food
+            FOREIGN KEY (food_id)
+                REFERENCES food (id)
+                ON DELETE CASCADE
+    )
+    """
+)
+
+# 'orders' partitioned by RANGE (order_date), the partition key joins the primary key.
+# The primary key alone no longer makes 'id' unique, while 'order_foods.order_id',
+# the archive and fetch_orders() take an id to name one order. Ids only come
+# from the SERIAL, so they never repeat across partitions, and every partition
+# gets a unique index on 'id' (see _unique_order_ids()) so a row with a
+# duplicate id given by hand is refused within its partition.
+partitioned_orders_command = """
+    CREATE TABLE IF NOT EXISTS orders (
+        id              SERIAL,
+        branch_id       INTEGER NOT NULL,
+        customer_id     INTEGER NOT NULL,
+        waiter_id       INTEGER NOT NULL,
+        accountant_id   INTEGER NOT NULL,
+        salon_id        INTEGER NOT NULL,
+        order_date      DATE NOT NULL,
+        reg_time        TIME NOT NULL,
+        total_cost      REAL NOT NULL,
+
+        PRIMARY KEY (id, order_date),
+
+        CONSTRAINT fk_branch
+            FOREIGN KEY (branch_id)
+                REFERENCES branch (id)
+                ON DELETE CASCADE,
+
+        CONSTRAINT fk_customer
+            FOREIGN KEY (customer_id)
+                REFERENCES customer (id)
+                ON DELETE CASCADE,
+
+        CONSTRAINT fk_employee
+            FOREIGN KEY (waiter_id)
+                REFERENCES employee (id)
+                ON DELETE CASCADE,
+
+            FOREIGN KEY (accountant_id)
+                REFERENCES employee (id)
+                ON DELETE CASCADE,
+
+        CONSTRAINT fk_salon
+            FOREIGN KEY (salon_id)
+                REFERENCES salon (id)
+                ON DELETE CASCADE
+    ) PARTITION BY RANGE (order_date)
+"""
+
+# 'order_foods' next to a partitioned 'orders': the foreign key needs the
+# order_date of the order, and {partition} optionally partitions the table too
+dated_order_foods_command = """
+    CREATE TABLE IF NOT EXISTS order_foods (
+        id              SERIAL,
+        order_id        INTEGER NOT NULL,
+        food_id         INTEGER NOT NULL,
+        order_date      DATE NOT NULL,
+
+        {primary_key},
+
+        CONSTRAINT fk_orders
+            FOREIGN KEY (order_id, order_date)
+                REFERENCES orders (id, order_date)
+                ON UPDATE CASCADE ON DELETE CASCADE,
+
+        CONSTRAINT fk_food
+            FOREIGN KEY (food_id)
+                REFERENCES food (id)
+                ON DELETE CASCADE
+    ) {partition}
+"""
+
+# Fill the order_date of new 'order_foods' rows from their order
+order_foods_date_commands = (
+    """
+    CREATE OR REPLACE FUNCTION order_foods_fill_date() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        IF NEW.order_date IS NULL THEN
+            SELECT order_date INTO NEW.order_date FROM orders WHERE id = NEW.order_id;
+        END IF;
+        RETURN NEW;
+    END;
+    $$
+    """,
+
+    "DROP TRIGGER IF EXISTS order_foods_fill_date ON order_foods",
+
+    """
+    CREATE TRIGGER order_foods_fill_date
+        BEFORE INSERT ON order_foods
+        FOR EACH ROW EXECUTE FUNCTION order_foods_fill_date()
+    """
+)
+
+# Calendar dimension: every day of 'calendar_years' with its Jalali parts.
+# Weeks start on Saturday, weekday 0 is Saturday and 6 is Friday, and week 1
+# of a year is the one holding 1 Farvardin.
+calendar_commands = (
+    """
+    CREATE TABLE IF NOT EXISTS calendar (
+        date            DATE PRIMARY KEY,
+        jalali          TEXT NOT NULL,
+        year            SMALLINT NOT NULL,
+        quarter         SMALLINT NOT NULL,
+        month           SMALLINT NOT NULL,
+        day             SMALLINT NOT NULL,
+        week            SMALLINT NOT NULL,
+        weekday         SMALLINT NOT NULL,
+        holiday         BOOLEAN NOT NULL
+    )
+    """,
+
+    "CREATE UNIQUE INDEX IF NOT EXISTS calendar_year_month_day_idx ON calendar (year, month, day) INCLUDE (date)",
+
+    # The lookup reads a table, so it is STABLE and not IMMUTABLE: a cached
+    # plan does not keep a folded date. A SQL function that reads a table is
+    # not inlined, and in a filter it runs once per row, so a query compares
+    # with (SELECT jalali_date(...)): the InitPlan runs it once per query.
+    """
+    CREATE OR REPLACE FUNCTION jalali_date(year INTEGER, month INTEGER, day INTEGER) RETURNS DATE
+    LANGUAGE sql STABLE STRICT PARALLEL SAFE AS $$
+        SELECT date FROM calendar WHERE calendar.year = $1 AND calendar.month = $2 AND calendar.day = $3
+    $$
+    """
+)
+
+# Jalali years covered by the calendar table
+calendar_years = (1300, 1500)
+
+# Fixed solar holidays as (month, day): Nowruz, Islamic Republic Day, Nature
+# Day, the 14 and 15 Khordad, Revolution Day and Oil Nationalization Day.
+# Fridays are holidays too. Lunar holidays move every year and are not included.
+jalali_holidays = frozenset(((1, 1), (1, 2), (1, 3), (1, 4), (1, 12), (1, 13),
+                             (3, 14), (3, 15), (11, 22), (12, 29)))
+
+# Rows of the calendar table for the Jalali years first_year to last_year
+def calendar_rows(first_year=calendar_years[0], last_year=calendar_years[1]):
+    for year in range(first_year, last_year + 1):
+        new_year = _jalali_new_year(year)
+        first_weekday = (new_year.weekday() + 2) % 7
+        day_of_year = 0
+        for month in range(1, 13):
+            for day in range(1, jalali_month_days(year, month) + 1):
+                date = new_year + datetime.timedelta(days=day_of_year)
+                weekday = (date.weekday() + 2) % 7
+                yield (date, "{0:04d}-{1:02d}-{2:02d}".format(year, month, day), year, (month - 1) // 3 + 1,
+                       month, day, (day_of_year + first_weekday) // 7 + 1, weekday,
+                       weekday == 6 or (month, day) in jalali_holidays)
+                day_of_year += 1
+
+# Create the calendar table and fill it when it is empty
+def _create_calendar(cur):
+    for command in calendar_commands:
+        cur.execute(command)
+
+    cur.execute("SELECT EXISTS (SELECT 1 FROM calendar)")
+    if not cur.fetchone()[0]:
+        column_types = ("date", "text", "integer", "integer", "integer", "integer", "integer", "integer", "boolean")
+        cur.copy_expert("COPY calendar FROM STDIN", _ChunkStream(_copy_chunks(calendar_rows(), column_types, "text", [0])))
+
+# Calendar columns each reporting period groups by
+period_columns = {
+    "year":         ("year",),
+    "quarter":      ("year", "quarter"),
+    "month":        ("year", "month"),
+    "week":         ("year", "week"),
+    "weekday":      ("weekday",)
+}
+
+# Order count and revenue of every branch per Jalali period, as rows of
+# (branch name, period columns..., order count, revenue). 'first' and 'last'
+# are Jalali dates bounding the orders. The range is applied to order_date
+# itself, so it uses the index and prunes partitions, and the calendar is
+# joined on its primary key. holidays=True or False keeps only those days.
+def period_report(period="month", first=None, last=None, holidays=None):
+
+    if period not in period_columns:
+        raise ValueError("period must be one of {0}".format(", ".join(period_columns)))
+    columns = ", ".join("calendar." + column for column in period_columns[period])
+
+    conditions, params = [], []
+    if first is not None:
+        conditions.append("orders.order_date >= %s")
+        params.append(_to_date(first))
+    if last is not None:
+        conditions.append("orders.order_date <= %s")
+        params.append(_to_date(last))
+    if holidays is not None:
+        conditions.append("calendar.holiday = %s")
+        params.append(holidays)
+
+    return execute_query("""
+        SELECT branch.name, {0}, COUNT(*), SUM(orders.total_cost::DOUBLE PRECISION)
+        FROM orders
+        JOIN calendar ON calendar.date = orders.order_date
+        JOIN branch ON branch.id = orders.branch_id
+        {1}
+        GROUP BY branch.name, {0}
+        ORDER BY branch.name, {0}
+    """.format(columns, "WHERE " + " AND ".join(conditions) if conditions else ""), tuple(params))
+
+# Create tables in the PostgreSQL database.
+# With partition_by = 'year' or 'month', 'orders' (and with partition_order_foods
+# also 'order_foods') is partitioned by order_date. A default partition takes
+# rows outside the created ranges, and partitions are created from the period
+# of 'partition_start' (a date, default today) to 'partitions_ahead' periods
+# after the current one.
+def create_tables(partition_by=None, partition_order_foods=False, partition_start=None, partitions_ahead=1):
+
+    global _partitioned
+
+    statements = list(commands)
+    if partition_by is not None:
+        if partition_by not in partition_periods:
+            raise ValueError("partition_by must be one of {0}".format(", ".join(partition_periods)))
+
+        statements[5] = partitioned_orders_command
+        statements[7] = dated_order_foods_command.format(
+            primary_key="PRIMARY KEY (id, order_date)" if partition_order_foods else "PRIMARY KEY (id)",
+            partition="PARTITION BY RANGE (order_date)" if partition_order_foods else "")
+
+    try:
+        # take a connection from the pool
+        with get_connection() as conn:
+            cur = conn.cursor()
+
+            # create table one by one
+            for command in statements:
+                cur.execute(command)
+
+            # create and fill the Jalali calendar dimension
+            _create_calendar(cur)
+
+            # create the first partitions, and let a partitioned 'order_foods' find its order dates
+            _partitioned = None
+            _primary_keys.clear()
+            if partition_by is not None:
+                partitioned = ["orders", "order_foods"] if partition_order_foods else ["orders"]
+                for table_name in partitioned:
+                    cur.execute("CREATE TABLE IF NOT EXISTS {0}_default PARTITION OF {0} DEFAULT".format(table_name))
+                    if table_name == "orders":
+                        _unique_order_ids(cur, "orders_default")
+                    _create_partitions(cur, table_name, partition_by, partition_start, partitions_ahead)
+
+                if not partition_order_foods:
+                    for command in order_foods_date_commands:
+                        cur.execute(command)
+
+            # create the managed indexes
+            managed = indexes + (trigram_indexes if _create_trigram_extension(cur) else ())
+            for name, table_name, definition in managed:
+                cur.execute("CREATE INDEX IF NOT EXISTS {0} ON {1} {2}".format(name, table_name, definition))
+
+            # create the summary tables and the triggers that maintain them
+            for command in summary_commands():
+                cur.execute(command)
+
+            # create the archive of the old orders
+            for command in archive_commands:
+                cur.execute(command)
+
+            # notify the lookup caches of changes to the small tables
+            for command in lookup_commands():
+                cur.execute(command)
+
+            # close communication with the PostgreSQL database server
+            cur.close()
+
+        # Execute a statement
+        print(":: All tables created successfully.\n")
+
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(error)
+
+# Periods a table can be partitioned by, partition names end in _y1400 or _m1400_01
+partition_periods = ("year", "month")
+_partition_name = re.compile(r"_(?:y(\d{4})|m(\d{4})_(\d{2}))$")
+
+# Partitioned tables among 'orders' and 'order_foods', None until looked up
+_partitioned = None
+
+# Return the set of partitioned tables among 'orders' and 'order_foods'.
+# With 'cached_only' nothing is queried, None tells it was not looked up yet.
+def partitioned_tables(cached_only=False):
+    global _partitioned
+
+    if _partitioned is None and not cached_only:
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT relname FROM pg_class
+                WHERE relkind = 'p' AND relname IN ('orders', 'order_foods') AND pg_table_is_visible(oid)
+            """)
+            _partitioned = frozenset(row[0] for row in cur.fetchall())
+            cur.close()
+
+    return _partitioned
+
+# Name and Gregorian bounds of the partition holding a Jalali (year, month) period
+def _partition_bounds(table_name, period, year, month):
+    next_year, next_month = _next_period(period, year, month)
+    low, high = jalali_to_gregorian(year, month, 1), jalali_to_gregorian(next_year, next_month, 1)
+
+    if period == "year":
+        return "{0}_y{1:04d}".format(table_name, year), low.isoformat(), high.isoformat()
+    return "{0}_m{1:04d}_{2:02d}".format(table_name, year, month), low.isoformat(), high.isoformat()
+
+# The (year, month) period after another one
+def _next_period(period, year, month):
+    if period == "year":
+        return year + 1, 1
+    return (year + 1, 1) if month == 12 else (year, month + 1)
+
+# Existing range partitions of a table as (name, period, year, month)
+def _partitions(cur, table_name):
+    cur.execute("""
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = inhparent
+        JOIN pg_class child ON child.oid = inhrelid
+        WHERE parent.relname = %s AND pg_table_is_visible(parent.oid)
+    """, (table_name,))
+
+    partitions = []
+    for (name,) in cur.fetchall():
+        match = _partition_name.search(name)
+        if match is None:
+            continue
+        if match.group(1):
+            partitions.append((name, "year", int(match.group(1)), 1))
+        else:
+            partitions.append((name, "month", int(match.group(2)), int(match.group(3))))
+
+    return sorted(partitions, key=lambda partition: partition[2:])
+
+# Create the partitions of a table from the period after its latest partition
+# (or of 'start') to 'ahead' periods after the period of the newest order.
+# Without orders the periods count from 'start', or from today.
+def _create_partitions(cur, table_name, period=None, start=None, ahead=1):
+
+    existing = _partitions(cur, table_name)
+    if period is None:
+        if not existing:
+            raise ValueError("'{0}' has no range partitions to continue".format(table_name))
+        period = existing[-1][1]
+
+    if start is not None:
+        start = _to_date(start)
+
+    cur.execute("SELECT MAX(order_date) FROM orders")
+    reference = gregorian_to_jalali(cur.fetchone()[0] or start or datetime.date.today())
+
+    if start is not None:
+        year, month, _ = gregorian_to_jalali(start)
+    elif existing:
+        year, month = _next_period(period, existing[-1][2], existing[-1][3])
+    else:
+        year, month = reference[:2]
+    if period == "year":
+        month = 1
+
+    last_year, last_month = reference[0], reference[1] if period == "month" else 1
+    for _ in range(ahead):
+        last_year, last_month = _next_period(period, last_year, last_month)
+
+    created = []
+    names = set(partition[0] for partition in existing)
+    while (year, month if period == "month" else 1) <= (last_year, last_month if period == "month" else 1):
+        name, low, high = _partition_bounds(table_name, period, year, month)
+        if name not in names:
+            cur.execute("CREATE TABLE {0} PARTITION OF {1} FOR VALUES FROM ('{2}') TO ('{3}')".format(
+                name, table_name, low, high))
+            created.append(name)
+            if table_name == "orders":
+                _unique_order_ids(cur, name)
+        year, month = _next_period(period, year, month)
+
+    return created
+
+# Unique index on the 'id' of a partition of 'orders'
+def _unique_order_ids(cur, partition):
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS {0}_id_key ON {0} (id)".format(partition))
+
+# Pre-create the upcoming partitions of every partitioned table.
+# A range that already has rows in the default partition cannot be created,
+# the error is reported and the other tables are still handled.
+def create_partitions(ahead=1, start=None):
+
+    created = []
+    for table_name in ("orders", "order_foods"):
+        if table_name not in partitioned_tables():
+            continue
+
+        try:
+            with get_connection() as conn:
+                cur = conn.cursor()
+                names = _create_partitions(cur, table_name, start=start, ahead=ahead)
+                cur.close()
+
+            for name in names:
+                print("   [Done] Creating partition '{0}'".format(name))
+            created.extend(names)
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            print("!! '{0}': {1}".format(table_name, error))
+
+    return created
+
+# Nodes of an EXPLAIN (FORMAT JSON) plan
+def _plan_nodes(plan):
+    yield plan
+    for child in plan.get("Plans", ()):
+        yield from _plan_nodes(child)
+
+# Check which partitions of 'orders' and 'order_foods' the planner keeps for
+# each query. Returns one dict per query and partitioned table with the number
+# of partitions scanned and the total number of partitions.
+def verify_partition_pruning(queries):
+
+    results = []
+    with get_connection() as conn:
+        cur = conn.cursor()
+
+        partitions = {}
+        for table_name in partitioned_tables():
+            cur.execute("""
+                SELECT child.relname FROM pg_inherits
+                JOIN pg_class child ON child.oid = inhrelid
+                WHERE inhparent = %s::regclass
+            """, (table_name,))
+            partitions[table_name] = set(row[0] for row in cur.fetchall())
+
+        for number, query in enumerate(queries, 1):
+            cur.execute("EXPLAIN (FORMAT JSON) " + query)
+            plan = cur.fetchone()[0][0]["Plan"]
+            scanned = set(node.get("Relation Name") for node in _plan_nodes(plan))
+
+            for table_name, names in sorted(partitions.items()):
+                used = scanned & names
+                if not used and table_name not in scanned:
+                    continue
+                results.append({
+                    "query":        number,
+                    "table":        table_name,
+                    "scanned":      len(used),
+                    "partitions":   len(names),
+                    "pruned":       len(used) < len(names)
+                })
+
+        cur.close()
+
+    return results
+
+# Indexes created by create_tables() and migrate_indexes(): (name, table, definition).
+# Foreign keys are indexed for the joins and cascading deletes, the rest serve the sample queries.
+indexes = (
+    ("employee_branch_id_idx",          "employee",     "(branch_id)"),
+    ("food_branch_id_idx",              "food",         "(branch_id)"),
+    ("food_chef_id_idx",                "food",         "(chef_id)"),
+    ("food_cost_covering_idx",          "food",         "(cost) INCLUDE (name, branch_id)"),
+    ("orders_branch_id_order_date_idx", "orders",       "(branch_id, order_date)"),
+    ("orders_customer_id_idx",          "orders",       "(customer_id)"),
+    ("orders_waiter_id_idx",            "orders",       "(waiter_id)"),
+    ("orders_accountant_id_idx",        "orders",       "(accountant_id)"),
+    ("orders_salon_id_idx",             "orders",       "(salon_id)"),
+    ("order_foods_order_id_idx",        "order_foods",  "(order_id)"),
+    ("order_foods_food_id_idx",         "order_foods",  "(food_id)"),
+    ("person_phone_number_idx",         "person",       '(phone_number COLLATE "C", id)'),
+    ("person_last_name_idx",            "person",       '(lower(last_name) COLLATE "C", lower(first_name) COLLATE "C", id)'),
+    ("person_first_name_idx",           "person",       '(lower(first_name) COLLATE "C", lower(last_name) COLLATE "C", id)')
+)
+
+# Indexes that need the pg_trgm extension, built only where it can be installed
+trigram_indexes = (
+    ("person_name_trgm_idx",            "person",       "USING gin ((lower(first_name || ' ' || last_name)) gin_trgm_ops)"),
+)
+
+# Install pg_trgm and return whether it is available
+def _create_trigram_extension(cur):
+    cur.execute("SAVEPOINT trigram")
+    try:
+        cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    except psycopg2.Error as error:
+        cur.execute("ROLLBACK TO SAVEPOINT trigram")
+        print("!! pg_trgm is not available, name searches will scan 'person': {0}".format(str(error).strip()))
+        return False
+    cur.execute("RELEASE SAVEPOINT trigram")
+    return True
+
+# Return None when an index does not exist, otherwise whether it is valid
+def _index_state(cur, name):
+    cur.execute("""
+        SELECT index.indisvalid
+        FROM pg_index index
+        JOIN pg_class class ON class.oid = index.indexrelid
+        WHERE class.relname = %s AND pg_table_is_visible(class.oid)
+    """, (name,))
+    state = cur.fetchone()
+
+    return None if state is None else state[0]
+
+# Build an index CONCURRENTLY, replacing an invalid one left by an interrupted build
+def _build_index(cur, name, table_name, definition, unique=False):
+    state = _index_state(cur, name)
+    if state:
         return False
 
-    finally:
-        if conn is not None:
-            conn.close()
-            print(":: Database connection closed.")
+    if state is not None:
+        cur.execute("DROP INDEX CONCURRENTLY IF EXISTS {0}".format(name))
+    cur.execute("CREATE {0}INDEX CONCURRENTLY {1} ON {2} {3}".format("UNIQUE " if unique else "", name, table_name, definition))
 
-# Create tables in the PostgreSQL database
-def create_tables():
+    return True
 
-    commands = (
-        """
-        CREATE TABLE IF NOT EXISTS branch (
-            id              INTEGER NOT NULL PRIMARY KEY,
-            name            TEXT NOT NULL,
-            state           TEXT NOT NULL,
-            city            TEXT NOT NULL,
-            street          TEXT NOT NULL,
-            date            DATE NOT NULL
-        )
-        """,
+# Build the managed indexes on an existing database without blocking writes.
+# Every index is built with CREATE INDEX CONCURRENTLY, and an invalid index
+# left behind by an interrupted build is dropped and built again. A partitioned
+# table gets its index ON ONLY the parent, then every partition builds its own
+# index concurrently and attaches it. Partitions of 'orders' made before their
+# unique index on 'id' existed get it too.
+def migrate_indexes():
 
-        """
-        CREATE TABLE IF NOT EXISTS person (
-            id              INTEGER NOT NULL PRIMARY KEY,
-            first_name      TEXT NOT NULL,
-            last_name       TEXT NOT NULL,
-            gender          TEXT NOT NULL,
-            phone_number    TEXT NOT NULL
-        )
-        """,
+    try:
+        with get_connection(autocommit=True) as conn:
+            cur = conn.cursor()
 
-        """
-        CREATE TABLE IF NOT EXISTS employee (
-            id              INTEGER PRIMARY KEY,
-            branch_id       INTEGER NOT NULL,
-            post            TEXT NOT NULL,
-            degree          TEXT NOT NULL,
-            birth_date      DATE NOT NULL,
-            salary          REAL NOT NULL,
-            state           TEXT NOT NULL,
-            married         TEXT NOT NULL,
-
-            CONSTRAINT fk_person
-                FOREIGN KEY (id)
-                    REFERENCES person (id)
-                    ON UPDATE CASCADE ON DELETE CASCADE,
-
-            CONSTRAINT fk_branch
-                FOREIGN KEY (branch_id)
-                    REFERENCES branch (id)
-                    ON DELETE CASCADE
-        )
-        """,
+            cur.execute("BEGIN")
+            managed = indexes + (trigram_indexes if _create_trigram_extension(cur) else ())
+            cur.execute("COMMIT")
 
-        """
-        CREATE TABLE IF NOT EXISTS customer (
-            id              INTEGER PRIMARY KEY,
+            for name, table_name, definition in managed:
+                start = time.perf_counter()
 
-            CONSTRAINT fk_person
-                FOREIGN KEY (id)
-                    REFERENCES person (id)
-                    ON UPDATE CASCADE ON DELETE CASCADE
-        )
-        """,
+                if table_name in partitioned_tables():
+                    if _index_state(cur, name):
+                        print("   [Skip] '{0}' already exists".format(name))
+                        continue
+
+                    cur.execute("CREATE INDEX IF NOT EXISTS {0} ON ONLY {1} {2}".format(name, table_name, definition))
+                    cur.execute("SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = %s::regclass",
+                                (table_name,))
+                    for (partition,) in cur.fetchall():
+                        partition_index = partition + name[len(table_name):]
+                        _build_index(cur, partition_index, partition, definition)
+                        cur.execute("ALTER INDEX {0} ATTACH PARTITION {1}".format(name, partition_index))
+
+                elif not _build_index(cur, name, table_name, definition):
+                    print("   [Skip] '{0}' already exists".format(name))
+                    continue
+
+                print("   [Done] Building '{0}' ({1:.2f}s)".format(name, time.perf_counter() - start))
+
+            if "orders" in partitioned_tables():
+                cur.execute("SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = 'orders'::regclass")
+                for (partition,) in cur.fetchall():
+                    start = time.perf_counter()
+                    if _build_index(cur, partition + "_id_key", partition, "(id)", unique=True):
+                        print("   [Done] Building '{0}_id_key' ({1:.2f}s)".format(partition, time.perf_counter() - start))
+
+            cur.close()
+
+        print(":: All indexes are in place.")
+        return True
+
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(error)
+        return False
 
+# Summary tables kept current by triggers on 'orders' and 'order_foods'
+summary_tables = ("branch_revenue", "customer_revenue", "food_sales")
+
+# Aggregates of the summary tables over the base tables: (summary, key columns, value columns, query)
+summary_sources = (
+    ("branch_revenue", ("branch_id", "year"), ("order_count", "income"),
+     """
+        SELECT branch_id, calendar.year::INTEGER AS year,
+               COUNT(*) AS order_count, SUM(total_cost::DOUBLE PRECISION) AS income
+        FROM {orders} AS source
+        JOIN calendar ON calendar.date = source.order_date
+        GROUP BY 1, 2
+     """),
+
+    ("customer_revenue", ("branch_id", "customer_id"), ("order_count", "total_purchase"),
+     """
+        SELECT branch_id, customer_id,
+               COUNT(*) AS order_count, SUM(total_cost::DOUBLE PRECISION) AS total_purchase
+        FROM {orders}
+        GROUP BY 1, 2
+     """),
+
+    ("food_sales", ("food_id",), ("sold_count",),
+     """
+        SELECT food_id, COUNT(*) AS sold_count
+        FROM {order_foods}
+        GROUP BY 1
+     """)
+)
+
+# Statement that adds the aggregates of 'rows' times 'sign' to a summary table.
+# Rows are locked in key order, so concurrent loads cannot deadlock on them.
+def _summary_upsert(summary, keys, values, query, rows, sign):
+    changes = ", ".join("{0} = summary.{0} + EXCLUDED.{0}".format(value) for value in values)
+    signed = ", ".join("{0} * {1}".format(sign, value) for value in values)
+
+    return """
+        INSERT INTO {summary} AS summary ({columns})
+        SELECT {keys}, {signed} FROM ({query}) AS delta
+        ORDER BY {keys}
+        ON CONFLICT ({keys}) DO UPDATE SET {changes};
+    """.format(summary=summary, columns=", ".join(keys + values), keys=", ".join(keys), signed=signed,
+               query=query.format(orders=rows, order_foods=rows), changes=changes)
+
+# Tables, trigger functions and triggers of the summaries.
+# Statement-level triggers read the transition tables, so a COPY of many rows
+# updates each summary row once. INSERT adds the new rows, DELETE subtracts the
+# old rows and UPDATE does both.
+# The summary rows are updated inside the writing transaction, so every order
+# of a branch waits for the branch_revenue row of the one before it to commit:
+# concurrent order writes are serialized per branch. On the two-branch sample
+# schema loadsim.py saturates at 2 waiters, from 4 on most backends wait on
+# Lock:transactionid. Orders of many branches still scale, a single busy
+# branch does not.
+def summary_commands():
+
+    commands = [
         """
-        CREATE TABLE IF NOT EXISTS salon (
-            id              INTEGER NOT NULL PRIMARY KEY,
-            capacity        INTEGER NOT NULL,
-            type            TEXT NOT NULL,
-            floor           INTEGER NOT NULL
+        CREATE TABLE IF NOT EXISTS branch_revenue (
+            branch_id       INTEGER NOT NULL,
+            year            INTEGER NOT NULL,
+            order_count     BIGINT NOT NULL,
+            income          DOUBLE PRECISION NOT NULL,
+
+            PRIMARY KEY (branch_id, year)
         )
         """,
 
         """
-        CREATE TABLE IF NOT EXISTS orders (
-            id              SERIAL PRIMARY KEY,
+        CREATE TABLE IF NOT EXISTS customer_revenue (
             branch_id       INTEGER NOT NULL,
             customer_id     INTEGER NOT NULL,
-            waiter_id       INTEGER NOT NULL,
-            accountant_id   INTEGER NOT NULL,
-            salon_id        INTEGER NOT NULL,
-            order_date      DATE NOT NULL,
-            reg_time        TIME NOT NULL,
-            total_cost      REAL NOT NULL,
-            
-            CONSTRAINT fk_branch
-                FOREIGN KEY (branch_id)
-                    REFERENCES branch (id)
-                    ON DELETE CASCADE,
-
-            CONSTRAINT fk_customer
-                FOREIGN KEY (customer_id)
-                    REFERENCES customer (id)
-                    ON DELETE CASCADE,
-
-            CONSTRAINT fk_employee
-                FOREIGN KEY (waiter_id)
-                    REFERENCES employee (id)
-                    ON DELETE CASCADE,
-
-                FOREIGN KEY (accountant_id)
-                    REFERENCES employee (id)
-                    ON DELETE CASCADE,
-
-            CONSTRAINT fk_salon
-                FOREIGN KEY (salon_id)
-                    REFERENCES salon (id)
-                    ON DELETE CASCADE
+            order_count     BIGINT NOT NULL,
+            total_purchase  DOUBLE PRECISION NOT NULL,
+
+            PRIMARY KEY (branch_id, customer_id)
         )
         """,
 
         """
-        CREATE TABLE IF NOT EXISTS food (
-            id              INTEGER NOT NULL PRIMARY KEY,
-            branch_id       INTEGER NOT NULL,
-            chef_id         INTEGER NOT NULL,
-            name            TEXT NOT NULL,
-            type            TEXT NOT NULL,
-            cost            REAL NOT NULL,
-
-            CONSTRAINT fk_branch
-                FOREIGN KEY (branch_id)
-                    REFERENCES branch (id)
-                    ON DELETE CASCADE,
-            
-            CONSTRAINT fk_employee
-                FOREIGN KEY (chef_id)
-                    REFERENCES employee (id)
-                    ON DELETE CASCADE
-        )
+        CREATE INDEX IF NOT EXISTS customer_revenue_top_idx
+            ON customer_revenue (branch_id, total_purchase DESC)
         """,
 
         """
-        CREATE TABLE IF NOT EXISTS order_foods (
-            id              SERIAL PRIMARY KEY,
-            order_id        INTEGER NOT NULL,
-            food_id         INTEGER NOT NULL,
-
-            CONSTRAINT fk_orders
-                FOREIGN KEY (order_id)
-                    REFERENCES orders (id)
-                    ON DELETE CASCADE,
-
-            CONSTRAINT fk_food
-                FOREIGN KEY (food_id)
-                    REFERENCES food (id)
-                    ON DELETE CASCADE
+        CREATE TABLE IF NOT EXISTS food_sales (
+            food_id         INTEGER NOT NULL PRIMARY KEY,
+            sold_count      BIGINT NOT NULL
         )
-        """,     
+        """
+    ]
+
+    for table_name in ("orders", "order_foods"):
+        sources = [source for source in summary_sources if "{" + table_name + "}" in source[3]]
+
+        added = "".join(_summary_upsert(*source, rows="new_rows", sign=1) for source in sources)
+        removed = "".join(_summary_upsert(*source, rows="old_rows", sign=-1) for source in sources)
+
+        commands.append("""
+        CREATE OR REPLACE FUNCTION {0}_summary_apply() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                {1}
+            END IF;
+
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                {2}
+            END IF;
+
+            RETURN NULL;
+        END;
+        $$
+        """.format(table_name, removed, added))
+
+        transitions = {
+            "insert":   "NEW TABLE AS new_rows",
+            "update":   "OLD TABLE AS old_rows NEW TABLE AS new_rows",
+            "delete":   "OLD TABLE AS old_rows"
+        }
+        for event, transition in transitions.items():
+            commands.append("DROP TRIGGER IF EXISTS {0}_summary_{1} ON {0}".format(table_name, event))
+            commands.append("""
+            CREATE TRIGGER {0}_summary_{1}
+                AFTER {2} ON {0}
+                REFERENCING {3}
+                FOR EACH STATEMENT EXECUTE FUNCTION {0}_summary_apply()
+            """.format(table_name, event, event.upper(), transition))
+
+    return commands
+
+# Recompute every summary table from 'orders' and 'order_foods'.
+# Writes to both tables wait until the rebuild commits.
+def rebuild_summaries():
+
+    try:
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("LOCK TABLE orders, order_foods IN SHARE MODE")
+
+            for summary, keys, values, query in summary_sources:
+                start = time.perf_counter()
+                cur.execute("TRUNCATE {0}".format(summary))
+                cur.execute("INSERT INTO {0} ({1}) {2}".format(
+                    summary, ", ".join(keys + values), query.format(orders="orders", order_foods="order_foods")))
+                print("   [Done] Rebuilding '{0}' with {1} rows ({2:.2f}s)".format(
+                    summary, cur.rowcount, time.perf_counter() - start))
+
+            cur.close()
+
+        invalidate_cache(*summary_tables)
+        return True
+
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(error)
+        return False
+
+# Compare every summary table with a fresh aggregate of the base tables.
+# Returns the number of differing rows of each summary, rows whose counts are
+# zero are treated as missing.
+def check_summaries():
+
+    mismatches = {}
+    try:
+        with get_connection() as conn:
+            cur = conn.cursor()
+
+            for summary, keys, values, query in summary_sources:
+                join = " AND ".join("summary.{0} = expected.{0}".format(key) for key in keys)
+                differs = " OR ".join(
+                    "abs(COALESCE(summary.{0}, 0) - COALESCE(expected.{0}, 0)) > 0.01".format(value)
+                    for value in values)
+
+                cur.execute("""
+                    SELECT COUNT(*)
+                    FROM (SELECT * FROM {summary} WHERE {count} <> 0) AS summary
+                    FULL OUTER JOIN ({query}) AS expected ON {join}
+                    WHERE {differs}
+                """.format(summary=summary, count=values[0], join=join, differs=differs,
+                           query=query.format(orders="orders", order_foods="order_foods")))
+                mismatches[summary] = cur.fetchone()[0]
+
+            cur.close()
+
+        return mismatches
+
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(error)
+        return None
+
+# Tables the old orders and their items are moved to by archive_orders(), the
+# progress of every archival run keyed by its cutoff date, and views of the
+# live and the archived rows together for the reports
+archive_commands = (
+    "CREATE TABLE IF NOT EXISTS orders_archive (LIKE orders, PRIMARY KEY (id))",
+    "CREATE TABLE IF NOT EXISTS order_foods_archive (LIKE order_foods, PRIMARY KEY (id))",
+    "CREATE INDEX IF NOT EXISTS order_foods_archive_order_id_idx ON order_foods_archive (order_id)",
+
+    """
+    CREATE TABLE IF NOT EXISTS archive_progress (
+        cutoff          DATE PRIMARY KEY,
+        last_id         INTEGER NOT NULL DEFAULT 0,
+        orders          BIGINT NOT NULL DEFAULT 0,
+        items           BIGINT NOT NULL DEFAULT 0,
+        started         TIMESTAMPTZ NOT NULL DEFAULT now(),
+        updated         TIMESTAMPTZ NOT NULL DEFAULT now(),
+        finished        TIMESTAMPTZ
     )
+    """,
+
+    "CREATE OR REPLACE VIEW all_orders AS SELECT * FROM orders UNION ALL SELECT * FROM orders_archive",
+    "CREATE OR REPLACE VIEW all_order_foods AS SELECT * FROM order_foods UNION ALL SELECT * FROM order_foods_archive"
+)
+
+# Statements that lock the summary rows a batch of orders contributes to, in
+# the order the triggers of a new order lock them, so an archival batch and
+# live orders cannot deadlock on the summaries
+def _summary_lock_statements():
+
+    statements = []
+    for summary, keys, values, query in summary_sources:
+        statements.append("""
+            WITH batch_orders AS (SELECT * FROM orders WHERE id = ANY(%(ids)s)),
+                 batch_items AS (SELECT * FROM order_foods WHERE order_id = ANY(%(ids)s))
+            SELECT 1 FROM {0}
+            WHERE ({1}) IN (SELECT {1} FROM ({2}) AS batch)
+            ORDER BY {1}
+            FOR UPDATE
+        """.format(summary, ", ".join(keys), query.format(orders="batch_orders", order_foods="batch_items")))
+    return statements
+
+# Move the orders dated before 'cutoff', with their items, to the archive
+# tables in batches of 'batch_size' orders. Every batch is a short transaction
+# that waits at most 'lock_timeout' seconds for a lock and is retried later
+# when it had to give up, with 'pause' seconds between the batches. The
+# progress is saved with every batch, so a stopped run resumes where it left
+# off when it is started again with the same cutoff. 'max_batches' stops
+# after that many batches. The summary tables keep describing the live orders.
+def archive_orders(cutoff, batch_size=1000, pause=0.0, lock_timeout=2.0, max_batches=None, retries=10):
+
+    cutoff = _to_date(cutoff)
+    stats = {"cutoff": cutoff, "batches": 0, "orders": 0, "items": 0, "retries": 0, "finished": False}
 
-    conn = None
     try:
-        # read the connection parameters
-        params = config()
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                INSERT INTO archive_progress (cutoff) VALUES (%s)
+                ON CONFLICT (cutoff) DO UPDATE SET finished = NULL
+                RETURNING last_id, orders, items
+            """, (cutoff,))
+            last_id, archived, archived_items = cur.fetchone()
+            cur.execute("SELECT COUNT(*) FROM orders WHERE id > %s AND order_date < %s", (last_id, cutoff))
+            remaining = cur.fetchone()[0]
+            conn.commit()
+
+            if archived:
+                print(":: Resuming the archival before {0} after order {1}, {2} orders already archived.".format(
+                    cutoff, last_id, archived))
+            print(":: Archiving {0} orders dated before {1} ...".format(remaining, cutoff))
+
+            # Items of a partitioned schema carry the order date, which prunes their partitions
+            dated = " AND order_date < %(cutoff)s" if "orders" in partitioned_tables() else ""
+            lock_statements = _summary_lock_statements()
+            start = reported = time.perf_counter()
+            failures = 0
+
+            while max_batches is None or stats["batches"] < max_batches:
+                try:
+                    cur.execute("SET LOCAL lock_timeout = %s", ("{0}ms".format(int(lock_timeout * 1000)),))
+                    cur.execute("SELECT last_id FROM archive_progress WHERE cutoff = %s FOR UPDATE", (cutoff,))
+                    last_id = cur.fetchone()[0]
+                    cur.execute("""
+                        SELECT id FROM orders
+                        WHERE id > %s AND order_date < %s
+                        ORDER BY id
+                        LIMIT %s
+                        FOR UPDATE
+                    """, (last_id, cutoff, batch_size))
+                    ids = [row[0] for row in cur.fetchall()]
+
+                    if not ids:
+                        cur.execute("UPDATE archive_progress SET finished = now(), updated = now() WHERE cutoff = %s",
+                                    (cutoff,))
+                        conn.commit()
+                        stats["finished"] = True
+                        break
+
+                    params = {"ids": ids, "cutoff": cutoff}
+                    for statement in lock_statements:
+                        cur.execute(statement, params)
+
+                    cur.execute("INSERT INTO order_foods_archive SELECT * FROM order_foods "
+                                "WHERE order_id = ANY(%(ids)s)" + dated, params)
+                    items = cur.rowcount
+                    # The delete cascades to the items copied above
+                    cur.execute("""
+                        WITH moved AS (
+                            DELETE FROM orders WHERE id = ANY(%(ids)s) AND order_date < %(cutoff)s RETURNING *
+                        )
+                        INSERT INTO orders_archive SELECT * FROM moved
+                    """, params)
+                    orders = cur.rowcount
+                    cur.execute("""
+                        UPDATE archive_progress
+                        SET last_id = %s, orders = orders + %s, items = items + %s, updated = now()
+                        WHERE cutoff = %s
+                    """, (ids[-1], orders, items, cutoff))
+                    conn.commit()
+
+                except (psycopg2.errors.LockNotAvailable, psycopg2.errors.DeadlockDetected) as error:
+                    # Live transactions hold the rows, give way and try the batch again
+                    conn.rollback()
+                    failures += 1
+                    stats["retries"] += 1
+                    if failures > retries:
+                        raise
+                    time.sleep(min(lock_timeout, 0.1 * failures))
+                    continue
+
+                failures = 0
+                stats["batches"] += 1
+                stats["orders"] += orders
+                stats["items"] += items
+
+                now = time.perf_counter()
+                if now - reported >= 1.0:
+                    reported = now
+                    print("   [Progress] {0} of {1} orders ({2:.0%}), {3} items, {4:.0f} orders/s".format(
+                        stats["orders"], remaining, stats["orders"] / remaining if remaining else 1.0,
+                        stats["items"], stats["orders"] / (now - start)))
+
+                if pause:
+                    time.sleep(pause)
+
+            cur.close()
+
+        stats["seconds"] = time.perf_counter() - start
+        stats["orders_per_second"] = stats["orders"] / stats["seconds"] if stats["seconds"] else 0.0
+        print("   [Done] Archived {0} orders and {1} items in {2} batches ({3:.2f}s){4}".format(
+            stats["orders"], stats["items"], stats["batches"], stats["seconds"],
+            "" if stats["finished"] else ", stopped before the end"))
+        return stats
 
-        # connect to the PostgreSQL server
-        conn = psycopg2.connect(**params)
-        cur = conn.cursor()
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(error)
+        return None
+
+    finally:
+        invalidate_cache("orders", "order_foods", "orders_archive", "order_foods_archive")
 
-        # create table one by one
-        for command in commands:
-            cur.execute(command)
+# Progress of every archival run and the size of the archive
+def archive_status():
 
-        # close communication with the PostgreSQL database server
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT cutoff, last_id, orders, items, started, updated, finished
+            FROM archive_progress
+            ORDER BY cutoff
+        """)
+        runs = [dict(zip(("cutoff", "last_id", "orders", "items", "started", "updated", "finished"), row))
+                for row in cur.fetchall()]
+        cur.execute("SELECT (SELECT COUNT(*) FROM orders_archive), (SELECT COUNT(*) FROM order_foods_archive)")
+        orders, items = cur.fetchone()
         cur.close()
 
-        # commit the changes
-        conn.commit()
+    return {"runs": runs, "orders": orders, "items": items}
 
-        # Execute a statement
-        print(":: All tables created successfully.\n")
+# Drop every table of the schema with its data
+def drop_tables():
+
+    global _partitioned
+
+    try:
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("DROP TABLE IF EXISTS " + ", ".join(summary_tables) + ", "
+                        "order_foods_archive, orders_archive, archive_progress, "
+                        "order_foods, food, orders, salon, customer, employee, person, branch, calendar CASCADE")
+            cur.close()
+
+        _partitioned = None
+
+        _primary_keys.clear()
+        if query_cache is not None:
+            query_cache.clear()
+        if lookup_cache is not None:
+            lookup_cache.clear()
+
+        print(":: All tables dropped successfully.\n")
 
     except (Exception, psycopg2.DatabaseError) as error:
         print(error)
 
+# INSERT statement of every table, the SERIAL ids are left to their DEFAULT
+sql = {
+    "branch":       "INSERT INTO branch VALUES(%s, %s, %s, %s, %s, %s)",
+    "person":       "INSERT INTO person VALUES(%s, %s, %s, %s, %s)",
+    "employee":     "INSERT INTO employee VALUES(%s, %s, %s, %s, %s, %s, %s, %s)",
+    "customer":     "INSERT INTO customer VALUES(%s)",
+    "salon":        "INSERT INTO salon VALUES(%s, %s, %s, %s)",
+    "orders":       "INSERT INTO orders VALUES(DEFAULT, %s, %s, %s, %s, %s, %s, %s, %s)",
+    "food":         "INSERT INTO food VALUES(%s, %s, %s, %s, %s, %s)",
+    "order_foods":  "INSERT INTO order_foods VALUES(DEFAULT, %s, %s)"
+}
+
+# INSERT statement of a table for the current schema. Next to a partitioned
+# 'orders', an item takes the order_date of its order in the same statement.
+def insert_statement(table_name):
+    if table_name == "order_foods" and "orders" in partitioned_tables():
+        return """
+            INSERT INTO order_foods (order_id, food_id, order_date)
+            SELECT item.order_id, item.food_id, orders.order_date
+            FROM (VALUES (%s, %s)) AS item (order_id, food_id)
+            LEFT JOIN orders ON orders.id = item.order_id
+        """
+    return sql[table_name]
+
+# Columns and types of every table, in table order
+table_columns = {
+    "branch":       (("id", "integer"), ("name", "text"), ("state", "text"), ("city", "text"),
+                     ("street", "text"), ("date", "date")),
+    "person":       (("id", "integer"), ("first_name", "text"), ("last_name", "text"),
+                     ("gender", "text"), ("phone_number", "text")),
+    "employee":     (("id", "integer"), ("branch_id", "integer"), ("post", "text"), ("degree", "text"),
+                     ("birth_date", "date"), ("salary", "real"), ("state", "text"), ("married", "text")),
+    "customer":     (("id", "integer"),),
+    "salon":        (("id", "integer"), ("capacity", "integer"), ("type", "text"), ("floor", "integer")),
+    "orders":       (("id", "integer"), ("branch_id", "integer"), ("customer_id", "integer"),
+                     ("waiter_id", "integer"), ("accountant_id", "integer"), ("salon_id", "integer"),
+                     ("order_date", "date"), ("reg_time", "time"), ("total_cost", "real")),
+    "food":         (("id", "integer"), ("branch_id", "integer"), ("chef_id", "integer"),
+                     ("name", "text"), ("type", "text"), ("cost", "real")),
+    "order_foods":  (("id", "integer"), ("order_id", "integer"), ("food_id", "integer"))
+}
+
+# SERIAL columns, rows given to copy_data() come without them by default
+serial_columns = {
+    "orders":       "id",
+    "order_foods":  "id"
+}
+
+# Return the column names copy_data() expects for a table
+def copy_columns(table_name):
+    serial = serial_columns.get(table_name)
+    return tuple(name for name, _ in table_columns[table_name] if name != serial)
+
+# A read-only file object over an iterator of byte chunks.
+# COPY ... FROM STDIN pulls from it, so only one chunk is held at a time.
+class _ChunkStream:
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b""
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+
+        if size < 0:
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+
+        return data
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+# Convert a value into a datetime.date
+def _to_date(value):
+    if isinstance(value, datetime.date):
+        return value
+    return _parse_date(str(value))
+
+# Gregorian date of 1 Farvardin 1400, the anchor of the Jalali conversions
+_JALALI_ANCHOR = (1400, datetime.date(2021, 3, 21))
+
+# Whether a Jalali (Solar Hijri) year has 366 days, by the 33-year rule
+def jalali_leap(year):
+    return year % 33 in (1, 5, 9, 13, 17, 22, 26, 30)
+
+# Days of a Jalali month: 31 in the first six months, 30 in the next five,
+# and 29 or 30 in Esfand
+def jalali_month_days(year, month):
+    if month <= 6:
+        return 31
+    if month <= 11:
+        return 30
+    return 30 if jalali_leap(year) else 29
+
+# Gregorian date of 1 Farvardin of a Jalali year
+@functools.lru_cache(maxsize=None)
+def _jalali_new_year(year):
+    anchor_year, anchor = _JALALI_ANCHOR
+    days = sum(366 if jalali_leap(y) else 365 for y in range(min(year, anchor_year), max(year, anchor_year)))
+    return anchor + datetime.timedelta(days=days if year >= anchor_year else -days)
+
+# Days from 1 Farvardin to the first day of a Jalali month
+def _jalali_month_offset(month):
+    return (month - 1) * 31 if month <= 7 else 186 + (month - 7) * 30
+
+# Convert a Jalali date to a datetime.date
+def jalali_to_gregorian(year, month, day):
+    if not 1 <= month <= 12 or not 1 <= day <= jalali_month_days(year, month):
+        raise ValueError("{0:04d}-{1:02d}-{2:02d} is not a Jalali date".format(year, month, day))
+    return _jalali_new_year(year) + datetime.timedelta(days=_jalali_month_offset(month) + day - 1)
+
+# Convert a datetime.date to a Jalali (year, month, day)
+def gregorian_to_jalali(date):
+    year = date.year - 621
+    if date < _jalali_new_year(year):
+        year -= 1
+
+    days = (date - _jalali_new_year(year)).days
+    month = 1 + days // 31 if days < 186 else 7 + (days - 186) // 30
+    return year, month, days - _jalali_month_offset(month) + 1
+
+# Parse a 'YYYY-MM-DD' date. Dates are written in the Jalali calendar
+# throughout the application, a year before 1700 is read as Jalali and
+# converted; later years are taken as Gregorian.
+@functools.lru_cache(maxsize=65536)
+def _parse_date(text):
+    year, month, day = (int(part) for part in text.strip().split("-"))
+    if year < 1700:
+        return jalali_to_gregorian(year, month, day)
+    return datetime.date(year, month, day)
+
+# Convert the date values of a row for an INSERT into 'columns' of a table,
+# copy_columns(table_name) by default
+def database_row(table_name, row, columns=None):
+    types = dict(table_columns[table_name])
+    columns = columns or copy_columns(table_name)
+    return tuple(_to_date(value) if value is not None and types.get(column) == "date" else value
+                 for column, value in zip(columns, row))
+
+# Convert a value like '18:05', '18:05:30' or '06:05 PM' into a datetime.time
+def _to_time(value):
+    if isinstance(value, datetime.time):
+        return value
+
+    value = str(value).strip()
+    for time_format in ("%I:%M %p", "%I:%M:%S %p", "%H:%M", "%H:%M:%S"):
+        try:
+            return datetime.datetime.strptime(value, time_format).time()
+        except ValueError:
+            pass
+
+    return datetime.time.fromisoformat(value)
+
+# Escape a value for the COPY text format
+def _text_value(value, column_type=None):
+    if value is None:
+        return "\\N"
+    if column_type == "date":
+        value = _to_date(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+
+    return (str(value)
+            .replace("\\", "\\\\")
+            .replace("\t", "\\t")
+            .replace("\n", "\\n")
+            .replace("\r", "\\r"))
+
+# Day zero of the PostgreSQL binary date format
+_PG_EPOCH = datetime.date(2000, 1, 1)
+
+# Encode a value for the COPY binary format
+def _binary_value(value, column_type):
+    if value is None:
+        return b"\xff\xff\xff\xff"
+
+    if column_type == "integer":
+        data = struct.pack("!i", int(value))
+    elif column_type == "real":
+        data = struct.pack("!f", float(value))
+    elif column_type == "date":
+        data = struct.pack("!i", (_to_date(value) - _PG_EPOCH).days)
+    elif column_type == "time":
+        value = _to_time(value)
+        data = struct.pack("!q", ((value.hour * 60 + value.minute) * 60 + value.second) * 1000000 + value.microsecond)
+    else:
+        data = str(value).encode("utf-8")
+
+    return struct.pack("!i", len(data)) + data
+
+# Encode rows as COPY text or binary data, 'counter' receives the number of rows
+def _copy_chunks(rows, column_types, copy_format, counter, batch_size=1000):
+
+    if copy_format == "binary":
+        yield b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+
+    field_count = struct.pack("!h", len(column_types))
+    batch = []
+    for row in rows:
+        if copy_format == "binary":
+            batch.append(field_count + b"".join(_binary_value(value, column_type)
+                                                for value, column_type in zip(row, column_types)))
+        else:
+            batch.append(("\t".join(_text_value(value, column_type)
+                                     for value, column_type in zip(row, column_types)) + "\n").encode("utf-8"))
+
+        if len(batch) == batch_size:
+            counter[0] += len(batch)
+            yield b"".join(batch)
+            batch = []
+
+    counter[0] += len(batch)
+    if batch:
+        yield b"".join(batch)
+
+    if copy_format == "binary":
+        yield struct.pack("!h", -1)
+
+# Stream any iterable of tuples into a table with COPY ... FROM STDIN.
+# 'copy_format' is "text" or "binary", 'columns' defaults to copy_columns(table_name).
+# Errors are raised, and the number of rows and the load rate are returned.
+def copy_data(table_name, rows, copy_format="text", columns=None):
+
+    if columns is None:
+        columns = copy_columns(table_name)
+    types = dict(table_columns[table_name])
+    column_types = [types[column] for column in columns]
+
+    # Next to a partitioned 'orders', item rows without their order_date are
+    # staged and joined with 'orders' in one statement. A partitioned
+    # 'order_foods' needs the date before any trigger could fill it in.
+    staged = table_name == "order_foods" and "order_date" not in columns and "orders" in partitioned_tables()
+    target = "order_foods_staging" if staged else table_name
+
+    command = "COPY {0} ({1}) FROM STDIN WITH (FORMAT {2})".format(
+        target, ", ".join(columns), copy_format)
+
+    counter = [0]
+    start = time.perf_counter()
+
+    call = instrument("copy", table_name)
+    try:
+        with call:
+            with get_connection(call=call) as conn:
+                cur = conn.cursor()
+                with call.phase("execute"):
+                    if staged:
+                        cur.execute("CREATE TEMP TABLE order_foods_staging "
+                                    "(id INTEGER, order_id INTEGER, food_id INTEGER) ON COMMIT DROP")
+
+                    cur.copy_expert(command, _ChunkStream(_copy_chunks(rows, column_types, copy_format, counter)),
+                                    size=65536)
+
+                    if staged:
+                        cur.execute("""
+                            INSERT INTO order_foods ({0}, order_date)
+                            SELECT {1}, orders.order_date
+                            FROM order_foods_staging AS staging
+                            LEFT JOIN orders ON orders.id = staging.order_id
+                        """.format(", ".join(columns), ", ".join("staging." + column for column in columns)))
+
+                cur.close()
+            call.rows = counter[0]
     finally:
-        if conn is not None:
-            conn.close()
+        invalidate_cache(table_name)
+
+    seconds = time.perf_counter() - start
+
+    return {
+        "rows":             counter[0],
+        "seconds":          seconds,
+        "rows_per_second":  counter[0] / seconds if seconds > 0 else 0.0
+    }
 
 # Insert multiple row into tables
 def insert_data(table_name, data_list):
 
-    sql = {
-        "branch":       "INSERT INTO branch VALUES(%s, %s, %s, %s, %s, %s)",
-        "person":       "INSERT INTO person VALUES(%s, %s, %s, %s, %s)",
-        "employee":     "INSERT INTO employee VALUES(%s, %s, %s, %s, %s, %s, %s, %s)",
-        "customer":     "INSERT INTO customer VALUES(%s)",
-        "salon":        "INSERT INTO salon VALUES(%s, %s, %s, %s)",
-        "orders":       "INSERT INTO orders VALUES(DEFAULT, %s, %s, %s, %s, %s, %s, %s, %s)",
-        "food":         "INSERT INTO food VALUES(%s, %s, %s, %s, %s, %s)",
-        "order_foods":  "INSERT INTO order_foods VALUES(DEFAULT, %s, %s)"
-    }
+    try:
+        # Stream the rows through COPY, the changes are committed on exit
+        copy_data(table_name, data_list)
 
-    conn = None
+    # If any exception occurred, display the error message
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(error)
+
+# Primary key columns of every table, read from the catalog
+_primary_keys = {}
+
+def _primary_key(cur, table_name):
+    if table_name not in _primary_keys:
+        cur.execute("""
+            SELECT attribute.attname
+            FROM pg_index AS index
+            JOIN pg_attribute AS attribute
+                ON attribute.attrelid = index.indrelid AND attribute.attnum = ANY (index.indkey)
+            WHERE index.indrelid = %s::regclass AND index.indisprimary
+            ORDER BY array_position(index.indkey, attribute.attnum)
+        """, (table_name,))
+        _primary_keys[table_name] = tuple(name for name, in cur.fetchall())
+    return _primary_keys[table_name]
+
+# Move the SERIAL sequence of a column past the largest id of the table.
+# The sequence only moves forward: ids that transactions still in progress
+# took from it are never handed out again.
+def _advance_sequence(cur, table_name, column):
+    cur.execute("SELECT pg_get_serial_sequence(%s, %s)", (table_name, column))
+    sequence = cur.fetchone()[0]
+    cur.execute("""
+        SELECT setval(%s, MAX({1}), true) FROM {0}
+        HAVING MAX({1}) >= (SELECT CASE WHEN is_called THEN last_value + 1 ELSE last_value END FROM {2})
+    """.format(table_name, column, sequence), (sequence,))
+
+# Merge rows into a table and return the inserted, updated and skipped counts.
+# The rows are COPYed into a temporary staging table, which is never WAL-logged,
+# and applied by one INSERT ... ON CONFLICT on the primary key: the last row of
+# a key wins, a conflicting row updates the table when 'on_conflict' is
+# "update" and its values differ, and is skipped otherwise. 'columns' default
+# to every column, the SERIAL id included, so a re-import keeps its ids.
+# The primary key of a partitioned table includes order_date, so a re-imported
+# row whose date changed does not match its old row: it raises a unique
+# violation on the id index of the partition when both dates fall into the
+# same partition, and is inserted as a second row with that id otherwise.
+def merge_data(table_name, rows, on_conflict="update", copy_format="text", columns=None):
+
+    if on_conflict not in ("update", "nothing"):
+        raise ValueError("on_conflict must be 'update' or 'nothing'")
+    if columns is None:
+        columns = tuple(name for name, _ in table_columns[table_name])
+    types = dict(table_columns[table_name])
+    column_types = [types[column] for column in columns]
+
+    # Item rows take the order_date of their order next to a partitioned 'orders'
+    source = ["staging." + column for column in columns]
+    join = ""
+    targets = list(columns)
+    if table_name == "order_foods" and "order_date" not in columns and "orders" in partitioned_tables():
+        source.append("orders.order_date")
+        join = "LEFT JOIN orders ON orders.id = staging.order_id"
+        targets.append("order_date")
+
+    staging = "{0}_merge".format(table_name)
+    counter = [0]
+    start = time.perf_counter()
+
+    call = instrument("merge", table_name)
     try:
-        # Read database configuration
-        params = config()
+        with call:
+            with get_connection(call=call) as conn:
+                cur = conn.cursor()
+                with call.phase("execute"):
+                    cur.execute("CREATE TEMP TABLE {0} ({1}, merge_row BIGSERIAL) ON COMMIT DROP".format(
+                        staging, ", ".join("{0} {1}".format(column, types[column]) for column in columns)))
+                    cur.copy_expert(
+                        "COPY {0} ({1}) FROM STDIN WITH (FORMAT {2})".format(staging, ", ".join(columns), copy_format),
+                        _ChunkStream(_copy_chunks(rows, column_types, copy_format, counter)), size=65536)
+                    cur.execute("ANALYZE {0}".format(staging))
+
+                    key = _primary_key(cur, table_name)
+                    updated_columns = [column for column in targets if column not in key]
+                    if on_conflict == "update" and updated_columns:
+                        action = "DO UPDATE SET {0} WHERE ROW({1}) IS DISTINCT FROM ROW({2})".format(
+                            ", ".join("{0} = EXCLUDED.{0}".format(column) for column in updated_columns),
+                            ", ".join("{0}.{1}".format(table_name, column) for column in updated_columns),
+                            ", ".join("EXCLUDED." + column for column in updated_columns))
+                    else:
+                        action = "DO NOTHING"
+
+                    # Every part of the statement sees the table as it was before it, so
+                    # 'existing' tells the updated keys from the inserted ones
+                    cur.execute("""
+                        WITH source AS (
+                            SELECT DISTINCT ON ({2}) {1}
+                            FROM (
+                                SELECT {3}, staging.merge_row FROM {4} AS staging {5}
+                            ) AS source ({1}, merge_row)
+                            ORDER BY {2}, merge_row DESC
+                        ),
+                        existing AS (
+                            SELECT {2} FROM {0} JOIN source USING ({2})
+                        ),
+                        merged AS (
+                            INSERT INTO {0} AS {0} ({1})
+                            SELECT {1} FROM source
+                            ON CONFLICT ({2}) {6}
+                            RETURNING {2}
+                        )
+                        SELECT
+                            COUNT(*) FILTER (WHERE existing.{7} IS NULL),
+                            COUNT(*) FILTER (WHERE existing.{7} IS NOT NULL)
+                        FROM merged LEFT JOIN existing USING ({2})
+                    """.format(table_name, ", ".join(targets), ", ".join(key), ", ".join(source), staging, join,
+                               action, key[0]))
+                    inserted, updated = cur.fetchone()
+
+                    # Keep the SERIAL sequence ahead of the merged ids
+                    serial = serial_columns.get(table_name)
+                    if serial in columns:
+                        _advance_sequence(cur, table_name, serial)
+
+                cur.close()
+            call.rows = inserted + updated
+    finally:
+        invalidate_cache(table_name)
 
-        # Connect to the PostgreSQL database
-        conn = psycopg2.connect(**params)
+    seconds = time.perf_counter() - start
 
-        # Create a new cursor
-        cur = conn.cursor()
+    return {
+        "rows":             counter[0],
+        "inserted":         inserted,
+        "updated":          updated,
+        "skipped":          counter[0] - inserted - updated,
+        "seconds":          seconds,
+        "rows_per_second":  counter[0] / seconds if seconds > 0 else 0.0
+    }
 
-        # Execute the INSERT statement
-        cur.executemany(sql[table_name], data_list)
+# Strings and whitespace of a query, whitespace outside strings is collapsed
+_sql_tokens = re.compile(r"('(?:[^']|'')*')|\s+")
+
+# FROM and JOIN keywords, and one table of the list following them: a name,
+# optionally schema-qualified or quoted, with an optional alias
+_sql_from = re.compile(r"\b(?:FROM|JOIN)\b", re.IGNORECASE)
+_sql_table = re.compile(r"""
+    [\s(]*(?!(?:SELECT|LATERAL|VALUES)\b)
+    (?:"?[A-Za-z_][\w$]*"?\.)?"?([A-Za-z_][\w$]*)"?
+    (?:\s+(?:AS\s+)?(?!(?:WHERE|JOIN|ON|USING|INNER|LEFT|RIGHT|FULL|CROSS|NATURAL|GROUP|ORDER|HAVING|LIMIT|OFFSET
+        |FETCH|WINDOW|UNION|EXCEPT|INTERSECT|FOR|RETURNING|SET|TABLESAMPLE)\b)[A-Za-z_][\w$]*)?
+    \s*""", re.IGNORECASE | re.VERBOSE)
+
+# Tables a query reads: every table of the comma separated lists following
+# FROM, and the table after every JOIN
+def query_tables(query):
+
+    tables = set()
+    for match in _sql_from.finditer(query):
+        position = match.end()
+        while True:
+            table = _sql_table.match(query, position)
+            if table is None:
+                break
+            tables.add(table.group(1).lower())
+            position = table.end()
+            if not query.startswith(",", position):
+                break
+            position += 1
+
+    return frozenset(tables)
+
+# Summary tables changed by the triggers of a table, and views reading it
+_derived_tables = {
+    "orders":               ("branch_revenue", "customer_revenue", "all_orders"),
+    "order_foods":          ("food_sales", "all_order_foods"),
+    "orders_archive":       ("all_orders",),
+    "order_foods_archive":  ("all_order_foods",)
+}
+
+# Collapse the whitespace of a query outside string literals
+def normalize_query(query):
+    return _sql_tokens.sub(lambda match: match.group(1) or " ", query).strip()
+
+# Approximate memory used by a list of rows
+def _rows_size(rows):
+    size = sys.getsizeof(rows)
+    for row in rows:
+        size += sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+    return size
+
+# An LRU cache of query results with a time to live and a memory cap.
+# Every entry is tagged with the tables its query reads, and invalidate()
+# evicts the entries of a table after it was written. Every invalidation
+# also moves the generation of its tables on, and clear() the generation of
+# every table: a reader takes generation() before it queries and passes it to
+# put(), which drops rows read while a write to one of their tables committed.
+class QueryCache:
+
+    def __init__(self, max_entries=256, ttl=60.0, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._generations = {}
+        self._clears = 0
+        self._lock = threading.Lock()
+
+    # Remove an entry, the caller holds the lock
+    def _remove(self, key):
+        expires, size, tables, rows = self._entries.pop(key)
+        self.bytes -= size
+        for table_name in tables:
+            keys = self._tags.get(table_name)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[table_name]
+
+    # Return the cached rows of a key, or None
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._remove(key)
+                self.evictions += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(entry[3])
+
+    # Invalidation generation of the tables, the caller holds the lock
+    def _generation(self, tables):
+        return (self._clears,) + tuple(self._generations.get(table_name, 0) for table_name in tables)
+
+    # Invalidation generation of the tables, see put()
+    def generation(self, tables):
+        with self._lock:
+            return self._generation(tables)
+
+    # Store the rows of a key, least recently used entries make room for it.
+    # With 'generation', the rows are dropped when one of the tables was
+    # invalidated since generation() returned it. 'ttl' shortens the time to live.
+    def put(self, key, rows, tables, generation=None, ttl=None):
+        size = _rows_size(rows)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if generation is not None and generation != self._generation(tables):
+                return
+            if key in self._entries:
+                self._remove(key)
+
+            while self._entries and (len(self._entries) >= self.max_entries or self.bytes + size > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+            ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+            self._entries[key] = (time.monotonic() + ttl, size, tables, list(rows))
+            self.bytes += size
+            for table_name in tables:
+                self._tags.setdefault(table_name, set()).add(key)
+
+    # Evict every entry that reads one of the tables
+    def invalidate(self, *tables):
+        with self._lock:
+            for table_name in tables:
+                self._generations[table_name] = self._generations.get(table_name, 0) + 1
+                for key in list(self._tags.get(table_name, ())):
+                    self._remove(key)
+                    self.invalidations += 1
+
+    # Evict every entry
+    def clear(self):
+        with self._lock:
+            self._clears += 1
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._tags.clear()
+            self.bytes = 0
+
+    # Counters of the cache
+    def stats(self):
+        with self._lock:
+            return {
+                "entries":          len(self._entries),
+                "bytes":            self.bytes,
+                "hits":             self.hits,
+                "misses":           self.misses,
+                "evictions":        self.evictions,
+                "invalidations":    self.invalidations
+            }
+
+# The optional result cache of execute_query(), disabled until enable_cache()
+query_cache = None
+
+# Turn on the result cache of execute_query()
+def enable_cache(max_entries=256, ttl=60.0, max_bytes=64 * 1024 * 1024):
+    global query_cache
+    query_cache = QueryCache(max_entries, ttl, max_bytes)
+    return query_cache
+
+# Turn off the result cache of execute_query()
+def disable_cache():
+    global query_cache
+    query_cache = None
+
+# Counters of the result cache, or None when it is disabled
+def cache_stats():
+    if query_cache is None:
+        return None
+    return query_cache.stats()
+
+# Evict the cached results that read the written tables or their summaries
+def invalidate_cache(*tables):
+    if query_cache is None:
+        return
+
+    written = set(tables)
+    for table_name in tables:
+        written.update(_derived_tables.get(table_name, ()))
+    query_cache.invalidate(*written)
+
+# Channel the lookup tables notify when they change
+lookup_channel = "rms_lookup"
+
+# Small tables read by every order, cached in process by enable_lookup_cache()
+lookup_tables = ("food", "employee", "salon")
+
+# Trigger that notifies 'lookup_channel' with the table name once per statement
+def lookup_commands():
+
+    commands = ["""
+        CREATE OR REPLACE FUNCTION lookup_notify() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            PERFORM pg_notify('{0}', TG_TABLE_NAME);
+            RETURN NULL;
+        END;
+        $$
+        """.format(lookup_channel)]
+
+    for table_name in lookup_tables:
+        commands.append("DROP TRIGGER IF EXISTS {0}_lookup_notify ON {0}".format(table_name))
+        commands.append("""
+        CREATE TRIGGER {0}_lookup_notify
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {0}
+            FOR EACH STATEMENT EXECUTE FUNCTION lookup_notify()
+        """.format(table_name))
+
+    return commands
+
+# Install the lookup triggers on an existing database
+def install_lookup_triggers():
 
-        # Commit the changes to the database
-        conn.commit()
+    try:
+        with get_connection() as conn:
+            cur = conn.cursor()
+            for command in lookup_commands():
+                cur.execute(command)
+            cur.close()
 
-        # Close communication with the database
-        cur.close()
+        return True
 
-    # If any exception occurred, display the error message
     except (Exception, psycopg2.DatabaseError) as error:
         print(error)
 
-    # Close the connection to the database
-    finally:
-        if conn is not None:
-            conn.close()
+# Channel new orders and items are announced on, for the live dashboard
+orders_channel = "rms_orders"
+
+# Triggers that announce every INSERT statement on 'orders' and 'order_foods'
+# as one notification per order date and branch, with the transaction id so a
+# listener can tell the changes its snapshot already holds:
+#   {"x": xid, "s": serial, "d": date, "b": branch, "n": orders, "r": revenue}
+#   {"x": xid, "s": serial, "d": date, "b": branch, "f": {food id: items}}
+# PostgreSQL folds identical notifications of a transaction into one, the
+# serial keeps two equal statements apart. The items find their branch and
+# date through their order, which an AFTER trigger sees even when the same
+# statement inserted it.
+def orders_notify_commands():
+
+    commands = ["CREATE SEQUENCE IF NOT EXISTS orders_notify_serial CYCLE", """
+        CREATE OR REPLACE FUNCTION orders_notify() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            PERFORM pg_notify('{0}', json_build_object(
+                'x', txid_current(), 's', nextval('orders_notify_serial'), 'd', order_date, 'b', branch_id,
+                'n', COUNT(*), 'r', SUM(total_cost::DOUBLE PRECISION))::TEXT)
+            FROM new_rows
+            GROUP BY order_date, branch_id;
+            RETURN NULL;
+        END;
+        $$
+        """.format(orders_channel),
 
-# Execute a query and return the result
-def execute_query(query):
+        """
+        CREATE OR REPLACE FUNCTION order_foods_notify() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            PERFORM pg_notify('{0}', json_build_object(
+                'x', txid_current(), 's', nextval('orders_notify_serial'), 'd', order_date, 'b', branch_id,
+                'f', json_object_agg(food_id, items))::TEXT)
+            FROM (
+                SELECT orders.order_date, orders.branch_id, new_rows.food_id, COUNT(*) AS items
+                FROM new_rows
+                JOIN orders ON orders.id = new_rows.order_id
+                GROUP BY 1, 2, 3
+            ) AS sold
+            GROUP BY order_date, branch_id;
+            RETURN NULL;
+        END;
+        $$
+        """.format(orders_channel)]
+
+    for table_name in ("orders", "order_foods"):
+        commands.append("DROP TRIGGER IF EXISTS {0}_notify ON {0}".format(table_name))
+        commands.append("""
+        CREATE TRIGGER {0}_notify
+            AFTER INSERT ON {0}
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION {0}_notify()
+        """.format(table_name))
+
+    return commands
+
+# Install the order notification triggers, or with 'remove' drop them.
+# They are left out of create_tables(): a transaction that notifies holds a
+# database-wide lock from its commit until the commit is flushed, so every
+# order placed while they are installed queues behind the others.
+def install_orders_notify(remove=False):
 
-    conn = None
-    rows = []
     try:
-        # Read database configuration
-        params = config()
-        # Connect to the PostgreSQL database
-        conn = psycopg2.connect(**params)
-        # Create a new cursor
-        cur = conn.cursor()
+        with get_connection() as conn:
+            cur = conn.cursor()
+            if remove:
+                for table_name in ("orders", "order_foods"):
+                    cur.execute("DROP TRIGGER IF EXISTS {0}_notify ON {0}".format(table_name))
+            else:
+                for command in orders_notify_commands():
+                    cur.execute(command)
+            cur.close()
 
-        # Execute the query
-        cur.execute(query)
-        # Fetches all rows 
-        rows = cur.fetchall()
+        return True
 
-        # Close communication with the database
-        cur.close()
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(error)
+
+# A cached row, the slots are the columns read from its table
+class _Record:
+
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return "{0}({1})".format(type(self).__name__, ", ".join(repr(getattr(self, name)) for name in self.__slots__))
+
+class Food(_Record):
+    __slots__ = ("id", "branch_id", "chef_id", "name", "type", "cost")
+
+class Employee(_Record):
+    __slots__ = ("id", "branch_id", "post")
+
+class Salon(_Record):
+    __slots__ = ("id", "capacity", "type", "floor")
+
+# Record class of every lookup table
+lookup_records = {"food": Food, "employee": Employee, "salon": Salon}
+
+lookup_log = logging.getLogger("library.lookup")
+
+# In-process copy of the lookup tables, indexed by id and by branch.
+# Every table is loaded in bulk and replaced as a whole when its trigger
+# notifies: a listener thread waits on a dedicated connection that LISTENs
+# before loading, so no change between the load and the first wait is lost.
+# Readers take the current snapshot without a lock. An id missing from the
+# snapshot is read through from the database, and while the listener is
+# disconnected every lookup is read through. Without the notify triggers of
+# lookup_commands() nothing would tell the cache about a change, so the
+# listener gives up and the cache is 'disabled'.
+class LookupCache:
+
+    def __init__(self, reconnect_delay=1.0):
+        self.reconnect_delay = reconnect_delay
+        self.fresh = False
+        self.disabled = False
+        self.reloads = 0
+        self.read_throughs = 0
+        self._rows = {table_name: {} for table_name in lookup_tables}
+        self._by_branch = {table_name: {} for table_name in ("food", "employee")}
+        self._stop = threading.Event()
+        self._ready = threading.Event()
+        self._thread = None
+
+    # Load a table in bulk and swap in its new snapshot
+    def reload(self, table_name, conn=None):
+        record = lookup_records[table_name]
+        with (nullcontext(conn) if conn is not None else get_connection()) as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT {0} FROM {1}".format(", ".join(record.__slots__), table_name))
+            rows = {row[0]: record(*row) for row in cur}
+            cur.close()
+
+        if table_name in self._by_branch:
+            by_branch = {}
+            for row in rows.values():
+                by_branch.setdefault(row.branch_id, []).append(row)
+            self._by_branch[table_name] = {branch_id: tuple(group) for branch_id, group in by_branch.items()}
+        self._rows[table_name] = rows
+        self.reloads += 1
+
+    # Drop every cached row, the next lookups read through
+    def clear(self):
+        self._rows = {table_name: {} for table_name in lookup_tables}
+        self._by_branch = {table_name: {} for table_name in self._by_branch}
+
+    # Start the listener thread and wait until the tables are loaded
+    def start(self, timeout=30.0):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._listen, name="lookup-listener", daemon=True)
+            self._thread.start()
+        self._ready.wait(timeout)
+
+    # Stop the listener thread
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.fresh = False
+
+    def _listen(self):
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(**config())
+                conn.autocommit = True
+                cur = conn.cursor()
+                cur.execute("SELECT tgname FROM pg_trigger WHERE tgname = ANY(%s)",
+                            (["{0}_lookup_notify".format(table_name) for table_name in lookup_tables],))
+                missing = set(lookup_tables) - set(row[0][:-len("_lookup_notify")] for row in cur.fetchall())
+                if missing:
+                    lookup_log.warning("lookup cache disabled, %s not notified of changes; "
+                                       "run 'manage.py install-lookup-triggers'", ", ".join(sorted(missing)))
+                    self.disabled = True
+                    self._ready.set()
+                    return
+                cur.execute("LISTEN {0}".format(lookup_channel))
+                for table_name in lookup_tables:
+                    self.reload(table_name, conn)
+                self.fresh = True
+                self._ready.set()
+
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 0.5)[0]:
+                        conn.poll()
+                        changed = {notify.payload for notify in conn.notifies if notify.payload in lookup_records}
+                        conn.notifies.clear()
+                        for table_name in changed:
+                            self.reload(table_name, conn)
+
+            except (Exception, psycopg2.DatabaseError) as error:
+                self.fresh = False
+                lookup_log.warning("lookup listener: %s", str(error).strip())
+                self._ready.set()
+                self._stop.wait(self.reconnect_delay)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    # Read one row from the database when it is not in the snapshot
+    def _read_through(self, table_name, id):
+        record = lookup_records[table_name]
+        self.read_throughs += 1
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT {0} FROM {1} WHERE id = %s".format(", ".join(record.__slots__), table_name), (id,))
+            row = cur.fetchone()
+            cur.close()
+        return record(*row) if row is not None else None
+
+    def _get(self, table_name, id):
+        row = self._rows[table_name].get(id) if self.fresh else None
+        return row if row is not None else self._read_through(table_name, id)
+
+    def food(self, id):
+        return self._get("food", id)
+
+    def employee(self, id):
+        return self._get("employee", id)
+
+    def salon(self, id):
+        return self._get("salon", id)
+
+    # Foods of a branch
+    def menu(self, branch_id):
+        return self._by_branch["food"].get(branch_id, ())
+
+    # Employees of a branch, only those with 'post' when given
+    def staff(self, branch_id, post=None):
+        staff = self._by_branch["employee"].get(branch_id, ())
+        return staff if post is None else tuple(employee for employee in staff if employee.post == post)
+
+    # Whether check_order() can answer from the snapshot, without a query
+    def holds(self, waiter, food_ids):
+        return (self.fresh and waiter in self._rows["employee"]
+                and all(food_id in self._rows["food"] for food_id in food_ids))
+
+    # Check an order the way place_order_sql does and return (branch id, total cost).
+    # Raises ValueError when the waiter is unknown or a food is outside the waiter's branch.
+    def check_order(self, waiter, food_ids):
+        employee = self.employee(waiter)
+        foods = [self.food(food_id) for food_id in food_ids]
+        if employee is None or any(food is None or food.branch_id != employee.branch_id for food in foods):
+            raise ValueError("unknown waiter {0} or a food outside the waiter's branch".format(waiter))
+        return employee.branch_id, sum(food.cost for food in foods)
+
+    def stats(self):
+        return {
+            "fresh":            self.fresh,
+            "reloads":          self.reloads,
+            "read_throughs":    self.read_throughs,
+            "rows":             {table_name: len(rows) for table_name, rows in self._rows.items()}
+        }
+
+# The process-wide lookup cache, None while it is disabled
+lookup_cache = None
+
+# Load the lookup tables and keep them fresh, place_order() then checks and
+# prices orders without a query. Returns None, and leaves the cache off, when
+# the database does not notify the changes of the lookup tables.
+def enable_lookup_cache(timeout=30.0):
+    global lookup_cache
+
+    if lookup_cache is None:
+        cache = LookupCache()
+        cache.start(timeout)
+        if cache.disabled:
+            cache.stop()
+            return None
+        lookup_cache = cache
+    return lookup_cache
+
+def disable_lookup_cache():
+    global lookup_cache
+
+    if lookup_cache is not None:
+        lookup_cache.stop()
+        lookup_cache = None
+
+# Execute a query and return the result.
+# SELECT results are served from the cache when enable_cache() was called,
+# and SELECT queries run on a replica when there is one, unless 'primary'
+# asks to read the latest writes. Errors are printed and give None, or are
+# raised with 'raise_errors'.
+def execute_query(query, params=None, primary=False, raise_errors=False):
+
+    normalized = normalize_query(query)
+    select = normalized[:6].upper() == "SELECT"
+
+    cache = query_cache
+    key = None
+    if cache is not None and select:
+        key = (normalized, repr(params))
+        rows = cache.get(key)
+        if rows is not None:
+            return rows
+        tables = query_tables(normalized)
+        generation = cache.generation(tables)
+
+    rows = []
+    try:
+        # Take a connection from the pool, timed when the metrics are enabled
+        call = instrument("query", query=query, params=params)
+        with call:
+            read_only = select and not primary
+            while True:
+                try:
+                    with get_connection(call=call, read_only=read_only) as conn:
+                        # Create a new cursor
+                        cur = conn.cursor()
+
+                        # Execute the query
+                        with call.phase("execute"):
+                            cur.execute(query, params)
+                        # Fetches all rows 
+                        with call.phase("fetch"):
+                            rows = cur.fetchall()
+
+                        # Close communication with the database
+                        cur.close()
+                    break
+                except (psycopg2.OperationalError, psycopg2.errors.ReadOnlySqlTransaction):
+                    # A replica that dropped the connection or cancelled the
+                    # query for a recovery conflict, or a SELECT that writes,
+                    # e.g. nextval() or FOR UPDATE: run it once more on the primary
+                    if not read_only:
+                        raise
+                    read_only = False
+            call.rows = len(rows)
+
+        # A replica may not have replayed a write the generation check saw,
+        # so its rows are kept no longer than the lag allowed to replicas
+        ttl = None
+        if key is not None and read_only and get_replicas():
+            ttl = routing_config()["max_lag"]
+            if ttl is None:
+                key = None
+        if key is not None:
+            cache.put(key, rows, tables, generation, ttl)
 
         return rows
 
     # If any exception occurred, display the error message
     except (Exception, psycopg2.DatabaseError) as error:
+        if raise_errors:
+            raise
         print(error)
 
-    # Close the connection to the database
-    finally:
-        if conn is not None:
-            conn.close()
+# Insert an order and its items in one statement.
+# The branch comes from the waiter, the total from the food costs, and nothing
+# is inserted when the waiter is unknown or a food belongs to another branch.
+# Parameters: customer, waiter, accountant, salon, food ids, order date, time.
+place_order_sql = """
+    WITH items AS (
+        SELECT food_id, position
+        FROM unnest($5) WITH ORDINALITY AS item (food_id, position)
+    ),
+    new_order AS (
+        INSERT INTO orders (branch_id, customer_id, waiter_id, accountant_id, salon_id,
+                            order_date, reg_time, total_cost)
+        SELECT
+            employee.branch_id, $1, $2, $3, $4,
+            COALESCE($6, CURRENT_DATE),
+            COALESCE($7, LOCALTIME(0)),
+            (SELECT COALESCE(SUM(food.cost), 0) FROM items JOIN food ON food.id = items.food_id)
+        FROM
+            employee
+        WHERE
+            employee.id = $2
+            AND NOT EXISTS (
+                SELECT 1 FROM items LEFT JOIN food ON food.id = items.food_id
+                WHERE food.id IS NULL OR food.branch_id <> employee.branch_id
+            )
+        RETURNING id, total_cost, order_date
+    ),
+    new_items AS (
+        INSERT INTO order_foods ({item_columns})
+        SELECT {item_values} FROM new_order, items ORDER BY items.position
+    )
+    SELECT id, total_cost FROM new_order
+"""
+
+# place_order_sql for an order already checked and priced by the lookup cache.
+# Extra parameters: branch id, total cost.
+place_order_cached_sql = """
+    WITH new_order AS (
+        INSERT INTO orders (branch_id, customer_id, waiter_id, accountant_id, salon_id,
+                            order_date, reg_time, total_cost)
+        VALUES ($8, $1, $2, $3, $4, COALESCE($6, CURRENT_DATE), COALESCE($7, LOCALTIME(0)), $9)
+        RETURNING id, total_cost, order_date
+    ),
+    new_items AS (
+        INSERT INTO order_foods ({item_columns})
+        SELECT {item_values}
+        FROM new_order, unnest($5) WITH ORDINALITY AS items (food_id, position)
+        ORDER BY items.position
+    )
+    SELECT id, total_cost FROM new_order
+"""
+
+# place_order_sql, or place_order_cached_sql when 'cached', for the current
+# schema. Next to a partitioned 'orders' the items carry the order_date
+# themselves: a trigger cannot see an order inserted by the same statement.
+def place_order_statement(cached=False):
+    name, template = ("place_order_cached", place_order_cached_sql) if cached else ("place_order", place_order_sql)
+
+    if "orders" in partitioned_tables():
+        return name + "_dated", template.format(
+            item_columns="order_id, food_id, order_date",
+            item_values="new_order.id, items.food_id, new_order.order_date")
+
+    return name, template.format(
+        item_columns="order_id, food_id",
+        item_values="new_order.id, items.food_id")
+
+# Parameter types of place_order_sql and place_order_cached_sql
+place_order_types = ("INTEGER", "INTEGER", "INTEGER", "INTEGER", "INTEGER[]", "DATE", "TIME")
+place_order_cached_types = place_order_types + ("INTEGER", "REAL")
+
+# Statement name, SQL, parameter types and parameters that place an order.
+# With the lookup cache enabled the order is checked and priced in process,
+# raising ValueError when it is rejected, and the statement only inserts.
+def place_order_call(customer, waiter, accountant, salon, food_ids, order_date=None, reg_time=None):
+
+    if order_date is not None:
+        order_date = _to_date(order_date)
+    params = (customer, waiter, accountant, salon, food_ids, order_date, reg_time)
+    if lookup_cache is None:
+        name, statement = place_order_statement()
+        return name, statement, place_order_types, params
+
+    branch_id, total_cost = lookup_cache.check_order(waiter, food_ids)
+    name, statement = place_order_statement(cached=True)
+    return name, statement, place_order_cached_types, params + (branch_id, total_cost)
+
+# Statements prepared on every pooled connection
+_prepared = weakref.WeakKeyDictionary()
+
+# Execute a named prepared statement, preparing it on first use of a connection.
+# Prepared statements survive rollbacks, so PREPARE is sent on its own.
+def execute_prepared(cur, name, statement, types, params):
+
+    prepared = _prepared.setdefault(cur.connection, set())
+    if name not in prepared:
+        cur.execute("PREPARE {0} ({1}) AS {2}".format(name, ", ".join(types), statement))
+        prepared.add(name)
+
+    cur.execute("EXECUTE {0} ({1})".format(name, ", ".join(["%s"] * len(params))), params)
+
+# Place an order with its items and return (order id, total cost).
+# The whole order is one autocommitted statement, prepared once per connection,
+# so it is atomic and afterwards costs a single round trip. Raises ValueError
+# when the order is rejected.
+def place_order(customer, waiter, accountant, salon, food_ids, order_date=None, reg_time=None):
+
+    food_ids = list(food_ids)
+    if not food_ids:
+        raise ValueError("an order needs at least one food")
+
+    name, statement, types, params = place_order_call(
+        customer, waiter, accountant, salon, food_ids, order_date, reg_time)
+
+    call = instrument("place_order", "orders")
+    with call, get_connection(autocommit=True, call=call) as conn:
+        cur = conn.cursor()
+        with call.phase("execute"):
+            execute_prepared(cur, name, statement, types, params)
+            order = cur.fetchone()
+        call.rows = 1 + len(food_ids) if order is not None else 0
+        cur.close()
 
-# Initialize data for tables         
-def initialize_data():  
-    
-    print(":: Inserting sample data ...")
+    invalidate_cache("orders", "order_foods")
+
+    if order is None:
+        raise ValueError("unknown waiter {0} or a food outside the waiter's branch".format(waiter))
+
+    return order[0], order[1]
+
+# Names of the server-side cursors opened by stream_query()
+_cursor_names = itertools.count(1)
+
+# Execute a query and yield its rows lazily.
+# A named server-side cursor keeps the result on the server and 'itersize' rows
+# are fetched per round trip. The cursor is closed and the connection returned
+# to the pool when the rows are exhausted or the consumer stops early.
+# The query runs on a replica when there is one, unless 'primary' is set.
+def stream_query(query, params=None, itersize=2000, primary=False):
+
+    call = instrument("stream", query=query, params=params)
+    with call, get_connection(call=call, read_only=not primary) as conn:
+        cur = conn.cursor(name="stream_query_{0}".format(next(_cursor_names)))
+        cur.itersize = itersize
+        try:
+            with call.phase("execute"):
+                cur.execute(query, params)
+            while True:
+                with call.phase("fetch"):
+                    rows = cur.fetchmany(itersize)
+                if not rows:
+                    break
+                call.rows += len(rows)
+                yield from rows
+        finally:
+            if not conn.closed:
+                cur.close()
+
+# Sort keys of the customer lookups, in the order they are preferred. A prefix
+# key is the leading columns of the index that serves it, so a page is an
+# index range scan that stops after 'limit' rows. A search by a part of the
+# name sorts the trigram matches instead; walking a prefix index in order
+# while filtering on the part would read all of it for a rare name.
+customer_orders = {
+    "phone":        ('person.phone_number COLLATE "C"', "person.id"),
+    "last_name":    ('lower(person.last_name) COLLATE "C"', 'lower(person.first_name) COLLATE "C"', "person.id"),
+    "first_name":   ('lower(person.first_name) COLLATE "C"', 'lower(person.last_name) COLLATE "C"', "person.id"),
+    "name":         ("lower(person.first_name || ' ' || person.last_name)", "person.id")
+}
+
+# Filters of the customer lookups, 'name' is served by the trigram index
+customer_filters = {
+    "phone":        'person.phone_number COLLATE "C" LIKE %s',
+    "last_name":    'lower(person.last_name) COLLATE "C" LIKE %s',
+    "first_name":   'lower(person.first_name) COLLATE "C" LIKE %s',
+    "name":         "lower(person.first_name || ' ' || person.last_name) LIKE %s"
+}
+
+# Escape the LIKE wildcards of a search text
+def _like_escape(text):
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+# Query of a customer lookup, its parameters and the number of sort key
+# columns at the end of every row, see find_customers()
+def customer_lookup_query(phone=None, first_name=None, last_name=None, name=None, limit=20, after=None):
+
+    patterns = {}
+    if phone:
+        patterns["phone"] = _like_escape(re.sub(r"[\s()-]", "", phone)) + "%"
+    if last_name:
+        patterns["last_name"] = _like_escape(last_name.strip().lower()) + "%"
+    if first_name:
+        patterns["first_name"] = _like_escape(first_name.strip().lower()) + "%"
+    if name:
+        patterns["name"] = "%" + _like_escape(" ".join(name.lower().split())) + "%"
+    if not patterns:
+        raise ValueError("search by phone, first_name, last_name or name")
+    if limit < 1:
+        raise ValueError("limit must be at least 1")
+
+    order = next(key for key in customer_orders if key in patterns)
+    keys = customer_orders[order]
+    conditions = [customer_filters[key] for key in patterns]
+    params = list(patterns.values())
+    if after is not None:
+        conditions.append("({0}) > ({1})".format(", ".join(keys), ", ".join(["%s"] * len(keys))))
+        params.extend(after)
+    params.append(limit + 1)
+
+    query = """
+        SELECT person.id, person.first_name, person.last_name, person.phone_number, {keys}
+        FROM person
+        JOIN customer ON customer.id = person.id
+        WHERE {conditions}
+        ORDER BY {keys}
+        LIMIT %s
+    """.format(keys=", ".join(keys), conditions=" AND ".join(conditions))
+
+    return query, tuple(params), len(keys)
+
+# Find customers by the prefix of their phone number, first name or last name,
+# or by a part of their full name, and return a page of at most 'limit'
+# (id, first name, last name, phone number) rows with the cursor of the next
+# page, None after the last one. The next page is the same search with
+# 'after' set to that cursor; it starts after the sort key of the last row,
+# so a deep page costs as little as the first one.
+def find_customers(phone=None, first_name=None, last_name=None, name=None, limit=20, after=None):
+
+    query, params, key_count = customer_lookup_query(phone, first_name, last_name, name, limit, after)
+    rows = execute_query(query, params, raise_errors=True)
+
+    next_after = list(rows[limit-1][-key_count:]) if len(rows) > limit else None
+    return [row[:4] for row in rows[:limit]], next_after
+
+# An order with its branch, customer and staff names and its items
+class Order(_Record):
+    __slots__ = ("id", "branch_id", "branch", "order_date", "reg_time", "salon_id",
+                 "customer_id", "customer", "waiter_id", "waiter", "accountant_id", "accountant",
+                 "total_cost", "items")
+
+# An item of an order, priced at the current cost of its food
+class OrderItem(_Record):
+    __slots__ = ("id", "food_id", "name", "type", "cost")
+
+# Orders with the names of their branch, customer and staff
+order_details_sql = """
+    SELECT orders.id, orders.branch_id, branch.name, orders.order_date, orders.reg_time, orders.salon_id,
+           orders.customer_id, customer.first_name || ' ' || customer.last_name,
+           orders.waiter_id, waiter.first_name || ' ' || waiter.last_name,
+           orders.accountant_id, accountant.first_name || ' ' || accountant.last_name,
+           orders.total_cost
+    FROM {orders} AS orders
+    JOIN branch ON branch.id = orders.branch_id
+    JOIN person AS customer ON customer.id = orders.customer_id
+    JOIN person AS waiter ON waiter.id = orders.waiter_id
+    JOIN person AS accountant ON accountant.id = orders.accountant_id
+    WHERE {conditions}
+    ORDER BY orders.order_date, orders.id
+"""
+
+# Items of a set of orders with their foods
+order_items_sql = """
+    SELECT order_foods.order_id, order_foods.id, food.id, food.name, food.type, food.cost
+    FROM {order_foods} AS order_foods
+    JOIN food ON food.id = order_foods.food_id
+    WHERE order_foods.order_id = ANY(%s){dates}
+    ORDER BY order_foods.order_id, order_foods.id
+"""
+
+# Fetch fully assembled orders, given by their ids or by a range of dates
+# ('first' and 'last', Jalali or Gregorian) of one branch or of all of them,
+# and yield them in lists of at most 'chunk_size' orders by date.
+# Whatever the number of orders, it costs one query for the orders with their
+# names, read 'chunk_size' rows at a time from a server-side cursor, and one
+# query per chunk for the items, instead of a query per order and per item.
+# The chunks are read in one REPEATABLE READ transaction, every items query
+# sees the snapshot of the orders query, so they are consistent with each
+# other. With 'archived' the archived orders are included.
+def fetch_orders(order_ids=None, first=None, last=None, branch_id=None, chunk_size=500, archived=False, primary=False):
+
+    conditions, params = [], []
+    if order_ids is not None:
+        conditions.append("orders.id = ANY(%s)")
+        params.append(sorted(set(int(order_id) for order_id in order_ids)))
+    if first is not None:
+        conditions.append("orders.order_date >= %s")
+        params.append(_to_date(first))
+    if last is not None:
+        conditions.append("orders.order_date <= %s")
+        params.append(_to_date(last))
+    if branch_id is not None:
+        conditions.append("orders.branch_id = %s")
+        params.append(int(branch_id))
+    if not conditions:
+        raise ValueError("fetch orders by their ids or by a range of dates")
+
+    names = ("all_orders", "all_order_foods") if archived else ("orders", "order_foods")
+    query = order_details_sql.format(orders=names[0], conditions=" AND ".join(conditions))
+    # A partitioned 'order_foods' is pruned to the dates of the chunk
+    dated = "order_foods" in partitioned_tables()
+    items_query = order_items_sql.format(order_foods=names[1],
+        dates=" AND order_foods.order_date BETWEEN %s AND %s" if dated else "")
+
+    call = instrument("fetch_orders", "orders")
+    with call, get_connection(call=call, read_only=not primary) as conn:
+        cur = conn.cursor(name="fetch_orders_{0}".format(next(_cursor_names)))
+        cur.itersize = chunk_size
+        items_cur = conn.cursor()
+        try:
+            with call.phase("execute"):
+                items_cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+                cur.execute(query, tuple(params))
+            while True:
+                with call.phase("fetch"):
+                    orders = [Order(*row, []) for row in cur.fetchmany(chunk_size)]
+                    if not orders:
+                        break
+                    items_params = [[order.id for order in orders]]
+                    if dated:
+                        items_params += [min(order.order_date for order in orders), max(order.order_date for order in orders)]
+                    items_cur.execute(items_query, items_params)
+                    by_id = {order.id: order for order in orders}
+                    for row in items_cur:
+                        by_id[row[0]].items.append(OrderItem(*row[1:]))
+                call.rows += len(orders)
+                yield orders
+        finally:
+            if not conn.closed:
+                items_cur.close()
+                cur.close()
+
+# Sample rows of every table, in foreign key order
+def sample_data():
+
+    data = {}
 
     # Table 'branch'
-    data_list = [
+    data["branch"] = [
         (96101,     "BestFood_1",   "Tehran",       "Varamin",      "Zeytoun",      "1390-11-05"),
         (95053,     "BestFood_2",   "Kerman",       "Sirjan",       "AhmadKafi",    "1393-08-27"),
         (94017,     "BestFood_3",   "Fars",         "Shiraz",       "SattarKhan",   "1396-10-20")
     ]
-    insert_data("branch", data_list)
-    print("   [Done] Inserting to 'branch'")
     
     # Table 'person'
-    data_list = [
+    data["person"] = [
         (13114,     "Mostafa",      "Mirzaee",      "male",         9177463827),
         (13119,     "Mahsa",        "Kazemi",       "female",       9171349865),
         (13127,     "Reza",         "Hosseini",     "male",         9178472313),
@@ -351,11 +3221,9 @@ def initialize_data():
         (99128,     "Afshin",       "Niknam",       "male",         9158719511),
         (99137,     "Negar",        "Alizadeh",     "female",       9185894115)
     ]
-    insert_data("person", data_list)
-    print("   [Done] Inserting to 'person'")
     
     # Table 'employee'
-    data_list = [
+    data["employee"] = [
         (13114,      96101,       "Manager",        "Master",       "1367-09-27",     "950",       "Tehran",     "Yes"),
         (13119,      96101,       "Waiter",         "Associate",    "1369-03-09",     "200",       "Tehran",     "Yes"),
         (13127,      96101,       "Waiter",         "Diploma",      "1371-02-14",     "200",       "Tehran",     "No"),
@@ -377,11 +3245,9 @@ def initialize_data():
         (35178,      94017,       "Chef",           "Diploma",      "1370-09-14",     "350",       "Kerman",     "No"),
         (35198,      94017,       "Accountants",    "Master",       "1371-09-02",     "500",       "Kerman",     "Yes")
     ]
-    insert_data("employee", data_list)
-    print("   [Done] Inserting to 'employee'")
 
     # Table 'customer'
-    data_list = [
+    data["customer"] = [
         (77211,),
         (77278,),
         (88154,),
@@ -389,11 +3255,9 @@ def initialize_data():
         (99137,),
         (99128,),
     ]
-    insert_data("customer", data_list)
-    print("   [Done] Inserting to 'customer'")
 
     # Table 'salon'
-    data_list = [
+    data["salon"] = [
         (101,    20,     "Class A",    1),
         (102,    50,     "Class B",    2),
         (103,    100,    "Class C",    3),
@@ -406,11 +3270,9 @@ def initialize_data():
         (302,    50,     "Class B",    2),
         (303,    100,    "Class C",    3)
     ]
-    insert_data("salon", data_list)
-    print("   [Done] Inserting to 'salon'")
 
     # Table 'orders'
-    data_list = [
+    data["orders"] = [
         (96101,    77211,    13119,    23814,    101,    "1399-11-07",    "06:05 PM",    75000),
         (96101,    77278,    13127,    23814,    102,    "1400-01-03",    "11:30 AM",    55000),
         (96101,    77211,    13127,    23814,    103,    "1400-01-03",    "04:50 PM",    40000),
@@ -422,11 +3284,9 @@ def initialize_data():
         (94017,    99128,    25877,    35198,    303,    "1400-01-02",    "09:10 PM",    15000),
         (94017,    99128,    25835,    35198,    302,    "1400-02-02",    "07:30 PM",    60000),
     ]
-    insert_data("orders", data_list)
-    print("   [Done] Inserting to 'orders'")
 
     # Table 'food'
-    data_list = [
+    data["food"] = [
         (961,      96101,    13835,    "Chelo Morgh",    "Food",        25000),
         (962,      96101,    13835,    "Chelo Kabab",    "Food",        35000),
         (963,      96101,    13877,    "Pizza",          "FastFood",    20000),
@@ -442,11 +3302,9 @@ def initialize_data():
         (943,      94017,    35178,    "Pizza",          "FastFood",    20000),
         (944,      94017,    35178,    "Hot Dog",        "FastFood",    15000),
     ]
-    insert_data("food", data_list)
-    print("   [Done] Inserting to 'food'")
 
     # Table 'order_foods'
-    data_list = [
+    data["order_foods"] = [
         (1,    961),
         (1,    962),
         (1,    964),
@@ -465,5 +3323,366 @@ def initialize_data():
         (8,    941),
         (8,    942),
     ]
-    insert_data("order_foods", data_list)
-    print("   [Done] Inserting to 'order_foods'")
\ No newline at end of file
+
+    return data
+
+# Initialize data for tables
+def initialize_data():
+
+    print(":: Inserting sample data ...")
+
+    # Orders and items are numbered from 1, which would overwrite live orders
+    # and add items to them, so they are only inserted into an empty 'orders'
+    has_orders = execute_query("SELECT EXISTS (SELECT 1 FROM orders)", primary=True, raise_errors=True)[0][0]
+    for table_name, data_list in sample_data().items():
+        if table_name in serial_columns:
+            if has_orders:
+                print("   [Done] Inserting to '{0}': skipped, 'orders' is not empty".format(table_name))
+                continue
+            data_list = [(id,) + tuple(row) for id, row in enumerate(data_list, 1)]
+        try:
+            result = merge_data(table_name, data_list)
+            print("   [Done] Inserting to '{0}': {inserted} inserted, {updated} updated, {skipped} skipped"
+                  .format(table_name, **result))
+        except (Exception, psycopg2.DatabaseError) as error:
+            print(error)
+
+# Size of a generated database at scale factor 1
+scale_sizes = {
+    "branches":             100,
+    "orders":               10000000,
+    "customers_per_branch": 1000,
+    "foods_per_branch":     20,
+    "salons_per_branch":    3
+}
+
+# Staff of every generated branch, in employee id order
+branch_staff = ("Manager",) + ("Waiter",) * 6 + ("Chef",) * 4 + ("Accountants",) * 2
+
+# Values the generated rows are picked from
+_places = (
+    ("Tehran", "Varamin"), ("Tehran", "Shemiranat"), ("Kerman", "Sirjan"), ("Kerman", "Rafsanjan"),
+    ("Fars", "Shiraz"), ("Fars", "Marvdasht"), ("Isfahan", "Kashan"), ("Khorasan", "Mashhad")
+)
+_streets = ("Zeytoun", "AhmadKafi", "SattarKhan", "Enghelab", "Azadi", "Valiasr", "Hafez", "Saadi")
+_first_names = (
+    ("Mostafa", "male"), ("Mahsa", "female"), ("Reza", "male"), ("Zohre", "female"), ("Helen", "female"),
+    ("Ahmad", "male"), ("Mahdi", "male"), ("Mohsen", "male"), ("Minoo", "female"), ("Zahra", "female"),
+    ("Mohammad", "male"), ("Ali", "male"), ("Amir", "male"), ("Shabnam", "female"), ("Golnaz", "female"),
+    ("Afshin", "male"), ("Negar", "female")
+)
+_last_names = (
+    "Mirzaee", "Kazemi", "Hosseini", "Maleki", "Salehi", "Aghhaee", "Karami", "Mohammadian",
+    "Rezazadeh", "Ahmadi", "Alizadeh", "Fattahi", "Niknam"
+)
+_degrees = ("Diploma", "Associate", "Bachelor", "Master")
+_salaries = {"Manager": 900, "Waiter": 200, "Chef": 350, "Accountants": 500}
+_dishes = (
+    ("Chelo Morgh", "Food", 25000), ("Chelo Kabab", "Food", 35000), ("Pizza", "FastFood", 20000),
+    ("Hot Dog", "FastFood", 15000), ("Ghormeh Sabzi", "Food", 30000), ("Gheymeh", "Food", 28000),
+    ("Burger", "FastFood", 18000), ("Salad", "Appetizer", 10000), ("Ash Reshteh", "Appetizer", 12000),
+    ("Doogh", "Drink", 5000)
+)
+_salon_types = (("Class A", 20), ("Class B", 50), ("Class C", 100))
+
+# Rows generated with one random number generator, every block is reproducible on its own
+_GENERATOR_BLOCK = 10000
+
+# Row counts and id layout of a generated database
+class _Scale:
+
+    def __init__(self, scale_factor):
+        self.branches = max(1, int(round(scale_sizes["branches"] * scale_factor)))
+        self.orders = max(1, int(round(scale_sizes["orders"] * scale_factor)))
+        self.staff = len(branch_staff)
+        self.employees = self.branches * self.staff
+        self.customers_per_branch = scale_sizes["customers_per_branch"]
+        self.customers = self.branches * self.customers_per_branch
+        self.foods_per_branch = scale_sizes["foods_per_branch"]
+        self.salons_per_branch = scale_sizes["salons_per_branch"]
+
+        # Offsets of every post inside the staff of a branch
+        self.posts = {}
+        for offset, post in enumerate(branch_staff):
+            self.posts.setdefault(post, []).append(offset)
+
+    # Number of rows generated for a table, 'order_foods' counts the orders its items belong to
+    def rows(self, table_name):
+        return {
+            "branch":       self.branches,
+            "person":       self.employees + self.customers,
+            "employee":     self.employees,
+            "customer":     self.customers,
+            "salon":        self.branches * self.salons_per_branch,
+            "orders":       self.orders,
+            "food":         self.branches * self.foods_per_branch,
+            "order_foods":  self.orders
+        }[table_name]
+
+    # Ids of the staff members of a branch (1-based) holding a post
+    def staff_ids(self, branch, post):
+        first = (branch - 1) * self.staff + 1
+        return [first + offset for offset in self.posts[post]]
+
+# Random number generator of one block of a table
+def _block_random(seed, table_name, block):
+    return random.Random("{0}:{1}:{2}".format(seed, table_name, block))
+
+# Random Jalali date string between two years, days stop at 28 to stay valid in every month
+def _random_date(rng, first_year, last_year):
+    return "{0:04d}-{1:02d}-{2:02d}".format(rng.randint(first_year, last_year), rng.randint(1, 12), rng.randint(1, 28))
+
+# Generate the rows of a table for indexes [start, stop)
+def _generate_rows(table_name, scale, rng, start, stop, menu):
+
+    for i in range(start, stop):
+
+        if table_name == "branch":
+            state, city = rng.choice(_places)
+            yield (i + 1, "BestFood_{0}".format(i + 1), state, city, rng.choice(_streets),
+                   _random_date(rng, 1385, 1399))
+
+        elif table_name == "person":
+            first_name, gender = rng.choice(_first_names)
+            yield (i + 1, first_name, rng.choice(_last_names), gender, str(rng.randint(9000000000, 9999999999)))
+
+        elif table_name == "employee":
+            branch = i // scale.staff + 1
+            post = branch_staff[i % scale.staff]
+            yield (i + 1, branch, post, rng.choice(_degrees), _random_date(rng, 1340, 1378),
+                   _salaries[post] + 10 * rng.randint(0, 10), rng.choice(_places)[0], rng.choice(("Yes", "No")))
+
+        elif table_name == "customer":
+            yield (scale.employees + i + 1,)
+
+        elif table_name == "salon":
+            salon_type, capacity = _salon_types[i % len(_salon_types)]
+            yield (i + 1, capacity, salon_type, i % scale.salons_per_branch + 1)
+
+        elif table_name == "food":
+            branch = i // scale.foods_per_branch + 1
+            name, food_type, cost = _dishes[i % len(_dishes)]
+            yield (i + 1, branch, rng.choice(scale.staff_ids(branch, "Chef")), name, food_type,
+                   cost + 1000 * rng.randint(-2, 2))
+
+        else:
+            # 'orders' and 'order_foods' come from the same draws, so items match their order
+            branch = rng.randint(1, scale.branches)
+            customer = scale.employees + (branch - 1) * scale.customers_per_branch \
+                + rng.randint(1, scale.customers_per_branch)
+            first_staff = (branch - 1) * scale.staff + 1
+            waiter = first_staff + rng.choice(scale.posts["Waiter"])
+            accountant = first_staff + rng.choice(scale.posts["Accountants"])
+            salon = (branch - 1) * scale.salons_per_branch + rng.randint(1, scale.salons_per_branch)
+            order_date = _random_date(rng, 1398, 1401)
+            reg_time = "{0:02d}:{1:02d}".format(rng.randint(10, 23), rng.randint(0, 59))
+            items = rng.sample(menu[branch], rng.randint(1, 4))
+
+            if table_name == "orders":
+                yield (i + 1, branch, customer, waiter, accountant, salon, order_date, reg_time,
+                       sum(cost for _, cost in items))
+            else:
+                for food_id, _ in items:
+                    yield (i + 1, food_id)
+
+# Food ids and costs of every generated branch
+def _generated_menu(seed, scale):
+    menu = {}
+    for row in generate_table("food", seed, scale=scale):
+        menu.setdefault(row[1], []).append((row[0], row[5]))
+    return menu
+
+# Stream the generated rows of one table.
+# The output depends only on seed and scale_factor; 'shard' and 'shards' select
+# every shards-th block of rows, so shards can be generated independently.
+def generate_table(table_name, seed=0, scale_factor=1.0, shard=0, shards=1, scale=None):
+
+    if scale is None:
+        scale = _Scale(scale_factor)
+
+    menu = None
+    if table_name in ("orders", "order_foods"):
+        menu = _generated_menu(seed, scale)
+
+    # Orders and their items share the random numbers of a block
+    source = "orders" if table_name == "order_foods" else table_name
+
+    total = scale.rows(table_name)
+    for block in range(shard, (total + _GENERATOR_BLOCK - 1) // _GENERATOR_BLOCK, shards):
+        rng = _block_random(seed, source, block)
+        start = block * _GENERATOR_BLOCK
+        yield from _generate_rows(table_name, scale, rng, start, min(start + _GENERATOR_BLOCK, total), menu)
+
+# Columns of the generated rows, 'orders' keeps its generated ids for 'order_foods'
+def generated_columns(table_name):
+    if table_name == "orders":
+        return tuple(name for name, _ in table_columns["orders"])
+    return copy_columns(table_name)
+
+# Stream a complete generated database as (table_name, columns, rows) in foreign key order
+def generate_data(seed=0, scale_factor=1.0):
+    scale = _Scale(scale_factor)
+    for table_name in ("branch", "person", "employee", "customer", "salon", "food", "orders", "order_foods"):
+        yield table_name, generated_columns(table_name), generate_table(table_name, seed, scale_factor, scale=scale)
+
+# Move the SERIAL sequences past the ids loaded with explicit values
+def reset_sequences():
+    with get_connection() as conn:
+        cur = conn.cursor()
+        for table_name, column in serial_columns.items():
+            _advance_sequence(cur, table_name, column)
+        cur.close()
+
+# Generate a database for a seed and scale factor and load it through COPY
+def load_generated_data(seed=0, scale_factor=1.0, copy_format="text"):
+
+    print(":: Generating data with seed {0} and scale factor {1} ...".format(seed, scale_factor))
+
+    try:
+        for table_name, columns, rows in generate_data(seed, scale_factor):
+            stats = copy_data(table_name, rows, copy_format, columns)
+            print("   [Done] Loading {0} rows to '{1}' ({2:.0f} rows/s)".format(
+                stats["rows"], table_name, stats["rows_per_second"]))
+
+        reset_sequences()
+        return True
+
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(error)
+        return False
+
+# Tables a CREATE TABLE statement creates and references
+_created_table = re.compile(r"CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)", re.IGNORECASE)
+_referenced_table = re.compile(r"REFERENCES\s+(\w+)", re.IGNORECASE)
+
+# Foreign key dependencies of every table in the schema of create_tables()
+def table_dependencies(statements=commands):
+    dependencies = {}
+    for statement in statements:
+        table_name = _created_table.search(statement).group(1)
+        dependencies[table_name] = set(_referenced_table.findall(statement)) - {table_name}
+    return dependencies
+
+# Group tables into levels, every table depends only on tables of earlier levels
+def load_levels(dependencies):
+    levels = []
+    done = set()
+    remaining = dict(dependencies)
+
+    while remaining:
+        level = sorted(table_name for table_name, parents in remaining.items() if parents <= done)
+        if not level:
+            raise ValueError("foreign keys form a cycle between {0}".format(", ".join(sorted(remaining))))
+        levels.append(level)
+        done.update(level)
+        for table_name in level:
+            del remaining[table_name]
+
+    return levels
+
+# Load one chunk of a table, called on the pool of parallel_load().
+# A task is ("rows", table, columns, rows) or ("generated", table, columns, seed, scale factor, shard, shards).
+def _load_chunk(task, copy_format):
+    if task[0] == "rows":
+        kind, table_name, columns, rows = task
+    else:
+        kind, table_name, columns, seed, scale_factor, shard, shards = task
+        rows = generate_table(table_name, seed, scale_factor, shard, shards)
+
+    return copy_data(table_name, rows, copy_format, columns)
+
+# Load tables concurrently in foreign key order.
+# 'tasks' maps every table to a list of chunks (see _load_chunk). A table
+# starts as soon as the tables it references are complete, and its chunks run
+# at the same time on 'workers' threads or processes, each with its own
+# pooled connection. Returns the rows and seconds of every table.
+def parallel_load(tasks, workers=4, executor="thread", copy_format="text"):
+
+    dependencies = table_dependencies()
+    pending = {table_name: dependencies.get(table_name, set()) & set(tasks) for table_name in tasks}
+    load_levels(pending)
+
+    if executor == "process":
+        # Spawned workers start without the connections of this process
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    else:
+        pool = ThreadPoolExecutor(max_workers=workers)
+
+    started = {}
+    running = {}
+    results = {}
+    done = set()
+
+    with pool:
+        while pending or running:
+            for table_name in [table_name for table_name, parents in pending.items() if parents <= done]:
+                del pending[table_name]
+                started[table_name] = time.perf_counter()
+                results[table_name] = {"rows": 0, "seconds": 0.0}
+                for task in tasks[table_name] or [("rows", table_name, None, [])]:
+                    running[pool.submit(_load_chunk, task, copy_format)] = table_name
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                table_name = running.pop(future)
+                results[table_name]["rows"] += future.result()["rows"]
+
+                if table_name not in running.values():
+                    results[table_name]["seconds"] = time.perf_counter() - started[table_name]
+                    done.add(table_name)
+                    print("   [Done] Loading {0} rows to '{1}' ({2:.2f}s)".format(
+                        results[table_name]["rows"], table_name, results[table_name]["seconds"]))
+
+    return results
+
+# Load the sample data of initialize_data() with parallel_load()
+def parallel_initialize_data(workers=4, executor="thread"):
+
+    print(":: Inserting sample data in parallel ...")
+
+    try:
+        # Orders and items are numbered from 1 as in initialize_data(), and
+        # only loaded into an empty 'orders'
+        has_orders = execute_query("SELECT EXISTS (SELECT 1 FROM orders)", primary=True, raise_errors=True)[0][0]
+        tasks = {}
+        for table_name, data_list in sample_data().items():
+            if table_name not in serial_columns:
+                tasks[table_name] = [("rows", table_name, None, data_list)]
+            elif has_orders:
+                print("   [Done] Loading to '{0}': skipped, 'orders' is not empty".format(table_name))
+            else:
+                columns = tuple(name for name, _ in table_columns[table_name])
+                data_list = [(id,) + tuple(row) for id, row in enumerate(data_list, 1)]
+                tasks[table_name] = [("rows", table_name, columns, data_list)]
+        parallel_load(tasks, workers, executor)
+        reset_sequences()
+        return True
+
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(error)
+        return False
+
+# Generate a database and load it with parallel_load(), large tables are
+# split into shards of about 'chunk_size' rows, at most one per worker
+def parallel_load_generated_data(seed=0, scale_factor=1.0, workers=4, executor="thread",
+                                 copy_format="text", chunk_size=100000):
+
+    print(":: Generating data with seed {0} and scale factor {1} on {2} {3} workers ...".format(
+        seed, scale_factor, workers, executor))
+
+    try:
+        scale = _Scale(scale_factor)
+        tasks = {}
+        for table_name in table_columns:
+            blocks = (scale.rows(table_name) + _GENERATOR_BLOCK - 1) // _GENERATOR_BLOCK
+            shards = max(1, min(workers, blocks, scale.rows(table_name) // chunk_size))
+            tasks[table_name] = [("generated", table_name, generated_columns(table_name), seed, scale_factor, shard, shards)
+                                 for shard in range(shards)]
+
+        parallel_load(tasks, workers, executor, copy_format)
+        reset_sequences()
+        return True
+
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(error)
+        return False
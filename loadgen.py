@@ -0,0 +1,125 @@
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+from benchmark import order_fixture, percentile
+
+# One client thread: a persistent keep-alive connection sending a weighted
+# mix of requests until 'deadline', recording the latency of each
+def client(host, port, requests, weights, deadline, seed, results):
+
+    rng = random.Random(seed)
+    latencies, errors = [], 0
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    while time.perf_counter() < deadline:
+        method, path, body = rng.choices(requests, weights)[0](rng)
+        start = time.perf_counter()
+        try:
+            conn.request(method, path, body=body, headers={"Content-Type": "application/json"})
+            response = conn.getresponse()
+            response.read()
+            if response.status >= 400:
+                errors += 1
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=30)
+            continue
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+    results.append((latencies, errors))
+
+# Request makers for each kind of traffic, taking the fixture of a branch
+def request_kinds(fixture, items):
+
+    def order(rng):
+        foods = rng.sample(fixture["foods"], min(items, len(fixture["foods"])))
+        return "POST", "/orders", json.dumps({
+            "customer":     fixture["customer"],
+            "waiter":       fixture["waiter"],
+            "accountant":   fixture["accountant"],
+            "salon":        fixture["salon"],
+            "food_ids":     [food_id for food_id, cost in foods]
+        })
+
+    def report(rng):
+        return "GET", "/reports/{0}?summary=1".format(rng.choice((2, 3, 4))), None
+
+    def health(rng):
+        return "GET", "/health", None
+
+    return {"order": order, "report": report, "health": health}
+
+# A latency for the report, "n/a" when no request succeeded
+def format_ms(value):
+    return "n/a" if value is None else "{0:.1f} ms".format(value)
+
+# Drive the service with 'threads' clients for 'duration' seconds and report
+# requests per second and the latency percentiles
+def run(host, port, threads, duration, mix, items, seed):
+
+    kinds = request_kinds(order_fixture(), items)
+    requests = [kinds[name] for name in mix]
+    weights = [mix[name] for name in mix]
+
+    results = []
+    deadline = time.perf_counter() + duration
+    start = time.perf_counter()
+    workers = [threading.Thread(target=client, args=(host, port, requests, weights, deadline, seed + number, results))
+               for number in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    seconds = time.perf_counter() - start
+
+    latencies = sorted(latency for result, errors in results for latency in result)
+    report = {
+        "threads":              threads,
+        "requests":             len(latencies),
+        "errors":               sum(errors for result, errors in results),
+        "seconds":              seconds,
+        "requests_per_second":  len(latencies) / seconds,
+        "p50_ms":               percentile(latencies, 50) * 1000 if latencies else None,
+        "p95_ms":               percentile(latencies, 95) * 1000 if latencies else None,
+        "p99_ms":               percentile(latencies, 99) * 1000 if latencies else None,
+        "max_ms":               latencies[-1] * 1000 if latencies else None
+    }
+    print(":: {threads} clients, {requests} requests, {errors} errors in {seconds:.1f}s: "
+          "{requests_per_second:.0f} req/s, p50 {0}, p95 {1}, p99 {2}, max {3}".format(
+              *(format_ms(report[key]) for key in ("p50_ms", "p95_ms", "p99_ms", "max_ms")), **report))
+    return report
+
+# Parse a mix like "order=3,report=1" into weights
+def parse_mix(text):
+
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Generate load against the HTTP service.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--threads", type=int, nargs="+", default=[8], help="client counts to run in turn")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per client count")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("order=3,report=1"),
+                        help="weighted request mix of order, report and health")
+    parser.add_argument("--items", type=int, default=3, help="foods per order")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the reports as JSON to this file")
+    args = parser.parse_args()
+
+    reports = [run(args.host, args.port, threads, args.duration, args.mix, args.items, args.seed)
+               for threads in args.threads]
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(reports, output, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,364 @@
+import argparse
+import datetime
+import json
+import multiprocessing
+import random
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import psycopg2
+import psycopg2.errors
+import psycopg2.extras
+import library as lib
+from benchmark import load_scale, percentile
+
+# Simulated waiters of every branch placing orders at the same time, to find
+# how many orders per second the schema sustains. Every waiter has its own
+# database connection, like the till of a restaurant, so the limit measured
+# is the database's and not the size of the connection pool.
+
+# Name of the simulator's connections in pg_stat_activity
+application_name = "rms-loadsim"
+
+# Insert paths a waiter can place its orders through:
+#   place_order  the single prepared statement of library.place_order()
+#   insert       an INSERT of the order and a batch of items in one transaction
+insert_paths = ("place_order", "insert")
+
+# Staff, foods with their costs, salons and customers of every branch
+def branch_fixtures():
+
+    with lib.get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT branch_id,
+                   array_agg(id ORDER BY id) FILTER (WHERE post = 'Waiter'),
+                   array_agg(id ORDER BY id) FILTER (WHERE post = 'Accountants')
+            FROM employee
+            GROUP BY branch_id
+            ORDER BY branch_id
+        """)
+        staff = cur.fetchall()
+        cur.execute("SELECT branch_id, array_agg(ARRAY[id, cost] ORDER BY id) FROM food GROUP BY branch_id")
+        foods = dict(cur.fetchall())
+        cur.execute("SELECT id FROM salon ORDER BY id")
+        salons = [row[0] for row in cur.fetchall()]
+        cur.execute("SELECT id FROM customer ORDER BY id")
+        customers = [row[0] for row in cur.fetchall()]
+        cur.close()
+
+    return [
+        {
+            "branch_id":    branch_id,
+            "waiters":      waiters,
+            "accountants":  accountants,
+            "foods":        [(int(food_id), cost) for food_id, cost in foods[branch_id]],
+            "salons":       salons,
+            "customers":    customers
+        }
+        for branch_id, waiters, accountants in staff
+        if waiters and accountants and branch_id in foods
+    ]
+
+# Place one order through the 'insert' path and return its id
+def _insert_order(conn, cur, fixture, waiter_id, order, order_date, reg_time):
+
+    customer, accountant, salon, foods = order
+    cur.execute(lib.insert_statement("orders") + " RETURNING id", (
+        fixture["branch_id"], customer, waiter_id, accountant, salon, order_date, reg_time,
+        sum(cost for food_id, cost in foods)))
+    order_id = cur.fetchone()[0]
+    psycopg2.extras.execute_batch(cur, lib.insert_statement("order_foods"),
+                                  [(order_id, food_id) for food_id, cost in foods])
+    conn.commit()
+    return order_id
+
+# Place one order through the 'place_order' path and return its id
+def _place_order(conn, cur, fixture, waiter_id, order, order_date, reg_time):
+
+    customer, accountant, salon, foods = order
+    name, statement, types, params = lib.place_order_call(
+        customer, waiter_id, accountant, salon, [food_id for food_id, cost in foods], order_date, reg_time)
+    lib.execute_prepared(cur, name, statement, types, params)
+    return cur.fetchone()[0]
+
+# One simulated waiter. It connects, waits at 'barrier' for the others, then
+# places orders of 'items' foods for 'duration' seconds with an exponential
+# think time of mean 'think' seconds between them. Orders that fail on a
+# deadlock or a serialization failure are retried up to 'retries' times.
+def waiter(fixture, waiter_id, path, items, think, duration, order_date, seed, retries, barrier):
+
+    rng = random.Random(seed)
+    place = _place_order if path == "place_order" else _insert_order
+    result = {"latencies": [], "items": 0, "deadlocks": 0, "serialization_failures": 0,
+              "retries": 0, "errors": {}}
+
+    try:
+        conn = psycopg2.connect(application_name=application_name, **lib.config())
+        conn.autocommit = path == "place_order"
+    except (Exception, psycopg2.DatabaseError) as error:
+        result["errors"][str(error).strip()] = 1
+        barrier.wait()
+        return result
+
+    cur = conn.cursor()
+    barrier.wait()
+    stop_at = time.monotonic() + duration
+
+    try:
+        while True:
+            if think > 0:
+                time.sleep(rng.expovariate(1.0 / think))
+            if time.monotonic() >= stop_at:
+                break
+
+            order = (rng.choice(fixture["customers"]), rng.choice(fixture["accountants"]),
+                     rng.choice(fixture["salons"]), rng.sample(fixture["foods"], min(items, len(fixture["foods"]))))
+            reg_time = datetime.datetime.now().time().replace(microsecond=0)
+
+            start = time.perf_counter()
+            for attempt in range(retries + 1):
+                try:
+                    place(conn, cur, fixture, waiter_id, order, order_date, reg_time)
+                except psycopg2.errors.TransactionRollbackError as error:
+                    conn.rollback()
+                    if isinstance(error, psycopg2.errors.DeadlockDetected):
+                        result["deadlocks"] += 1
+                    else:
+                        result["serialization_failures"] += 1
+                    if attempt < retries:
+                        result["retries"] += 1
+                        continue
+                    message = str(error).strip().splitlines()[0]
+                    result["errors"][message] = result["errors"].get(message, 0) + 1
+                except (Exception, psycopg2.DatabaseError) as error:
+                    if conn.closed:
+                        raise
+                    conn.rollback()
+                    message = str(error).strip().splitlines()[0]
+                    result["errors"][message] = result["errors"].get(message, 0) + 1
+                else:
+                    # Orders still running at the end are not counted
+                    if time.monotonic() <= stop_at:
+                        result["latencies"].append(time.perf_counter() - start)
+                        result["items"] += len(order[3])
+                break
+
+    except (Exception, psycopg2.DatabaseError) as error:
+        message = str(error).strip().splitlines()[0]
+        result["errors"][message] = result["errors"].get(message, 0) + 1
+
+    finally:
+        cur.close()
+        conn.close()
+
+    return result
+
+# Samples the active connections of the simulator in pg_stat_activity every
+# 'interval' seconds: how many are running and what they wait for
+class WaitSampler(threading.Thread):
+
+    query = """
+        SELECT wait_event_type, wait_event, COUNT(*)
+        FROM pg_stat_activity
+        WHERE application_name = %s AND state = 'active'
+        GROUP BY 1, 2
+    """
+
+    def __init__(self, interval=0.05):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.samples = 0
+        self.active = 0
+        self.events = {}
+        self._done = threading.Event()
+
+    def run(self):
+        conn = psycopg2.connect(**lib.config())
+        conn.autocommit = True
+        cur = conn.cursor()
+        try:
+            while not self._done.wait(self.interval):
+                cur.execute(self.query, (application_name,))
+                self.samples += 1
+                for wait_type, wait_event, count in cur.fetchall():
+                    self.active += count
+                    if wait_type is not None:
+                        name = "{0}:{1}".format(wait_type, wait_event)
+                        self.events[name] = self.events.get(name, 0) + count
+        finally:
+            cur.close()
+            conn.close()
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+    # Mean waiting connections and their share of the active ones, per event
+    def report(self):
+        samples = self.samples or 1
+        lock_waits = sum(count for name, count in self.events.items() if name.startswith("Lock:"))
+        return {
+            "samples":          self.samples,
+            "active_mean":      self.active / samples,
+            "lock_wait_mean":   lock_waits / samples,
+            "lock_wait_share":  lock_waits / self.active if self.active else 0.0,
+            "wait_events":      {name: count / samples for name, count in
+                                 sorted(self.events.items(), key=lambda item: -item[1])}
+        }
+
+# Deadlocks the server has detected in this database so far
+def server_deadlocks():
+    return lib.execute_query(
+        "SELECT deadlocks FROM pg_stat_database WHERE datname = current_database()", primary=True)[0][0]
+
+# Run 'waiters' simulated waiters spread over the branches for 'duration'
+# seconds on threads or processes, and report the throughput, the latency
+# percentiles, the lock waits and the deadlocks
+def simulate(fixtures, waiters, duration, path="place_order", items=3, think=0.0, executor="thread",
+             order_date=None, seed=0, retries=3):
+
+    order_date = lib._to_date(order_date) if order_date is not None else datetime.date.today()
+    # Waiter 'number' works in branch number % branches, the waiters of a branch take turns
+    staff = []
+    for number in range(waiters):
+        fixture = fixtures[number % len(fixtures)]
+        staff.append((fixture, fixture["waiters"][number // len(fixtures) % len(fixture["waiters"])]))
+
+    if executor == "process":
+        # Spawned waiters start without the connections of this process
+        context = multiprocessing.get_context("spawn")
+        manager = context.Manager()
+        barrier = manager.Barrier(waiters + 1)
+        pool = ProcessPoolExecutor(max_workers=waiters, mp_context=context)
+    else:
+        manager = None
+        barrier = threading.Barrier(waiters + 1)
+        pool = ThreadPoolExecutor(max_workers=waiters)
+
+    deadlocks_before = server_deadlocks()
+    sampler = WaitSampler()
+
+    try:
+        with pool:
+            futures = [pool.submit(waiter, fixture, waiter_id, path, items, think, duration, order_date,
+                                   seed * 100003 + number, retries, barrier)
+                       for number, (fixture, waiter_id) in enumerate(staff)]
+            barrier.wait()
+            start = time.perf_counter()
+            sampler.start()
+            results = [future.result() for future in futures]
+            seconds = max(time.perf_counter() - start, duration)
+            sampler.stop()
+    finally:
+        if manager is not None:
+            manager.shutdown()
+
+    latencies = sorted(latency for result in results for latency in result["latencies"])
+    errors = {}
+    for result in results:
+        for message, count in result["errors"].items():
+            errors[message] = errors.get(message, 0) + count
+
+    return dict({
+        "waiters":                  waiters,
+        "branches":                 len({fixture["branch_id"] for fixture, waiter_id in staff}),
+        "path":                     path,
+        "executor":                 executor,
+        "items":                    items,
+        "think_ms":                 think * 1000,
+        "seconds":                  seconds,
+        "orders":                   len(latencies),
+        "orders_per_second":        len(latencies) / duration,
+        "items_per_second":         sum(result["items"] for result in results) / duration,
+        "p50_ms":                   percentile(latencies, 50) * 1000 if latencies else None,
+        "p95_ms":                   percentile(latencies, 95) * 1000 if latencies else None,
+        "p99_ms":                   percentile(latencies, 99) * 1000 if latencies else None,
+        "max_ms":                   latencies[-1] * 1000 if latencies else None,
+        "deadlocks":                sum(result["deadlocks"] for result in results),
+        "server_deadlocks":         server_deadlocks() - deadlocks_before,
+        "serialization_failures":   sum(result["serialization_failures"] for result in results),
+        "retries":                  sum(result["retries"] for result in results),
+        "errors":                   errors
+    }, **sampler.report())
+
+# The saturation point of a concurrency sweep: the last level that still raised
+# the throughput by more than 'gain' over the level before it
+def saturation_point(reports, gain=0.1):
+
+    point = reports[0]
+    for previous, report in zip(reports, reports[1:]):
+        if report["orders_per_second"] < previous["orders_per_second"] * (1 + gain):
+            break
+        point = report
+    return point
+
+# Simulate every concurrency level in turn and report the saturation point
+def sweep(levels, duration, path="place_order", items=3, think=0.0, executor="thread",
+          order_date=None, seed=0, retries=3, gain=0.1):
+
+    fixtures = branch_fixtures()
+    if not fixtures:
+        raise RuntimeError("no branch has waiters, accountants and foods to order")
+
+    print(":: Simulating {0} waiters over {1} branches, {2} items per order through {3} on {4} workers, {5:g}s per level:".format(
+        "/".join(str(level) for level in levels), len(fixtures), items, path, executor, duration))
+
+    reports = []
+    for waiters in levels:
+        report = simulate(fixtures, waiters, duration, path, items, think, executor, order_date, seed, retries)
+        reports.append(report)
+        top_wait = next(iter(report["wait_events"].items()), None)
+        print("   {waiters:>4} waiters  {orders_per_second:8.0f} orders/s   p50 {p50:7.2f} ms   p95 {p95:7.2f} ms"
+              "   p99 {p99:7.2f} ms   lock waits {lock_wait_mean:5.2f} ({share:4.0%})   deadlocks {deadlocks}"
+              "   errors {errors}{top}".format(
+                  p50=report["p50_ms"] or 0.0, p95=report["p95_ms"] or 0.0, p99=report["p99_ms"] or 0.0,
+                  share=report["lock_wait_share"], errors=sum(report["errors"].values()),
+                  top="   top wait {0} {1:.2f}".format(*top_wait) if top_wait else "",
+                  **{key: value for key, value in report.items() if key != "errors"}))
+        for message, count in report["errors"].items():
+            print("        !! {0} x{1}".format(message, count))
+
+    point = saturation_point(reports, gain)
+    best = max(reports, key=lambda report: report["orders_per_second"])
+    print(":: Saturation at {0} waiters, {1:.0f} orders/s; the best level was {2} waiters, {3:.0f} orders/s.".format(
+        point["waiters"], point["orders_per_second"], best["waiters"], best["orders_per_second"]))
+
+    return {"levels": reports, "saturation": point["waiters"], "best": best["waiters"]}
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Simulate concurrent waiters placing orders.")
+    parser.add_argument("--waiters", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32],
+                        help="concurrency levels to sweep")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per level")
+    parser.add_argument("--path", choices=insert_paths, default="place_order", help="insert path of the orders")
+    parser.add_argument("--items", type=int, default=3, help="foods per order")
+    parser.add_argument("--think", type=float, default=0.0, help="mean think time between orders, in ms")
+    parser.add_argument("--executor", choices=("thread", "process"), default="thread",
+                        help="run the waiters on threads or processes")
+    parser.add_argument("--date", help="order date, e.g. 1401-06-01 (default: today)")
+    parser.add_argument("--retries", type=int, default=3, help="retries of an order after a deadlock")
+    parser.add_argument("--gain", type=float, default=0.1,
+                        help="throughput gain below which a level counts as saturated")
+    parser.add_argument("--scale", type=float, help="load this scale factor first")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the generated data and the orders")
+    parser.add_argument("--output", help="write the reports as JSON to this file")
+    args = parser.parse_args()
+
+    try:
+        if args.scale is not None:
+            load_scale(args.seed, args.scale)
+        result = sweep(args.waiters, args.duration, args.path, args.items, args.think / 1000.0, args.executor,
+                       args.date, args.seed, args.retries, args.gain)
+
+    except (Exception, psycopg2.DatabaseError) as error:
+        print("!! {0}".format(error))
+        exit(1)
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(result, output, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+import argparse
+import api
+import library as lib
+
+# Maintenance commands for an existing restaurant database
+def main():
+
+    parser = argparse.ArgumentParser(description="Maintenance commands of the restaurant database.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("migrate-indexes", help="build the managed indexes CONCURRENTLY")
+    commands.add_parser("rebuild-summaries", help="recompute the summary tables from the orders")
+    commands.add_parser("check-summaries", help="compare the summary tables with the orders")
+
+    partitions_parser = commands.add_parser("create-partitions", help="pre-create the upcoming order partitions")
+    partitions_parser.add_argument("--ahead", type=int, default=1, help="periods after the current one")
+    partitions_parser.add_argument("--from", dest="start", help="first date to cover, e.g. 1398-01-01")
+
+    commands.add_parser("verify-pruning", help="show the partitions each sample query scans")
+    commands.add_parser("install-lookup-triggers", help="notify the lookup caches of food, employee and salon changes")
+    notify_parser = commands.add_parser("install-orders-notify", help="announce new orders and items to the live dashboards")
+    notify_parser.add_argument("--remove", action="store_true", help="drop the triggers, orders commit without waiting")
+    commands.add_parser("check-replicas", help="show the replication lag and the reads of every replica")
+
+    archive_parser = commands.add_parser("archive", help="move old orders and their items to the archive tables")
+    archive_parser.add_argument("--before", required=True, help="archive the orders dated before, e.g. 1400-01-01")
+    archive_parser.add_argument("--batch-size", type=int, default=1000, help="orders moved per transaction")
+    archive_parser.add_argument("--pause", type=float, default=0.0, help="seconds to wait between batches")
+    archive_parser.add_argument("--lock-timeout", type=float, default=2.0,
+                                help="seconds a batch waits for a lock before it gives way")
+    archive_parser.add_argument("--max-batches", type=int, help="stop after this many batches")
+
+    commands.add_parser("archive-status", help="show the archival runs and the size of the archive")
+
+    args = parser.parse_args()
+
+    if args.command == "migrate-indexes":
+        print(":: Building indexes ...")
+        check = lib.migrate_indexes()
+
+    elif args.command == "rebuild-summaries":
+        print(":: Rebuilding summary tables ...")
+        check = lib.rebuild_summaries()
+
+    elif args.command == "check-summaries":
+        mismatches = lib.check_summaries()
+        check = mismatches is not None and not any(mismatches.values())
+        for summary, count in (mismatches or {}).items():
+            print("   {0}: {1}".format(summary, "consistent" if count == 0 else "{0} differing rows".format(count)))
+
+    elif args.command == "create-partitions":
+        print(":: Creating partitions ...")
+        created = lib.create_partitions(args.ahead, args.start)
+        print(":: {0} partition(s) created.".format(len(created)))
+        check = True
+
+    elif args.command == "verify-pruning":
+        print(":: Partitions scanned by the sample queries:")
+        for result in lib.verify_partition_pruning(api.queries):
+            print("   Query {query}: {scanned} of {partitions} '{table}' partitions{note}".format(
+                note="" if result["pruned"] else " (no pruning)", **result))
+        check = True
+
+    elif args.command == "install-lookup-triggers":
+        print(":: Installing lookup triggers ...")
+        check = lib.install_lookup_triggers()
+
+    elif args.command == "install-orders-notify":
+        print(":: {0} order notification triggers ...".format("Removing" if args.remove else "Installing"))
+        check = lib.install_orders_notify(args.remove)
+
+    elif args.command == "check-replicas":
+        max_lag = lib.routing_config()["max_lag"]
+        status = lib.replica_status()
+        if len(status) == 1:
+            print(":: No replicas in the database file, reads go to the primary.")
+        for node in status:
+            lag = "lag unknown" if node["lag"] is None else "lag {0:.3f}s".format(node["lag"])
+            state = "primary" if node["name"] == "primary" else "in rotation" if node["available"] else node.get("error") or "behind the {0}s limit".format(max_lag)
+            print("   {name:<12} {host}:{port:<6} {lag:<14} {state}".format(
+                lag=lag, state=state, name=node["name"], host=node["host"], port=node["port"] or 5432))
+        check = all(node["available"] for node in status)
+
+    elif args.command == "archive":
+        check = lib.archive_orders(args.before, args.batch_size, args.pause, args.lock_timeout, args.max_batches)
+
+    elif args.command == "archive-status":
+        status = lib.archive_status()
+        print(":: {orders} orders and {items} items archived.".format(**status))
+        for run in status["runs"]:
+            print("   before {cutoff}: {orders} orders, {items} items up to order {last_id}, {state}".format(
+                state="finished {0:%Y-%m-%d %H:%M}".format(run["finished"]) if run["finished"]
+                else "stopped {0:%Y-%m-%d %H:%M}".format(run["updated"]), **run))
+        check = True
+
+    if not check:
+        exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+import argparse
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import psycopg2
+import api
+import library as lib
+
+# A threading HTTP server that serves connections from a bounded pool of
+# workers instead of one new thread per connection. Connections beyond the
+# pool and 'backlog' waiting ones are refused with 503
+class PooledHTTPServer(ThreadingHTTPServer):
+
+    # Listen backlog, the default of 5 drops connection bursts into SYN retries
+    request_queue_size = 128
+
+    def __init__(self, address, handler, workers=None, backlog=64):
+        super().__init__(address, handler)
+        # A keep-alive connection holds its worker, so there are more workers
+        # than pooled database connections; the pool queues the database work
+        self.workers = workers or 4 * lib.pool_config()["maxconn"]
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="rms-http")
+        self.slots = threading.BoundedSemaphore(self.workers + backlog)
+
+    def process_request(self, request, client_address):
+        if not self.slots.acquire(blocking=False):
+            request.sendall(b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            self.shutdown_request(request)
+            return
+        self.executor.submit(self._serve, request, client_address)
+
+    def _serve(self, request, client_address):
+        try:
+            self.process_request_thread(request, client_address)
+        finally:
+            self.slots.release()
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+# JSON requests over HTTP/1.1 keep-alive:
+#   POST /tables/<table>   a row, or {"rows": [...]}, as a list or column mapping
+#   POST /orders           {"customer", "waiter", "accountant", "salon", "food_ids",
+#                           "order_date", "reg_time"}, the last two optional
+#   GET  /reports/<1-5>    ?summary=1 reads the summary tables where there is one,
+#                          ?archived=1 includes the archived orders
+#   GET  /customers        ?phone=, ?last_name= or ?first_name= prefixes, ?name= part,
+#                          ?limit=20 and ?after= the JSON cursor of the previous page
+#   GET  /orders           ?ids=1,2,3 or ?first=&last= dates and ?branch=, ?archived=1
+#                          includes the archived orders; one JSON order per line, chunked
+#   GET  /metrics          Prometheus text, when the library metrics are enabled
+#   GET  /health           with the state of the replicas when there are some
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+    server_version = "rms/1.0"
+    # Headers and body are written separately, Nagle would hold the body back
+    # until the client's delayed ACK
+    disable_nagle_algorithm = True
+    # Idle keep-alive connections give their worker back after this many seconds,
+    # and busy ones after this many requests so queued connections get a turn
+    timeout = 5
+    keepalive_requests = 100
+    quiet = False
+
+    def setup(self):
+        super().setup()
+        self.served = 0
+
+    def send_json(self, status, body):
+        self.send_body(status, json.dumps(body, default=str).encode(), "application/json")
+
+    def send_body(self, status, payload, content_type):
+        self.served += 1
+        self.send_response(status)
+        if self.served >= self.keepalive_requests:
+            self.send_header("Connection", "close")
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"null")
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+    def dispatch(self, routes):
+        url = urlsplit(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        route = routes.get(parts[0] if parts else "")
+        if route is None:
+            self.send_json(404, {"error": "no route for {0}".format(url.path)})
+            return
+        try:
+            route(parts[1:], parse_qs(url.query))
+        except (KeyError, IndexError, TypeError, ValueError) as error:
+            self.send_json(400, {"error": str(error)})
+        except psycopg2.IntegrityError as error:
+            self.send_json(409, {"error": str(error).strip()})
+        except (Exception, psycopg2.DatabaseError) as error:
+            self.send_json(500, {"error": str(error).strip()})
+
+    def do_GET(self):
+        self.dispatch({"reports": self.report, "customers": self.customers, "orders": self.orders,
+                       "metrics": self.metrics, "health": self.health})
+
+    def do_POST(self):
+        self.dispatch({"tables": self.insert, "orders": self.order})
+
+    def health(self, parts, params):
+        if not lib.replica_config():
+            self.send_json(200, {"status": "ok"})
+            return
+        self.send_json(200, {"status": "ok", "nodes": lib.replica_status()})
+
+    def metrics(self, parts, params):
+        if lib.metrics is None:
+            self.send_json(404, {"error": "metrics are disabled"})
+            return
+        self.send_body(200, lib.metrics_prometheus().encode(), "text/plain; version=0.0.4")
+
+    def report(self, parts, params):
+        query_number = int(parts[0])
+        if not 1 <= query_number <= len(api.queries):
+            raise ValueError("no report {0}".format(query_number))
+        query = api.report_query(query_number, params.get("summary", ["0"])[0] in ("1", "true"),
+                                 params.get("archived", ["0"])[0] in ("1", "true"))
+        rows = lib.execute_query(query, raise_errors=True)
+        self.send_json(200, {"title": api.query_titles[query_number-1], "rows": rows})
+
+    def customers(self, parts, params):
+        search = {key: params[key][0] for key in ("phone", "first_name", "last_name", "name") if key in params}
+        after = json.loads(params["after"][0]) if "after" in params else None
+        limit = int(params.get("limit", ["20"])[0])
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        rows, after = lib.find_customers(limit=min(limit, 100), after=after, **search)
+        self.send_json(200, {"customers": rows, "next": after})
+
+    def orders(self, parts, params):
+        search = {key: params[name][0] for key, name in (("first", "first"), ("last", "last"), ("branch_id", "branch"))
+                  if name in params}
+        if "ids" in params:
+            search["order_ids"] = [int(order_id) for order_id in params["ids"][0].split(",") if order_id]
+        chunks = lib.fetch_orders(archived=params.get("archived", ["0"])[0] in ("1", "true"), **search)
+        # Errors of the query itself are answered by dispatch() before the headers
+        orders = next(chunks, [])
+
+        self.served += 1
+        self.send_response(200)
+        if self.served >= self.keepalive_requests:
+            self.send_header("Connection", "close")
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            while orders:
+                payload = "".join(json.dumps(order_json(order), default=str) + "\n" for order in orders).encode()
+                self.wfile.write(b"%X\r\n%s\r\n" % (len(payload), payload))
+                orders = next(chunks, [])
+            self.wfile.write(b"0\r\n\r\n")
+        except (Exception, psycopg2.DatabaseError) as error:
+            # Too late for an error status, the unterminated body tells the client
+            self.close_connection = True
+            self.log_error("order stream stopped: %s", str(error).strip())
+        finally:
+            chunks.close()
+
+    def insert(self, parts, params):
+        table_name = parts[0]
+        if table_name not in api.tables_columns:
+            self.send_json(404, {"error": "no table '{0}'".format(table_name)})
+            return
+        body = self.read_json()
+        rows = body["rows"] if isinstance(body, dict) and "rows" in body else [body]
+        rows = [api.batch_row(table_name, row) for row in rows]
+        api.insert_rows(table_name, rows)
+        self.send_json(201, {"table": table_name, "rows": len(rows)})
+
+    def order(self, parts, params):
+        body = self.read_json()
+        order_id, total_cost = lib.place_order(
+            int(body["customer"]), int(body["waiter"]), int(body["accountant"]), int(body["salon"]),
+            [int(food_id) for food_id in body["food_ids"]], body.get("order_date"), body.get("reg_time"))
+        self.send_json(201, {"id": order_id, "total_cost": total_cost})
+
+# An order of lib.fetch_orders() as a JSON object
+def order_json(order):
+    body = {name: getattr(order, name) for name in order.__slots__}
+    body["items"] = [{name: getattr(item, name) for name in item.__slots__} for item in order.items]
+    return body
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Serve the restaurant database over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, help="request workers (default: 4 x the pool's maxconn)")
+    parser.add_argument("--backlog", type=int, default=64, help="connections queued for a worker")
+    parser.add_argument("--metrics", action="store_true", help="enable the library metrics and /metrics")
+    parser.add_argument("--cache", action="store_true", help="enable the query result cache")
+    parser.add_argument("--no-lookup-cache", action="store_true",
+                        help="check and price orders in the database instead of the lookup cache")
+    parser.add_argument("--quiet", action="store_true", help="do not log every request")
+    args = parser.parse_args()
+
+    if args.metrics:
+        lib.enable_metrics()
+    if args.cache:
+        lib.enable_cache()
+    if not args.no_lookup_cache:
+        lib.enable_lookup_cache()
+    Handler.quiet = args.quiet
+
+    server = PooledHTTPServer((args.host, args.port), Handler, args.workers, args.backlog)
+    print(":: Serving on http://{0}:{1} with {2} workers.".format(args.host, args.port, server.workers))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("!! Server stopped.")
+    finally:
+        server.server_close()
+        lib.disable_lookup_cache()
+        lib.close_pool()
+
+if __name__ == '__main__':
+    main()